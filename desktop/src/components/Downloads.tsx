@@ -35,10 +35,15 @@ type HistoryItem = {
   error?: string;
   config: DownloadConfig;
   thumbnail_path?: string;
+  thumbnail_url?: string;
   // eslint-disable-next-line @typescript-eslint/no-explicit-any
   metadata?: Record<string, any>;
 };
 
+function thumbnailSrc(url: string, size: "list" | "card") {
+  return new URL(`${url}?size=${size}`, api.defaults.baseURL).toString();
+}
+
 function formatDate(iso?: string) {
   if (!iso) return "–";
   const d = new Date(iso);
@@ -198,9 +203,9 @@ function Item({ item, deleteItem, onSelect, selected }: ItemProps) {
     >
       {/* Thumbnail */}
       <div className="w-16 h-11 flex-shrink-0 rounded-lg overflow-hidden bg-gray-100 dark:bg-gray-800 flex items-center justify-center shadow-sm">
-        {item.thumbnail_path ? (
+        {item.thumbnail_url ? (
           <img
-            src={`file://${item.thumbnail_path.replace(/\\/g, "/")}`}
+            src={thumbnailSrc(item.thumbnail_url, "list")}
             alt={title}
             className="w-full h-full object-cover"
             loading="lazy"
@@ -337,11 +342,11 @@ function DetailPanel({
       </div>
 
       {/* Thumbnail */}
-      {item.thumbnail_path && (
+      {item.thumbnail_url && (
         <div className="p-3 pb-0">
           <div className="rounded-xl overflow-hidden aspect-video bg-gray-100 dark:bg-gray-800 shadow-md">
             <img
-              src={`file://${item.thumbnail_path.replace(/\\/g, "/")}`}
+              src={thumbnailSrc(item.thumbnail_url, "card")}
               alt={title}
               className="w-full h-full object-cover"
             />
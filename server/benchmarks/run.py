@@ -0,0 +1,416 @@
+"""
+Benchmarks of the server API and the download pipeline.
+
+The app runs in-process under uvicorn with the stub backend in place of
+yt-dlp, so no network, yt-dlp or ffmpeg is involved and the numbers only
+move when the server does. `--backend mock` fetches from the local mock
+media server instead, adding real HTTP transfers. From the server folder:
+
+    python -m benchmarks.run                   # run, compare with the baseline
+    python -m benchmarks.run --save-baseline   # run, store as the new baseline
+    python -m benchmarks.run --only endpoints --requests 2000
+
+The exit code is 1 when `--check` is given and a result regressed by more
+than `--tolerance` against the baseline.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import aiohttp
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# Lower is better for these suffixes, higher for everything else
+LOWER_IS_BETTER = ("_ms", "_seconds")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.results: Dict[str, Dict[str, float]] = {}
+        self.base = ""
+        self.data_dir = Path(tempfile.mkdtemp(prefix="mihari-bench-"))
+        self.session: aiohttp.ClientSession
+
+    # Setup
+
+    def load_app(self):
+        """Import the app inside a throwaway data folder, with a local backend"""
+        os.chdir(self.data_dir)
+        sys.path.insert(0, str(SERVER_DIR))
+        import main
+        from libs.backends import create_downloader
+
+        logging.getLogger().setLevel(logging.WARNING)
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access", "tortoise"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        options: Dict[str, Any] = {"file_size": self.args.file_size}
+        if self.args.backend == "mock":
+            # The same transfer time as the stub's chunks, as a bandwidth
+            duration = self.args.chunks * self.args.chunk_delay
+            options["bandwidth"] = int(self.args.file_size / duration) if duration else 0
+            options["latency"] = 0
+        else:
+            options["chunks"] = self.args.chunks
+            options["chunk_delay"] = self.args.chunk_delay
+        downloader = create_downloader(
+            self.args.backend,
+            main.get_data_path() / "bin",
+            staging_dir=main.get_data_path() / "partial",
+            governor=main.governor,
+            encoder=main.encoder,
+            tuner=main.encoder_benchmark,
+            options=options,
+        )
+        main.downloader = downloader
+        main.subscriptions.downloader = downloader
+        # Measuring the server, not the politeness limits
+        main.governor.configure(requests_per_second=0)
+        self.main = main
+
+    async def start_server(self):
+        import uvicorn
+
+        port = free_port()
+        config = uvicorn.Config(
+            self.main.app, host="127.0.0.1", port=port, log_config=None, lifespan="on"
+        )
+        self.server = uvicorn.Server(config)
+        self.server_task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            if self.server_task.done():
+                self.server_task.result()
+            await asyncio.sleep(0.05)
+        self.base = f"http://127.0.0.1:{port}/api/v1"
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.args.concurrency * 2)
+        )
+
+    async def stop_server(self):
+        await self.session.close()
+        self.server.should_exit = True
+        await self.server_task
+
+    # Helpers
+
+    async def load(
+        self, name: str, request: Callable[[int], Awaitable[int]], total: int
+    ) -> Dict[str, float]:
+        """Run `total` requests, `--concurrency` at a time, and record their latency"""
+        latencies: List[float] = []
+        errors = 0
+        counter = iter(range(total))
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started_at = time.perf_counter()
+                status = await request(i)
+                latencies.append((time.perf_counter() - started_at) * 1000)
+                if status >= 400:
+                    errors += 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started_at
+        result = {
+            "requests_per_second": round(total / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "errors": errors,
+        }
+        self.results[name] = result
+        return result
+
+    async def get(self, path: str, **params: Any) -> int:
+        async with self.session.get(self.base + path, params=params) as resp:
+            await resp.read()
+            return resp.status
+
+    async def post(self, path: str, body: Dict[str, Any]) -> int:
+        async with self.session.post(self.base + path, json=body) as resp:
+            await resp.read()
+            return resp.status
+
+    def submit(self, url: str) -> Awaitable[int]:
+        return self.post(
+            "/download/async",
+            {"url": url, "config": {"output_path": str(self.data_dir / "out")}},
+        )
+
+    async def drain(self, timeout: float = 600):
+        """Wait until no download is queued or running"""
+        from libs.Models import Downloads, Status
+        from libs.db import get_reader
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pending = await Downloads.filter(
+                status__in=[Status.QUEUED, Status.DOWNLOADING]
+            ).using_db(get_reader()).count()
+            if not pending:
+                return
+            await asyncio.sleep(0.05)
+        raise TimeoutError("Downloads did not finish in time")
+
+    async def seed_history(self, rows: int):
+        from libs.Models import Downloads, Status, utcnow
+        from libs.db import db_writer
+
+        now = utcnow()
+        await db_writer.run(
+            lambda: Downloads.bulk_create(
+                [
+                    Downloads(
+                        url=f"https://stub.local/watch?v=seed{i}",
+                        filename=f"Seed {i}.mp4",
+                        status=Status.FINISHED,
+                        user_id=0,
+                        date_started=now,
+                        date_finished=now,
+                        metadata={"title": f"Seed {i}", "uploader": "Stub"},
+                    )
+                    for i in range(rows)
+                ],
+                batch_size=500,
+            )
+        )
+
+    # Scenarios
+
+    async def bench_endpoints(self):
+        n = self.args.requests
+        await self.seed_history(self.args.history_rows)
+        await self.load("history", lambda i: self.get("/history", limit=50), n)
+        await self.load("settings", lambda i: self.get("/settings"), n)
+        # 50 distinct videos, so most lookups are served from the info cache
+        await self.load(
+            "info",
+            lambda i: self.get("/info", url=f"https://stub.local/watch?v=info{i % 50}"),
+            n,
+        )
+        await self.load(
+            "download_async",
+            lambda i: self.submit(f"https://stub.local/watch?v=async{i}"),
+            n,
+        )
+        await self.drain()
+
+    async def bench_websocket(self):
+        clients = self.args.ws_clients
+        downloads = self.args.ws_downloads
+        received = [0] * clients
+        done = asyncio.Event()
+        finished: set = set()
+
+        async def client(index: int):
+            url = self.base.replace("http", "ws") + "/ws/progress?interval=0.1"
+            async with self.session.ws_connect(url) as ws:
+                ready.set()
+                async for message in ws:
+                    event = json.loads(message.data)
+                    received[index] += 1
+                    if event.get("type") == "status" and event.get("status") == "finished":
+                        finished.add(event["download_id"])
+                        if len(finished) >= downloads:
+                            done.set()
+                    if done.is_set():
+                        return
+
+        ready = asyncio.Event()
+        tasks = [asyncio.create_task(client(i)) for i in range(clients)]
+        await ready.wait()
+        await asyncio.sleep(0.2)
+        started_at = time.perf_counter()
+        await asyncio.gather(
+            *(self.submit(f"https://stub.local/watch?v=ws{i}") for i in range(downloads))
+        )
+        await asyncio.wait_for(done.wait(), timeout=600)
+        elapsed = time.perf_counter() - started_at
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.drain()
+        self.results["websocket"] = {
+            "events_per_second": round(sum(received) / elapsed, 1),
+            "events_per_client_per_second": round(sum(received) / clients / elapsed, 1),
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    async def bench_db_writes(self):
+        from libs.metrics import DB_WRITE_SECONDS
+
+        for concurrent in self.args.downloads:
+            self.main.scheduler.configure(max_concurrent=concurrent, max_per_host=concurrent)
+            total = max(concurrent * 4, 16)
+            count_before, seconds_before = DB_WRITE_SECONDS.totals()
+            started_at = time.perf_counter()
+            await asyncio.gather(
+                *(
+                    self.submit(f"https://stub.local/watch?v=db{concurrent}-{i}")
+                    for i in range(total)
+                )
+            )
+            await self.drain()
+            elapsed = time.perf_counter() - started_at
+            count_after, seconds_after = DB_WRITE_SECONDS.totals()
+            count = count_after - count_before
+            self.results[f"db_writes_{concurrent}"] = {
+                "downloads_per_second": round(total / elapsed, 2),
+                "writes_per_second": round(count / elapsed, 1),
+                "mean_write_ms": round((seconds_after - seconds_before) / count * 1000, 3)
+                if count
+                else 0.0,
+            }
+
+    async def run(self):
+        self.load_app()
+        await self.start_server()
+        try:
+            scenarios = {
+                "endpoints": self.bench_endpoints,
+                "websocket": self.bench_websocket,
+                "db": self.bench_db_writes,
+            }
+            for name, scenario in scenarios.items():
+                if self.args.only and name not in self.args.only:
+                    continue
+                print(f"Running {name}...", flush=True)
+                await scenario()
+        finally:
+            await self.stop_server()
+
+
+def machine() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Print every result next to its baseline, return the regressions"""
+    regressions = []
+    for scenario, values in results.items():
+        print(scenario)
+        for key, value in values.items():
+            base = baseline.get(scenario, {}).get(key)
+            line = f"  {key:<32} {value:>12}"
+            if base:
+                change = (value - base) / base
+                worse = change > tolerance if key.endswith(LOWER_IS_BETTER) else change < -tolerance
+                line += f"  baseline {base:>12}  {change:+.1%}"
+                if worse and key != "errors":
+                    line += "  REGRESSION"
+                    regressions.append(f"{scenario}.{key}")
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=["endpoints", "websocket", "db"])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--history-rows", type=int, default=2000)
+    parser.add_argument("--ws-clients", type=int, default=4)
+    parser.add_argument("--ws-downloads", type=int, default=16)
+    parser.add_argument(
+        "--downloads",
+        type=lambda v: [int(n) for n in v.split(",")],
+        default=[1, 8, 32],
+        help="Concurrent download counts for the DB write benchmark",
+    )
+    parser.add_argument("--backend", choices=["stub", "mock"], default="stub")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--check", action="store_true", help="Exit with 1 on regressions")
+    parser.add_argument("--output", type=Path, help="Also write the results here")
+    args = parser.parse_args()
+    args.baseline = args.baseline.resolve()
+    if args.output:
+        args.output = args.output.resolve()
+
+    bench = Bench(args)
+    try:
+        asyncio.run(bench.run())
+    finally:
+        shutil.rmtree(bench.data_dir, ignore_errors=True)
+
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "machine": machine(),
+        "options": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("baseline", "save_baseline", "check", "output")
+        },
+        "results": bench.results,
+    }
+    baseline = {}
+    if args.baseline.exists():
+        stored = json.loads(args.baseline.read_text(encoding="utf-8"))
+        baseline = stored.get("results", {})
+        differing = [
+            key
+            for key, value in report["options"].items()
+            if key not in ("only", "tolerance") and stored.get("options", {}).get(key) != value
+        ]
+        if differing:
+            print(f"Options differ from the baseline ({', '.join(differing)}), compare with care")
+    regressions = compare(bench.results, baseline, args.tolerance)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.save_baseline:
+        if args.only and baseline:
+            # Keep the scenarios that weren't run
+            report["results"] = {**baseline, **bench.results}
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
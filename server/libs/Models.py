@@ -1,20 +1,24 @@
 import base64
+import binascii
 from enum import StrEnum, auto
 import json
 import logging
 import os
 from pathlib import Path
+import re
 import sys
-from typing import Dict, Optional, Union, Any
-import aiofiles
-import aiohttp
+from typing import Dict, Iterable, List, Optional, Tuple, Union, Any
 from asyncyt.basemodels import PlaylistConfig
 from tortoise import fields
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import Q
 from tortoise.models import Model
 from datetime import datetime, timedelta, timezone
-from tortoise.transactions import in_transaction
 import __main__
 
+from libs.db import db_writer, get_reader, sqlite_connection
+from libs.metrics import DOWNLOAD_TRANSITIONS
+
 
 from asyncyt import (
     DownloadConfig,
@@ -102,6 +106,20 @@ def utcnow():
     return datetime.now(timezone.utc)
 
 
+SPEED_PATTERN = re.compile(r"([\d.]+)\s*([KMGT]?)i?B/s", re.IGNORECASE)
+
+
+def parse_speed(speed: Union[str, float, None]) -> Optional[float]:
+    """Convert a yt-dlp speed like "3.20MiB/s" to bytes per second"""
+    if speed is None or isinstance(speed, (int, float)):
+        return speed
+    match = SPEED_PATTERN.search(speed)
+    if not match:
+        return None
+    power = " KMGT".index(match.group(2).upper() or " ")
+    return float(match.group(1)) * 1024**power
+
+
 class Status(StrEnum):
     QUEUED = auto()
     DOWNLOADING = auto()
@@ -119,7 +137,72 @@ class Priority(StrEnum):
 class DownloadType(StrEnum):
     VIDEO = auto()
     PLAYLIST = auto()
-    
+
+
+# Columns `/history` can project, in `Downloads.to_dict` order
+HISTORY_FIELDS = (
+    "id",
+    "user_id",
+    "url",
+    "filename",
+    "date_created",
+    "date_started",
+    "date_finished",
+    "status",
+    "priority",
+    "batch_id",
+    "parent_id",
+    "error",
+    "retry_count",
+    "retry_at",
+    "config",
+    "thumbnail_path",
+    "metadata",
+)
+
+
+def check_history_fields(fields: Optional[Iterable[str]]) -> List[str]:
+    """Validate a `/history` projection, all fields when none are given"""
+    selected = list(fields) if fields else list(HISTORY_FIELDS)
+    unknown = set(selected) - set(HISTORY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def thumbnail_url(id: int, thumbnail_path: Optional[str]) -> Optional[str]:
+    """Where a download's thumbnail is served, add `?size=` for a variant"""
+    return f"/api/v1/download/{id}/thumbnail" if thumbnail_path else None
+
+
+def format_history_row(row: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Shape a `.values()` row the same way `Downloads.to_dict` does"""
+    item = {}
+    for field in fields:
+        value = row[field]
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif field in ("thumbnail_path", "metadata") and not value:
+            value = None
+        item[field] = value
+        if field == "thumbnail_path":
+            item["thumbnail_url"] = thumbnail_url(row["id"], value)
+    return item
+
+
+def encode_cursor(date_created: datetime, id: int) -> str:
+    """Opaque keyset cursor pointing just after a `(date_created, id)` row"""
+    raw = json.dumps([date_created.isoformat(), id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        date_created, id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(date_created), int(id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 
 
 
@@ -139,6 +222,8 @@ class Downloads(Model):
     error = fields.TextField(null=True)
     retry_count = fields.IntField(default=0)
     max_retries = fields.IntField(default=3)
+    # Not picked from the queue before this, set while waiting to retry
+    retry_at = fields.DatetimeField(null=True)
 
     downloaded_bytes = fields.BigIntField(null=True)
     total_bytes = fields.BigIntField(null=True)
@@ -151,6 +236,9 @@ class Downloads(Model):
     thumbnail_path = fields.TextField(null=True)
 
     user_id = fields.IntField(index=True)
+    batch_id = fields.CharField(max_length=36, null=True, index=True)
+    # The playlist row an item was expanded from
+    parent_id = fields.IntField(null=True, index=True)
 
     class Meta: # type: ignore
         table = "downloads"
@@ -158,80 +246,144 @@ class Downloads(Model):
             ("status", "priority"),
             ("user_id", "status"),
             ("date_created",),
+            ("user_id", "date_created", "id"),
         ]
 
     def __str__(self):
         return str(self.filename or f"Download {self.id}")
 
-    async def start_download(self):
-        """Mark download as started"""
-        self.status = Status.DOWNLOADING
-        self.date_started = utcnow()
-        await self.save(update_fields=["status", "date_started"])
+    async def start_download(self) -> bool:
+        """Mark download as started, False if it is no longer queued"""
+        date_started = utcnow()
+        claimed = await db_writer.run(
+            lambda: Downloads.filter(id=self.id, status=Status.QUEUED).update(
+                status=Status.DOWNLOADING, date_started=date_started
+            )
+        )
+        if claimed:
+            self.status = Status.DOWNLOADING
+            self.date_started = date_started
+            DOWNLOAD_TRANSITIONS.inc(status=Status.DOWNLOADING)
+        return bool(claimed)
 
     async def set_finished(self, path: Union[str, Path]):
         """Mark download as finished with transaction safety"""
         path = Path(path)
 
-        async with in_transaction():
-            self.filename = path.name
-            self.date_finished = utcnow()
-            self.status = Status.FINISHED
-
-            await self.save()
+        self.filename = path.name
+        self.date_finished = utcnow()
+        self.status = Status.FINISHED
+        # A retried download succeeded, retry_count keeps the attempts
+        self.error = None
+        self.retry_at = None
+
+        # Progress columns are written by the progress buffer, don't clobber them
+        await db_writer.run(
+            lambda: self.save(
+                update_fields=["filename", "date_finished", "status", "error", "retry_at"]
+            )
+        )
+        DOWNLOAD_TRANSITIONS.inc(status=Status.FINISHED)
 
-    async def set_paused(self):
-        """Pause download"""
-        if not self.status in [Status.QUEUED, Status.DOWNLOADING]:
+    async def set_paused(self, downloaded_bytes: Optional[int] = None):
+        """Pause download, keeping how far it got"""
+        if self.status in [Status.QUEUED, Status.DOWNLOADING]:
             self.status = Status.PAUSED
-            await self.save(update_fields=["status"])
+            update_fields = ["status"]
+            if downloaded_bytes is not None:
+                self.downloaded_bytes = downloaded_bytes
+                update_fields.append("downloaded_bytes")
+            await db_writer.run(lambda: self.save(update_fields=update_fields))
+            DOWNLOAD_TRANSITIONS.inc(status=Status.PAUSED)
 
     async def resume_download(self):
-        """Resume paused download"""
+        """Resume paused download, the scheduler picks it up from the queue"""
         if self.status == Status.PAUSED:
-            self.status = Status.DOWNLOADING
-            await self.save(update_fields=["status"])
+            self.status = Status.QUEUED
+            await db_writer.run(lambda: self.save(update_fields=["status"]))
+            DOWNLOAD_TRANSITIONS.inc(status=Status.QUEUED)
 
     async def set_canceled(self):
         """Cancel download"""
         self.status = Status.CANCELED
         self.date_finished = utcnow()
-        await self.save(update_fields=["status", "date_finished"])
+        await db_writer.run(
+            lambda: self.save(update_fields=["status", "date_finished"])
+        )
+        DOWNLOAD_TRANSITIONS.inc(status=Status.CANCELED)
 
     async def set_failed(self, error: str):
-        """Mark download as failed with retry logic"""
-        async with in_transaction():
-            self.status = Status.FAILED
-            self.date_finished = utcnow()
-            self.error = error[:2000]
+        """Mark download as failed for good"""
+        self.status = Status.FAILED
+        self.date_finished = utcnow()
+        self.error = error[:2000]
+        self.retry_at = None
+
+        await db_writer.run(
+            lambda: self.save(
+                update_fields=["status", "date_finished", "error", "retry_at"]
+            )
+        )
+        DOWNLOAD_TRANSITIONS.inc(status=Status.FAILED)
+
+    async def set_retrying(self, error: str, delay: float):
+        """Record a failed attempt and queue the download again after `delay` seconds"""
+        self.status = Status.QUEUED
+        self.error = error[:2000]
+        self.retry_count += 1
+        self.retry_at = utcnow() + timedelta(seconds=delay)
+
+        await db_writer.run(
+            lambda: self.save(
+                update_fields=["status", "error", "retry_count", "retry_at"]
+            )
+        )
+        DOWNLOAD_TRANSITIONS.inc(status=Status.QUEUED)
+
+    async def set_deferred(self, reason: str, delay: float):
+        """Queue the download again after `delay` seconds without counting an attempt"""
+        self.status = Status.QUEUED
+        self.error = reason[:2000]
+        self.retry_at = utcnow() + timedelta(seconds=delay)
+
+        await db_writer.run(
+            lambda: self.save(update_fields=["status", "error", "retry_at"])
+        )
+        DOWNLOAD_TRANSITIONS.inc(status=Status.QUEUED)
 
-            await self.save()
+    async def finish_playlist(self, successful: int, failed: int, canceled: int):
+        """Settle a playlist once every item is done, finished if any item was"""
+        if successful:
+            self.status = Status.FINISHED
+        elif failed:
+            self.status = Status.FAILED
+        else:
+            self.status = Status.CANCELED
+        self.date_finished = utcnow()
+        self.metadata.update(
+            {
+                "total_videos": successful + failed + canceled,
+                "successful_downloads": successful,
+                "failed_downloads": failed,
+                "canceled_downloads": canceled,
+            }
+        )
+        await db_writer.run(
+            lambda: self.save(update_fields=["status", "date_finished", "metadata"])
+        )
 
     async def determine_success(
         self, response: Union[DownloadResponse, PlaylistResponse]
     ):
-        """Enhanced success determination"""
+        """Enhanced success determination, the thumbnail is fetched separately"""
         if isinstance(response, DownloadResponse):
             if response.success and response.filename:
-                file_path = Path(response.filename)
-                await self.set_finished(file_path)
                 if response.video_info:
-                    thumbnail = response.video_info.thumbnail
                     metadata = response.video_info.model_dump()
                     metadata.pop("formats")
                     self.metadata.update(metadata)
-                    filepath = thumbnailsPath / (str(self.id) + ".jpg")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(thumbnail) as resp:
-                            if resp.status != 200:
-                                await self.save(update_fields=["metadata"])
-                                return
-                            data = await resp.read()
-
-                    async with aiofiles.open(filepath, "wb") as f:
-                        await f.write(data)
-                    self.thumbnail_path = str(filepath.resolve())
-                    await self.save(update_fields=["thumbnail_path", "metadata"])
+                    await db_writer.run(lambda: self.save(update_fields=["metadata"]))
+                await self.set_finished(Path(response.filename))
             else:
                 await self.set_failed(response.error or "Unknown error")
 
@@ -244,32 +396,41 @@ class Downloads(Model):
                         "successful_downloads": response.successful_downloads,
                     }
                 )
-                await self.save(update_fields=["metadata"])
+                await db_writer.run(lambda: self.save(update_fields=["metadata"]))
             else:
                 await self.set_failed(response.error or "Playlist download failed")
     
     async def setInfo(self, video_info: Dict[str, Any]):
         """Set video info metadata"""
         self.metadata.update(video_info)
-        await self.save(update_fields=["metadata"])
+        await db_writer.run(lambda: self.save(update_fields=["metadata"]))
 
     @classmethod
     async def create_download(
         cls,
         url: str,
         config: Optional[DownloadConfig | PlaylistConfig] = None,
-        type: DownloadType = DownloadType.VIDEO,
+        download_type: DownloadType = DownloadType.VIDEO,
         user_id: int = 0,
         priority: Priority = Priority.NORMAL,
+        batch_id: Optional[str] = None,
+        parent_id: Optional[int] = None,
+        metadata: Optional[Dict[str, Any]] = None,
     ):
         """Enhanced download creation"""
-        return await cls.create(
-            url=url,
-            config=config.model_dump() if config else {},
-            user_id=user_id,
-            type=type,
-            priority=priority,
-            status=Status.QUEUED,
+        DOWNLOAD_TRANSITIONS.inc(status=Status.QUEUED)
+        return await db_writer.run(
+            lambda: cls.create(
+                url=url,
+                batch_id=batch_id,
+                parent_id=parent_id,
+                config=config.model_dump() if config else {},
+                metadata=metadata or {},
+                user_id=user_id,
+                download_type=download_type,
+                priority=priority,
+                status=Status.QUEUED,
+            )
         )
 
     @classmethod
@@ -286,13 +447,75 @@ class Downloads(Model):
         return result
 
     @classmethod
-    async def get_queue(cls, limit: int = 10):
+    async def get_history_page(
+        cls,
+        user_id: int = 0,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        status: Optional[Status] = None,
+        download_type: Optional[DownloadType] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Newest-first page of history using keyset pagination on `(date_created, id)`.
+        Only the requested `fields` are read from the DB, returns the rows and
+        the cursor of the next page (None on the last page).
+        """
+        selected = check_history_fields(fields)
+
+        query = cls.filter(user_id=user_id).using_db(get_reader())
+        if status:
+            query = query.filter(status=status)
+        if download_type:
+            query = query.filter(download_type=download_type)
+        if since:
+            query = query.filter(date_created__gte=since)
+        if until:
+            query = query.filter(date_created__lt=until)
+        if cursor:
+            date_created, id = decode_cursor(cursor)
+            query = query.filter(
+                Q(date_created__lt=date_created)
+                | Q(date_created=date_created, id__lt=id)
+            )
+        query = query.order_by("-date_created", "-id")
+        if limit:
+            # One extra row tells us whether there is a next page
+            query = query.limit(limit + 1)
+
+        rows = await query.values(*{*selected, "id", "date_created"})
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["date_created"], rows[-1]["id"])
+
+        return [format_history_row(row, selected) for row in rows], next_cursor
+
+    @classmethod
+    async def get_queue(
+        cls, limit: int = 10, using_db: Optional[BaseDBAsyncClient] = None
+    ):
         """Get downloads in queue ordered by priority"""
-        return (
-            await cls.filter(status=Status.QUEUED)
-            .order_by("priority", "date_created")
-            .limit(limit)
-        )
+        # Priority is stored as text, so "high" < "low" < "normal" in SQL order
+        queue = []
+        for priority in (Priority.HIGH, Priority.NORMAL, Priority.LOW):
+            if len(queue) >= limit:
+                break
+            # Playlists are expanded into their items, only those are downloaded
+            queue += (
+                await cls.filter(
+                    status=Status.QUEUED,
+                    priority=priority,
+                    download_type=DownloadType.VIDEO,
+                )
+                .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=utcnow()))
+                .order_by("date_created", "id")
+                .limit(limit - len(queue))
+                .using_db(using_db)
+            )
+        return queue
 
     @classmethod
     async def get_active_downloads(cls):
@@ -303,10 +526,12 @@ class Downloads(Model):
     async def cleanup_old_downloads(cls, days: int = 30):
         """Clean up old completed/failed downloads"""
         cutoff_date = utcnow() - timedelta(days=days)
-        return await cls.filter(
-            status__in=[Status.FINISHED, Status.FAILED, Status.CANCELED],
-            date_finished__lt=cutoff_date,
-        ).delete()
+        return await db_writer.run(
+            lambda: cls.filter(
+                status__in=[Status.FINISHED, Status.FAILED, Status.CANCELED],
+                date_finished__lt=cutoff_date,
+            ).delete()
+        )
 
     @property
     def is_active(self) -> bool:
@@ -330,9 +555,14 @@ class Downloads(Model):
             ),
             "status": self.status,
             "priority": self.priority,
+            "batch_id": self.batch_id,
+            "parent_id": self.parent_id,
             "error": self.error,
+            "retry_count": self.retry_count,
+            "retry_at": self.retry_at.isoformat() if self.retry_at else None,
             "config": self.config,
             "thumbnail_path": self.thumbnail_path if self.thumbnail_path else None,
+            "thumbnail_url": thumbnail_url(self.id, self.thumbnail_path),
             "metadata": self.metadata if self.metadata else None,
         }
 
@@ -340,23 +570,132 @@ class Downloads(Model):
         self.downloaded_bytes = progress.downloaded_bytes
         self.total_bytes = progress.total_bytes
         self.percentage = progress.percentage
-        self.speed = progress.speed
+        self.speed = parse_speed(progress.speed)
         self.eta = progress.eta
-        await self.save(
-            update_fields=[
-                "downloaded_bytes",
-                "total_bytes",
-                "percentage",
-                "speed",
-                "eta",
-            ]
+        await db_writer.run(
+            lambda: self.save(
+                update_fields=[
+                    "downloaded_bytes",
+                    "total_bytes",
+                    "percentage",
+                    "speed",
+                    "eta",
+                ]
+            )
         )
 
     async def delete(self): # type: ignore
-        await super().delete()
-        filepath = thumbnailsPath / (str(self.id) + ".jpg")
-        if filepath.exists():
-            filepath.unlink()
+        await db_writer.run(super().delete)
+
+
+class Subscriptions(Model):
+    """A playlist or channel whose new videos are downloaded as they appear"""
+
+    id = fields.IntField(pk=True)
+    url = fields.CharField(max_length=2048, index=True)
+    title = fields.CharField(max_length=512, null=True)
+    config: Dict[str, Any] = fields.JSONField(default=dict)  # type: ignore
+    # Seconds between syncs, None only syncs on demand
+    interval = fields.IntField(null=True)
+    last_synced = fields.DatetimeField(null=True)
+    error = fields.TextField(null=True)
+    date_created = fields.DatetimeField(auto_now_add=True)
+    user_id = fields.IntField(default=0, index=True)
+
+    class Meta:  # type: ignore
+        table = "subscriptions"
+
+    @property
+    def is_due(self) -> bool:
+        if self.interval is None:
+            return False
+        if self.last_synced is None:
+            return True
+        return utcnow() >= self.last_synced + timedelta(seconds=self.interval)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "title": self.title,
+            "config": self.config,
+            "interval": self.interval,
+            "last_synced": self.last_synced.isoformat() if self.last_synced else None,
+            "error": self.error,
+            "date_created": (
+                self.date_created.isoformat() if self.date_created else None
+            ),
+        }
+
+
+class SubscriptionEntries(Model):
+    """Entries of a subscription that were already queued, the index a sync diffs against"""
+
+    id = fields.IntField(pk=True)
+    subscription_id = fields.IntField(index=True)
+    entry_id = fields.CharField(max_length=256)
+    # None for entries that existed before subscribing and were skipped
+    download_id = fields.IntField(null=True)
+    date_added = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:  # type: ignore
+        table = "subscription_entries"
+        unique_together = (("subscription_id", "entry_id"),)
+
+
+class MediaEntries(Model):
+    """Finished output file of a video downloaded with a given config, the dedup index"""
+
+    id = fields.IntField(pk=True)
+    video_key = fields.CharField(max_length=2048)
+    config_hash = fields.CharField(max_length=64)
+    path = fields.TextField()
+    size = fields.BigIntField()
+    download_id = fields.IntField(null=True)
+    date_created = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:  # type: ignore
+        table = "media_index"
+        unique_together = (("video_key", "config_hash"),)
+
+
+class EncoderBenchmarks(Model):
+    """Measured throughput of one codec and preset on this machine"""
+
+    id = fields.IntField(pk=True)
+    codec = fields.CharField(max_length=64)
+    preset = fields.CharField(max_length=32)
+    width = fields.IntField()
+    height = fields.IntField()
+    frames = fields.IntField()
+    seconds = fields.FloatField(null=True)
+    fps = fields.FloatField(null=True)
+    fps_per_core = fields.FloatField(null=True)
+    cpu_count = fields.IntField()
+    # Set instead of the measurements when the encoder isn't usable here
+    error = fields.TextField(null=True)
+    date_measured = fields.DatetimeField(auto_now=True)
+
+    class Meta:  # type: ignore
+        table = "encoder_benchmarks"
+        unique_together = (("codec", "preset"),)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec,
+            "preset": self.preset,
+            "width": self.width,
+            "height": self.height,
+            "frames": self.frames,
+            "seconds": self.seconds,
+            "fps": self.fps,
+            "fps_per_core": self.fps_per_core,
+            "cpu_count": self.cpu_count,
+            "error": self.error,
+            "date_measured": (
+                self.date_measured.isoformat() if self.date_measured else None
+            ),
+        }
 
 
 class Users(Model):
@@ -380,13 +719,16 @@ class Users(Model):
         settings = self.settings.copy()
         settings[key] = value
         self.settings = settings
-        await self.save(update_fields=["settings"])
+        await db_writer.run(lambda: self.save(update_fields=["settings"]))
         return self.settings
 
 
+DB_PATH = str(get_data_path().absolute() / "Mihari.sqlite3")
+
 TORTOISE_ORM = {
     "connections": {
-        "default": f"sqlite://{str(get_data_path().absolute() / "Mihari.sqlite3")}"
+        "default": sqlite_connection(DB_PATH),
+        "reader": sqlite_connection(DB_PATH, read_only=True),
     },
     "apps": {
         "models": {
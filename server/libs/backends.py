@@ -0,0 +1,230 @@
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import importlib
+from pathlib import Path
+import re
+import tempfile
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from asyncyt import (
+    AsyncYT,
+    DownloadConfig,
+    DownloadGotCanceledError,
+    DownloadProgress,
+    VideoInfo,
+)
+from asyncyt.basemodels import PlaylistInfo, PlaylistVideoInfo
+from asyncyt.enums import ProgressStatus
+from asyncyt.utils import call_callback, get_id
+
+from libs.downloader import MihariDownloader
+from libs.governor import parse_rate
+
+# Backend name -> "module:class", imported when picked
+BACKENDS = {
+    "stub": "libs.backends:StubBackend",
+    "mock": "libs.mock_media:MockHTTPBackend",
+}
+DEFAULT_BACKEND = "yt-dlp"
+
+TEMPLATE_FIELD = re.compile(r"%\((\w+)\)s")
+
+Chunks = AsyncIterator[Tuple[bytes, int]]
+
+
+def video_id(url: str) -> str:
+    """Stable made-up id of any URL"""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:11]
+
+
+def create_downloader(
+    backend: str = DEFAULT_BACKEND,
+    *args,
+    options: Optional[Dict[str, Any]] = None,
+    **kwargs,
+) -> MihariDownloader:
+    """
+    `MihariDownloader` over the named backend. yt-dlp is AsyncYT itself,
+    the others replace what it does below the caches, staging and governor.
+    """
+    if backend == DEFAULT_BACKEND:
+        if options:
+            raise ValueError("The yt-dlp backend takes no options")
+        return MihariDownloader(*args, **kwargs)
+    if backend not in BACKENDS:
+        known = ", ".join([DEFAULT_BACKEND, *BACKENDS])
+        raise ValueError(f"Unknown downloader backend {backend!r}, expected one of {known}")
+    module, _, name = BACKENDS[backend].partition(":")
+    base = getattr(importlib.import_module(module), name)
+    downloader = type(f"Mihari{name}", (MihariDownloader, base), {})(*args, **kwargs)
+    downloader.configure_backend(**(options or {}))
+    return downloader
+
+
+class LocalBackend(AsyncYT, ABC):
+    """
+    Base of the backends that make media themselves instead of running
+    yt-dlp. Subclasses provide metadata and `media` chunks, downloads are
+    written the way yt-dlp writes them: a `.part` file in the output
+    template's folder (continued when it already exists), progress after
+    every chunk, then AsyncYT's usual finalize.
+    """
+
+    async def setup_binaries(self):
+        pass
+
+    def configure_backend(self, **options: Any):
+        for key, value in options.items():
+            if key.startswith("_") or not hasattr(self, key) or callable(getattr(self, key)):
+                raise ValueError(f"Unknown option for {type(self).__name__}: {key}")
+            setattr(self, key, value)
+
+    def backend_options(self) -> Dict[str, Any]:
+        return {}
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    def media(self, url: str, info: VideoInfo, offset: int) -> Chunks:
+        """Chunks of the file from `offset` on, each with the file's total size"""
+
+    def _output_file(self, temp_path: Path, config: DownloadConfig, info: VideoInfo) -> Path:
+        """Where yt-dlp would write, honouring an absolute `custom_filename` the same way"""
+        template = config.custom_filename or "%(title)s.%(ext)s"
+        values = {"title": info.title, "ext": "mp4", "id": video_id(info.url)}
+        name = TEMPLATE_FIELD.sub(lambda m: values.get(m.group(1), "NA"), template)
+        path = Path(name)
+        return path if path.is_absolute() else temp_path / path
+
+    async def download(self, *args, **kwargs) -> Path:
+        url, config, progress_callback, finalize = self._get_config(*args, **kwargs)
+        config = config or DownloadConfig()
+        id_ = get_id(url, config)
+        output_dir = Path(config.output_path).resolve()
+        output_dir.mkdir(parents=True, exist_ok=True)
+        temp_dir = tempfile.TemporaryDirectory(delete=False)
+        temp_path = Path(temp_dir.name)
+
+        info = await self.get_video_info(url)
+        target = self._output_file(temp_path, config, info)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part = target.with_name(target.name + ".part")
+        progress = DownloadProgress(id=id_, url=url, title=info.title)
+        # yt-dlp's --limit-rate, which the governor sets
+        rate_limit = parse_rate(config.rate_limit)
+        try:
+            with open(part, "ab") as f:
+                offset = progress.downloaded_bytes = f.tell()
+                started_at = time.monotonic()
+                async for chunk, total in self.media(url, info, offset):
+                    f.write(chunk)
+                    progress.downloaded_bytes += len(chunk)
+                    progress.total_bytes = total
+                    progress.status = ProgressStatus.DOWNLOADING
+                    progress.percentage = round(
+                        progress.downloaded_bytes / total * 100 if total else 0, 1
+                    )
+                    fetched = progress.downloaded_bytes - offset
+                    elapsed = time.monotonic() - started_at
+                    if rate_limit and fetched / rate_limit > elapsed:
+                        await asyncio.sleep(fetched / rate_limit - elapsed)
+                        elapsed = fetched / rate_limit
+                    if elapsed > 0:
+                        speed = fetched / elapsed
+                        progress.speed = f"{speed / 1024**2:.2f}MiB/s"
+                        progress.eta = int((total - progress.downloaded_bytes) / speed) if speed else 0
+                    if progress_callback:
+                        await call_callback(progress_callback, progress)
+        except asyncio.CancelledError:
+            raise DownloadGotCanceledError(id_)
+        part.replace(target)
+
+        progress.status = ProgressStatus.COMPLETED
+        progress.percentage = 100.0
+        if progress_callback:
+            await call_callback(progress_callback, progress)
+
+        if finalize:
+            moved = await self.finalize_download(temp_dir, output_dir, config)
+            if moved:
+                return moved[0]
+            raise FileNotFoundError("No output file found after processing")
+        files = [f for f in temp_path.iterdir() if f.is_file()]
+        if files:
+            return files[0]
+        raise FileNotFoundError("No output file found in temp dir")
+
+
+class StubBackend(LocalBackend):
+    """
+    No network at all: metadata is made up from the URL and a download
+    writes `file_size` zero bytes in `chunks` steps, `chunk_delay` apart.
+    """
+
+    file_size: int = 4 * 1024 * 1024
+    chunks: int = 20
+    chunk_delay: float = 0.01
+    info_latency: float = 0.02
+
+    def backend_options(self) -> Dict[str, Any]:
+        return {
+            "file_size": self.file_size,
+            "chunks": self.chunks,
+            "chunk_delay": self.chunk_delay,
+            "info_latency": self.info_latency,
+        }
+
+    def _video_info(self, url: str) -> VideoInfo:
+        return VideoInfo(
+            url=url,
+            title=f"Stub {video_id(url)}",
+            duration=60,
+            uploader="Stub",
+            thumbnail="",
+            formats=[{"format_id": "18", "ext": "mp4", "filesize": self.file_size}],
+        )
+
+    async def get_video_info(self, url: str) -> VideoInfo:
+        await asyncio.sleep(self.info_latency)
+        return self._video_info(url)
+
+    async def _search(self, query: str, max_results: int = 10) -> List[VideoInfo]:
+        await asyncio.sleep(self.info_latency)
+        return [
+            self._video_info(f"https://stub.local/watch?v={query}-{i}")
+            for i in range(max_results)
+        ]
+
+    async def get_playlist_info(
+        self, url: str, max_videos: Optional[int] = None
+    ) -> PlaylistInfo:
+        await asyncio.sleep(self.info_latency)
+        count = max_videos or 10
+        return PlaylistInfo(
+            id=video_id(url),
+            url=url,
+            title="Stub playlist",
+            entry_count=count,
+            entries=[
+                PlaylistVideoInfo(
+                    id=f"{video_id(url)}-{i}",
+                    url=f"{url.rstrip('/')}/{i}",
+                    title=f"Stub {i}",
+                    duration=60,
+                    playlist_index=i + 1,
+                )
+                for i in range(count)
+            ],
+        )
+
+    async def media(self, url: str, info: VideoInfo, offset: int) -> Chunks:
+        size = max(1, self.file_size // max(1, self.chunks))
+        chunk = b"\0" * size
+        while offset < self.file_size:
+            await asyncio.sleep(self.chunk_delay)
+            data = chunk[: min(size, self.file_size - offset)]
+            offset += len(data)
+            yield data, self.file_size
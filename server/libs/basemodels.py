@@ -1,4 +1,6 @@
-from typing import Any, Optional
+from typing import Any, List, Optional
+from asyncyt import PlaylistConfig
+from asyncyt.enums import Preset as EncodingPreset, VideoCodec
 from pydantic import BaseModel, Field
 
 
@@ -26,3 +28,25 @@ class PresetExport(BaseModel):
 
 class PresetPath(BaseModel):
     path: str = Field(description="The Path for the imported/exported Preset")
+
+
+class SubscriptionRequest(BaseModel):
+    url: str = Field(description="The Playlist or Channel URL to follow")
+    playlist_config: Optional[PlaylistConfig] = Field(
+        None, description="The Playlist Config every sync downloads with"
+    )
+    interval: Optional[int] = Field(
+        3600, ge=60, description="Seconds between syncs, null to only sync on demand"
+    )
+    download_existing: bool = Field(
+        True, description="Download the videos already in the playlist too"
+    )
+
+
+class BenchmarkRequest(BaseModel):
+    codecs: Optional[List[VideoCodec]] = Field(
+        None, description="Codecs to benchmark, libx264 and libx265 when omitted"
+    )
+    presets: Optional[List[EncodingPreset]] = Field(
+        None, description="Presets to benchmark, all but placebo when omitted"
+    )
@@ -0,0 +1,115 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from asyncyt import DownloadGotCanceledError, DownloadResponse
+
+from libs.Models import Downloads, Status
+
+
+def item_event(download: Downloads, future: asyncio.Future) -> Dict[str, Any]:
+    """Per-item event for a finished batch future"""
+    event: Dict[str, Any] = {"type": "item", "id": download.id, "url": download.url}
+    if future.cancelled():
+        event["status"] = Status.CANCELED
+        return event
+
+    error = future.exception()
+    if isinstance(error, DownloadGotCanceledError):
+        event["status"] = Status.CANCELED
+    elif error is not None:
+        event.update(status=Status.FAILED, error=str(error))
+    else:
+        response: DownloadResponse = future.result()
+        if response.success:
+            event.update(status=Status.FINISHED, filename=response.filename)
+        else:
+            event.update(status=Status.FAILED, error=response.error)
+    return event
+
+
+class BatchTracker:
+    """Collects the per-item outcomes of a batch so any number of clients can stream them"""
+
+    def __init__(
+        self,
+        batch_id: str,
+        downloads: List[Downloads],
+        on_done: Optional[Callable[[], Any]] = None,
+    ):
+        self.batch_id = batch_id
+        self.on_done = on_done
+        self.total = len(downloads)
+        self.events: List[Dict[str, Any]] = [
+            {
+                "type": "batch",
+                "batch_id": batch_id,
+                "total": self.total,
+                "items": [{"id": d.id, "url": d.url} for d in downloads],
+            }
+        ]
+        self.completed = 0
+        self._condition = asyncio.Condition()
+        if self.done:
+            # Nothing queued, an empty batch is over as soon as it exists
+            self._finish()
+
+    @property
+    def done(self) -> bool:
+        return self.completed >= self.total
+
+    def watch(self, download: Downloads, future: asyncio.Future):
+        future.add_done_callback(
+            lambda f: asyncio.create_task(self._record(item_event(download, f)))
+        )
+
+    async def _record(self, event: Dict[str, Any]):
+        async with self._condition:
+            self.completed += 1
+            self.events.append(event)
+            if self.done:
+                self._finish()
+            self._condition.notify_all()
+
+    def _finish(self):
+        self.events.append(
+            {"type": "done", "batch_id": self.batch_id, "total": self.total}
+        )
+        if self.on_done:
+            self.on_done()
+
+    async def stream(self) -> AsyncIterator[Dict[str, Any]]:
+        """Replay the events so far, then follow new ones until the batch is done"""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                return
+            async with self._condition:
+                await self._condition.wait_for(lambda: len(self.events) > index)
+
+
+class BatchRegistry:
+    """Live batches of this process, forgotten a while after they complete"""
+
+    def __init__(self, keep_for: float = 600.0):
+        self.keep_for = keep_for
+        self._batches: Dict[str, BatchTracker] = {}
+
+    def create(self, batch_id: str, downloads: List[Downloads]) -> BatchTracker:
+        if not downloads:
+            # Done before anyone could follow it, never kept
+            return BatchTracker(batch_id, downloads)
+        tracker = BatchTracker(
+            batch_id,
+            downloads,
+            on_done=lambda: asyncio.get_running_loop().call_later(
+                self.keep_for, self._batches.pop, batch_id, None
+            ),
+        )
+        self._batches[batch_id] = tracker
+        return tracker
+
+    def get(self, batch_id: str) -> Optional[BatchTracker]:
+        return self._batches.get(batch_id)
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from asyncyt.encoding import EncodingConfig
+from asyncyt.enums import Preset, VideoCodec
+
+from libs.Models import EncoderBenchmarks
+from libs.db import db_writer, get_reader
+from libs.encoder import EncodePool
+
+logger = logging.getLogger(__name__)
+
+# Software encoders that take the x264 style presets, slowest preset last
+BENCHMARK_CODECS = (VideoCodec.H264, VideoCodec.H265)
+BENCHMARK_PRESETS = tuple(preset for preset in Preset if preset != Preset.PLACEBO)
+PRESET_ORDER = list(Preset)
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def benchmark_command(
+    ffmpeg_path: str,
+    codec: str,
+    preset: str,
+    width: int,
+    height: int,
+    frame_rate: int,
+    seconds: float,
+) -> List[str]:
+    """Encode a synthetic clip with `codec` and `preset` and throw the output away"""
+    source = f"testsrc2=size={width}x{height}:rate={frame_rate}:duration={seconds}"
+    return [
+        ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-f", "lavfi", "-i", source,
+        "-c:v", codec, "-preset", preset, "-an",
+        "-f", "null", "-",
+    ]  # fmt: skip
+
+
+async def probe_video(
+    ffprobe_path: str, source: Path
+) -> Optional[Tuple[int, int, float]]:
+    """Width, height and frame rate of the first video stream of `source`"""
+    process = await asyncio.create_subprocess_exec(
+        ffprobe_path, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate",
+        "-of", "json", str(source),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )  # fmt: skip
+    stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        return None
+    try:
+        stream = json.loads(stdout)["streams"][0]
+        numerator, _, denominator = stream.get("avg_frame_rate", "0/1").partition("/")
+        frame_rate = float(numerator) / float(denominator or 1)
+        return int(stream["width"]), int(stream["height"]), frame_rate
+    except (ValueError, KeyError, IndexError, ZeroDivisionError):
+        return None
+
+
+class EncoderBenchmark:
+    """
+    Measures how fast each codec and preset encodes on this machine, then
+    predicts encode times from it. Throughput is kept as fps per core at the
+    benchmark resolution and scaled by pixel count, so one run covers every
+    resolution.
+
+    With `target_speed` set, encodes that name a codec but no preset get the
+    slowest (best compressing) preset expected to encode at least that many
+    seconds of video per second.
+    """
+
+    def __init__(
+        self,
+        encoder: EncodePool,
+        clip_seconds: float = 5.0,
+        width: int = 1280,
+        height: int = 720,
+        frame_rate: int = 30,
+    ):
+        self.encoder = encoder
+        self.clip_seconds = clip_seconds
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.target_speed: Optional[float] = None
+        self.results: Dict[Tuple[str, str], EncoderBenchmarks] = {}
+        self.total = 0
+        self.measured = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def load(self):
+        for result in await EncoderBenchmarks.all().using_db(get_reader()):
+            self.results[(result.codec, result.preset)] = result
+
+    def start(
+        self,
+        ffmpeg_path: str,
+        codecs: Optional[Iterable[str]] = None,
+        presets: Optional[Iterable[str]] = None,
+    ):
+        """Benchmark every pair of `codecs` and `presets` in the background"""
+        if self.running:
+            raise RuntimeError("A benchmark is already running")
+        pairs = [
+            (str(codec), str(preset))
+            for codec in (codecs or BENCHMARK_CODECS)
+            for preset in (presets or BENCHMARK_PRESETS)
+        ]
+        self.total = len(pairs)
+        self.measured = 0
+        self._task = asyncio.create_task(self._run(ffmpeg_path, pairs))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, ffmpeg_path: str, pairs: List[Tuple[str, str]]):
+        cores = available_cores()
+        frames = int(self.clip_seconds * self.frame_rate)
+        logger.info(f"Benchmarking {len(pairs)} encoder presets on {cores} cores")
+        for codec, preset in pairs:
+            seconds, error = await self._measure(ffmpeg_path, codec, preset)
+            fps = frames / seconds if seconds else None
+            defaults = {
+                "width": self.width,
+                "height": self.height,
+                "frames": frames,
+                "seconds": round(seconds, 3) if seconds else None,
+                "fps": round(fps, 2) if fps else None,
+                "fps_per_core": round(fps / cores, 3) if fps else None,
+                "cpu_count": cores,
+                "error": error,
+            }
+            result, _ = await db_writer.run(
+                lambda: EncoderBenchmarks.update_or_create(
+                    codec=codec, preset=preset, defaults=defaults
+                )
+            )
+            self.results[(codec, preset)] = result
+            self.measured += 1
+            if error:
+                logger.warning(f"Benchmarking {codec} {preset} failed: {error}")
+        logger.info("Encoder benchmark finished")
+
+    async def _measure(
+        self, ffmpeg_path: str, codec: str, preset: str
+    ) -> Tuple[Optional[float], Optional[str]]:
+        cmd = benchmark_command(
+            ffmpeg_path,
+            codec,
+            preset,
+            self.width,
+            self.height,
+            self.frame_rate,
+            self.clip_seconds,
+        )
+        started_at = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=sys.platform != "win32",
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        elapsed = time.monotonic() - started_at
+        if process.returncode != 0:
+            output = stderr.decode(errors="replace").strip()
+            return None, output[-2000:] or f"ffmpeg exited with code {process.returncode}"
+        return elapsed, None
+
+    def estimate_fps(
+        self, codec: str, preset: str, width: int, height: int
+    ) -> Optional[float]:
+        """
+        Expected fps of one encode at `width`x`height`, with the CPU split
+        between as many encodes as the encoder pool runs at once
+        """
+        result = self.results.get((codec, preset))
+        if result is None or not result.fps_per_core:
+            return None
+        cores = available_cores()
+        cores_per_encode = max(1.0, cores / min(self.encoder.workers, cores))
+        scale = (result.width * result.height) / max(1, width * height)
+        return result.fps_per_core * cores_per_encode * scale
+
+    def recommend(
+        self,
+        codec: str,
+        duration: float,
+        width: int,
+        height: int,
+        frame_rate: float = 30.0,
+        target_speed: Optional[float] = None,
+        max_seconds: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        The slowest preset of `codec` that encodes `duration` seconds of video
+        within `max_seconds`, or at `target_speed` times real time. The
+        fastest measured preset when none is fast enough.
+        """
+        frames = duration * frame_rate
+        if max_seconds:
+            required_fps = frames / max_seconds
+        else:
+            required_fps = frame_rate * (target_speed or self.target_speed or 1.0)
+
+        candidates = []
+        for preset in reversed(PRESET_ORDER):
+            fps = self.estimate_fps(codec, str(preset), width, height)
+            if fps:
+                candidates.append(
+                    {
+                        "preset": str(preset),
+                        "estimated_fps": round(fps, 2),
+                        "estimated_seconds": round(frames / fps, 2),
+                        "meets_target": fps >= required_fps,
+                    }
+                )
+        chosen = next((c for c in candidates if c["meets_target"]), None)
+        if chosen is None and candidates:
+            chosen = candidates[-1]
+        return {
+            "codec": codec,
+            "required_fps": round(required_fps, 2),
+            **(chosen or {"preset": None, "meets_target": False}),
+            "candidates": candidates,
+        }
+
+    async def tune(
+        self,
+        encoding: EncodingConfig,
+        ffprobe_path: str,
+        source: Path,
+        duration: float,
+    ) -> EncodingConfig:
+        """`encoding` with the recommended preset, when auto-tuning applies to it"""
+        video = encoding.video
+        if not self.target_speed or not video or not video.codec or video.preset:
+            return encoding
+        if not any(codec == str(video.codec) for codec, _ in self.results):
+            return encoding
+        stream = await probe_video(ffprobe_path, source)
+        if stream is None:
+            return encoding
+        width, height, frame_rate = stream
+        recommendation = self.recommend(
+            str(video.codec), duration, width, height, frame_rate or 30.0
+        )
+        if not recommendation["preset"]:
+            return encoding
+        logger.info(
+            f"Encoding {source.name} with preset {recommendation['preset']} "
+            f"(~{recommendation['estimated_seconds']}s)"
+        )
+        return encoding.model_copy(
+            update={
+                "video": video.model_copy(
+                    update={"preset": Preset(recommendation["preset"])}
+                )
+            }
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "measured": self.measured,
+            "total": self.total,
+            "target_speed": self.target_speed,
+            "cpu_count": available_cores(),
+            "results": [result.to_dict() for result in self.results.values()],
+        }
@@ -0,0 +1,87 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+from urllib.parse import urlparse, urlunparse
+
+from asyncyt import clean_youtube_url
+
+T = TypeVar("T")
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL so equivalent links share one cache entry"""
+    parsed = urlparse(url.strip())
+    parsed = parsed._replace(
+        scheme=parsed.scheme.lower(), netloc=parsed.netloc.lower(), fragment=""
+    )
+    return clean_youtube_url(urlunparse(parsed))
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so repeated searches share one cache entry"""
+    return " ".join(query.split()).casefold()
+
+
+class AsyncTTLCache(Generic[T]):
+    """
+    Size-bounded LRU cache with a time-to-live for the results of coroutines.
+    Concurrent misses for the same key share a single in-flight call.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data: OrderedDict[Hashable, Tuple[float, T]] = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        entry = self._data.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self._data[key]
+
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._store(key, t))
+        # Shielded so one caller giving up doesn't cancel the others
+        return await asyncio.shield(task)
+
+    def _store(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, task.result())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from libs.metrics import DB_WRITE_SECONDS
+from libs.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WRITE_CONNECTION = "default"
+READ_CONNECTION = "reader"
+
+# Applied to both connections on connect. WAL lets the reader connection see
+# the last commit while the writer works, NORMAL sync is safe under WAL and
+# skips an fsync per commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # KiB, about 64MB
+    "mmap_size": 268435456,  # 256MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    "journal_size_limit": 67108864,
+}
+
+
+def sqlite_connection(file_path: str, read_only: bool = False) -> dict:
+    credentials = {"file_path": file_path, **SQLITE_PRAGMAS}
+    if read_only:
+        credentials["query_only"] = "ON"
+    return {"engine": "tortoise.backends.sqlite", "credentials": credentials}
+
+
+def get_reader() -> BaseDBAsyncClient:
+    """Read-only connection, queries on it never wait behind the writer"""
+    return connections.get(READ_CONNECTION)
+
+
+Write = Callable[[], Awaitable[Any]]
+
+
+class DatabaseWriter:
+    """
+    Single task that applies every write to the database. Writes queued while
+    it is busy are committed together in one transaction, each in its own
+    savepoint so a failing write doesn't roll back the others.
+
+    Before `start()` (or from the writer task itself) writes run inline.
+    """
+
+    def __init__(self, max_batch: int = 128):
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue[Tuple[Write, asyncio.Future]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def run(self, write: Callable[[], Awaitable[T]]) -> T:
+        """Queue a write and wait for its result"""
+        with DB_WRITE_SECONDS.time(), tracer.child("db.write"):
+            if not self.running or asyncio.current_task() is self._task:
+                return await write()
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((write, future))
+            return await future
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Finish the queued writes, then stop"""
+        if not self._task:
+            return
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch: List[Tuple[Write, asyncio.Future]] = [await self.queue.get()]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._apply(batch)
+            except Exception as e:
+                logger.exception(e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _apply(self, batch: List[Tuple[Write, asyncio.Future]]):
+        results = []
+        async with in_transaction(WRITE_CONNECTION):
+            for write, future in batch:
+                if future.cancelled():
+                    continue
+                try:
+                    async with in_transaction(WRITE_CONNECTION):
+                        results.append((future, await write(), None))
+                except Exception as e:
+                    results.append((future, None, e))
+        # Only report results once the batch is committed
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+db_writer = DatabaseWriter()
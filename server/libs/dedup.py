@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from asyncyt import DownloadConfig, get_unique_path
+
+from libs.Models import MediaEntries
+from libs.cache import normalize_url
+from libs.db import db_writer, get_reader
+from libs.governor import get_host
+
+logger = logging.getLogger(__name__)
+
+# Config fields that change how or where a file is fetched, not what it contains
+TRANSPORT_FIELDS = {
+    "output_path",
+    "custom_filename",
+    "cookies_file",
+    "proxy",
+    "rate_limit",
+    "retries",
+    "fragment_retries",
+}
+TRANSPORT_OPTIONS = {"downloader", "limit-rate", "concurrent-fragments"}
+
+Key = Tuple[str, str]
+
+
+def video_key(url: str) -> str:
+    """Canonical id of a video, the same for every link form of it"""
+    parsed = urlparse(normalize_url(url))
+    key = get_host(parsed.geturl()) + parsed.path
+    return f"{key}?{parsed.query}" if parsed.query else key
+
+
+def config_hash(config: DownloadConfig) -> str:
+    """Hash of the parts of a config that decide what the output file contains"""
+    data = config.model_dump(mode="json", exclude=TRANSPORT_FIELDS)
+    data["custom_options"] = {
+        key: value
+        for key, value in data.get("custom_options", {}).items()
+        if key not in TRANSPORT_OPTIONS
+    }
+    raw = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(source: Path, target: Path):
+    try:
+        os.link(source, target)
+    except OSError:
+        # Another filesystem, or one without hardlinks
+        shutil.copy2(source, target)
+
+
+class MediaIndex:
+    """
+    Index of finished outputs by (video, config). A repeated download is
+    served from the existing file, and identical downloads running at the
+    same time wait for the first one instead of fetching it again.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.coalesced = 0
+        self._inflight: Dict[Key, asyncio.Future] = {}
+
+    def key(self, url: str, config: DownloadConfig) -> Key:
+        return video_key(url), config_hash(config)
+
+    async def claim(
+        self, key: Key
+    ) -> Tuple[Optional[MediaEntries], Optional[asyncio.Future]]:
+        """
+        The indexed output for `key`, or None and a token when the caller
+        has to download it and `release` the key with that token once done.
+        An identical download in progress is waited for first.
+        """
+        while (inflight := self._inflight.get(key)) is not None:
+            self.coalesced += 1
+            await asyncio.wait([inflight])
+
+        token = asyncio.get_running_loop().create_future()
+        self._inflight[key] = token
+        try:
+            entry = await self._lookup(key)
+        except BaseException:
+            self.release(key, token)
+            raise
+        if entry:
+            self.hits += 1
+            self.release(key, token)
+            return entry, None
+        return None, token
+
+    def release(self, key: Optional[Key], token: Optional[asyncio.Future]):
+        """Wake the downloads waiting on `key`, only its owner's token does"""
+        if key is None or token is None or self._inflight.get(key) is not token:
+            return
+        del self._inflight[key]
+        if not token.done():
+            token.set_result(None)
+
+    async def _lookup(self, key: Key) -> Optional[MediaEntries]:
+        entry = await MediaEntries.get_or_none(
+            video_key=key[0], config_hash=key[1], using_db=get_reader()
+        )
+        if entry is None:
+            return None
+        path = Path(entry.path)
+        if path.is_file() and path.stat().st_size == entry.size:
+            return entry
+        # Moved, deleted or changed since, no longer a copy of that download
+        await db_writer.run(entry.delete)
+        return None
+
+    async def record(self, key: Key, path: Path, download_id: int):
+        path = Path(path).resolve()
+        size = path.stat().st_size
+        await db_writer.run(
+            lambda: MediaEntries.update_or_create(
+                video_key=key[0],
+                config_hash=key[1],
+                defaults={"path": str(path), "size": size, "download_id": download_id},
+            )
+        )
+
+    async def materialize(self, entry: MediaEntries, output_path: Path) -> Path:
+        """The indexed file in `output_path`, hardlinked or copied there when it lives elsewhere"""
+        source = Path(entry.path)
+        output_path = Path(output_path).resolve()
+        if source.parent == output_path:
+            return source
+        output_path.mkdir(parents=True, exist_ok=True)
+        target = get_unique_path(output_path, source.name)
+        await asyncio.to_thread(link_or_copy, source, target)
+        return target
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,261 @@
+import asyncio
+from pathlib import Path
+import re
+import shutil
+import tempfile
+from typing import List, Optional, Union
+
+from asyncyt import AsyncYT, DownloadConfig, DownloadProgress, VideoInfo
+from asyncyt.enums import ProgressStatus
+from asyncyt.utils import call_callback, get_id, get_unique_path
+from asyncyt.basemodels import PlaylistInfo
+
+from libs.benchmark import EncoderBenchmark
+from libs.cache import AsyncTTLCache, normalize_query, normalize_url
+from libs.encoder import EncodePool, needs_encoding
+from libs.governor import HostGovernor, get_host
+from libs.metrics import EXTRACTION_SECONDS
+from libs.storage import move_atomic
+from libs.tracing import tracer
+
+# Where yt-dlp's "ytsearch" queries go
+SEARCH_HOST = "youtube.com"
+
+# Files yt-dlp is still working on, everything else in a staging dir is output
+PARTIAL_PATTERN = re.compile(r"\.part(-Frag\d+)?$|\.ytdl$|\.temp$|\.encoding\.\w+$")
+
+
+class MihariDownloader(AsyncYT):
+    """
+    AsyncYT with the server's caching, request governor, resumable staging
+    and separate encode stage layered on top
+    """
+
+    def __init__(
+        self,
+        bin_dir=None,
+        staging_dir: Optional[Path] = None,
+        governor: Optional[HostGovernor] = None,
+        encoder: Optional[EncodePool] = None,
+        tuner: Optional[EncoderBenchmark] = None,
+    ):
+        super().__init__(bin_dir=bin_dir)
+        self.staging_dir = Path(staging_dir) if staging_dir else None
+        self.governor = governor
+        self.encoder = encoder
+        self.tuner = tuner
+        self.info_cache: AsyncTTLCache[VideoInfo] = AsyncTTLCache(
+            maxsize=256, ttl=600
+        )
+        # Short TTL, this mostly absorbs the desktop type-ahead repeating itself
+        self.search_cache: AsyncTTLCache[List[VideoInfo]] = AsyncTTLCache(
+            maxsize=128, ttl=120
+        )
+
+    async def get_video_info(self, url: str) -> VideoInfo:
+        """
+        Cached `AsyncYT.get_video_info`. AsyncYT calls this itself before every
+        download, so one extraction now serves /info, the socket and the download.
+        """
+        url = normalize_url(url)
+
+        async def fetch():
+            if self.governor:
+                await self.governor.acquire(get_host(url))
+            with EXTRACTION_SECONDS.time(operation="info"):
+                return await super(MihariDownloader, self).get_video_info(url)
+
+        with tracer.child("extract.info"):
+            return await self.info_cache.get_or_fetch(url, fetch)
+
+    async def get_playlist_info(
+        self, url: str, max_videos: Optional[int] = None
+    ) -> PlaylistInfo:
+        if self.governor:
+            await self.governor.acquire(get_host(url))
+        with EXTRACTION_SECONDS.time(operation="playlist"), tracer.child("extract.playlist"):
+            return await super().get_playlist_info(url, max_videos)
+
+    async def _search(self, query: str, max_results: int = 10) -> List[VideoInfo]:
+        """Cached `AsyncYT._search`, failed searches raise and are not cached"""
+        query = normalize_query(query)
+
+        async def fetch():
+            if self.governor:
+                await self.governor.acquire(SEARCH_HOST)
+            with EXTRACTION_SECONDS.time(operation="search"):
+                return await super(MihariDownloader, self)._search(query, max_results)
+
+        return await self.search_cache.get_or_fetch((query, max_results), fetch)
+
+    def staging_path(self, key: Union[int, str]) -> Path:
+        assert self.staging_dir, "MihariDownloader has no staging_dir"
+        return self.staging_dir / str(key)
+
+    def resumable(self, config: DownloadConfig, key: Union[int, str]) -> DownloadConfig:
+        """
+        Config that makes yt-dlp write into a staging dir of its own instead
+        of AsyncYT's throwaway temp dir, so a killed download leaves its .part
+        files behind and running the same config again continues them.
+        """
+        staging = self.staging_path(key)
+        staging.mkdir(parents=True, exist_ok=True)
+        template = config.custom_filename or "%(title)s.%(ext)s"
+        return config.model_copy(
+            update={
+                # An absolute template wins over AsyncYT's temp output_path
+                "custom_filename": str(staging / template),
+                # ffmpeg as the external downloader can't continue a partial file
+                "custom_options": {**config.custom_options, "downloader": "native"},
+            }
+        )
+
+    def _staging_of(self, config: Optional[DownloadConfig]) -> Optional[Path]:
+        if not (self.staging_dir and config and config.custom_filename):
+            return None
+        template = Path(config.custom_filename)
+        if not template.is_relative_to(self.staging_dir):
+            return None
+        return self.staging_dir / template.relative_to(self.staging_dir).parts[0]
+
+    async def download(self, *args, **kwargs) -> Path:
+        url, config, progress_callback, finalize = self._get_config(*args, **kwargs)
+        if self.encoder and config and needs_encoding(config):
+            return await self._fetch_and_encode(url, config, progress_callback, finalize)
+        staging = self._staging_of(config)
+        if staging is None:
+            return await super().download(*args, **kwargs)
+
+        try:
+            return await super().download(url, config, progress_callback, finalize)
+        except FileNotFoundError:
+            # Expected: the output is in the staging dir, AsyncYT's temp dir is empty
+            files = staged_files(staging)
+            if not files:
+                raise
+        if not finalize:
+            # The media file, not a thumbnail or subtitles written next to it
+            return max(files, key=lambda f: f.stat().st_size)
+        assert config
+        moved = await self.finalize_download(
+            staging, Path(config.output_path).resolve(), config
+        )
+        if not moved:
+            raise FileNotFoundError("No output file found after processing")
+        return moved[0]
+
+    async def _fetch_and_encode(
+        self, url: str, config: DownloadConfig, progress_callback, finalize: bool
+    ) -> Path:
+        """
+        Fetch without yt-dlp's re-encode, then encode in the encoder pool.
+        A DOWNLOADED progress event marks the switch between the two stages.
+        """
+        assert self.encoder
+        fetch_config = config.model_copy(update={"encoding": None, "video_format": None})
+        with tracer.child("fetch"):
+            source = await self.download(url, fetch_config, progress_callback, False)
+
+        progress = DownloadProgress(
+            id=get_id(url, config),
+            url=url,
+            status=ProgressStatus.DOWNLOADED,
+            percentage=100.0,
+        )
+        if progress_callback:
+            await call_callback(progress_callback, progress)
+
+        info = await self.get_video_info(url)
+        target = source.with_name(f"{source.stem}.{config.video_format}")
+        # Matches PARTIAL_PATTERN, so an interrupted encode is never taken for output
+        scratch = source.with_name(f"{source.stem}.encoding.{config.video_format}")
+        assert config.encoding
+        encoding = config.encoding
+        if self.tuner:
+            encoding = await self.tuner.tune(
+                encoding, str(self.ffprobe_path), source, float(info.duration or 0)
+            )
+        await self.encoder.encode(
+            str(self.ffmpeg_path),
+            source,
+            scratch,
+            encoding,
+            progress,
+            progress_callback,
+            float(info.duration or 0),
+        )
+        source.unlink()
+        scratch.replace(target)
+
+        progress.status = ProgressStatus.COMPLETED
+        progress.encoding_percentage = 100.0
+        if progress_callback:
+            await call_callback(progress_callback, progress)
+        if not finalize:
+            return target
+
+        moved = await self.finalize_download(
+            target.parent, Path(config.output_path).resolve(), config
+        )
+        for path in moved:
+            if path.suffix == target.suffix and path.name.startswith(target.stem):
+                return path
+        raise FileNotFoundError("No output file found after encoding")
+
+    async def finalize_download(
+        self,
+        temp_dir: Union[tempfile.TemporaryDirectory, Path],
+        output_dir: Path,
+        config: DownloadConfig,
+    ) -> List[Path]:
+        """
+        AsyncYT's finalize with atomic moves: `shutil.move` across disks
+        copies straight to the final name, so a crash mid-copy left a
+        truncated file there that looked finished.
+        """
+        staging = Path(temp_dir.name) if isinstance(temp_dir, tempfile.TemporaryDirectory) else temp_dir
+        overwrite = config.encoding.overwrite if config.encoding else False
+        moved: List[Path] = []
+        with tracer.child("finalize"):
+            try:
+                output_dir.mkdir(parents=True, exist_ok=True)
+                for item in staging.iterdir():
+                    if not item.is_file():
+                        continue
+                    target = output_dir / item.name
+                    if target.exists() and not overwrite:
+                        target = get_unique_path(output_dir, item.name)
+                    moved.append(await asyncio.to_thread(move_atomic, item, target))
+            finally:
+                if isinstance(temp_dir, tempfile.TemporaryDirectory):
+                    await asyncio.to_thread(temp_dir.cleanup)
+                else:
+                    await asyncio.to_thread(shutil.rmtree, staging, True)
+        return moved
+
+    def partial_bytes(self, key: Union[int, str]) -> int:
+        """Bytes already on disk for a staged download"""
+        staging = self.staging_path(key)
+        if not staging.exists():
+            return 0
+        return sum(f.stat().st_size for f in staging.iterdir() if f.is_file())
+
+    async def discard_partial(self, key: Union[int, str]):
+        staging = self.staging_path(key)
+        if staging.exists():
+            await asyncio.to_thread(shutil.rmtree, staging, True)
+
+    async def close(self):
+        """Release what the backend underneath holds, AsyncYT itself holds nothing"""
+        close = getattr(super(), "close", None)
+        if close:
+            await close()
+
+
+def staged_files(staging: Path) -> List[Path]:
+    """Finished output files in a staging dir"""
+    return [
+        f
+        for f in staging.iterdir()
+        if f.is_file() and not PARTIAL_PATTERN.search(f.name)
+    ]
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from asyncyt import DownloadConfig, DownloadProgress
+from asyncyt.encoding import EncodingConfig
+from asyncyt.enums import ProgressStatus
+
+from libs.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[DownloadProgress], Union[None, Awaitable[None]]]
+
+
+def needs_encoding(config: DownloadConfig) -> bool:
+    """Whether yt-dlp would re-encode (not just remux) the download for `config`"""
+    encoding = config.encoding
+    if config.extract_audio or not config.video_format or encoding is None:
+        return False
+    return bool(
+        (encoding.video and encoding.video.codec)
+        or (encoding.audio and encoding.audio.codec)
+    )
+
+
+def encode_command(
+    ffmpeg_path: str, source: Path, target: Path, encoding: EncodingConfig
+) -> List[str]:
+    """The ffmpeg call yt-dlp's VideoConvertor would make for `encoding`"""
+    cmd = [ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error"]
+    cmd += ["-progress", "pipe:1", "-nostats", *encoding.extra_global_args]
+    cmd += ["-i", str(source)]
+    if encoding.video:
+        cmd += encoding.video.to_ffmpeg_args()
+    if encoding.audio:
+        cmd += encoding.audio.to_ffmpeg_args()
+    # The target is a scratch name of our own, always overwritten
+    cmd += ["-y", str(target)]
+    return cmd
+
+
+def parse_progress(
+    block: Dict[str, str], progress: DownloadProgress, duration: float
+) -> None:
+    """Apply one ffmpeg `-progress` block to `progress`"""
+    out_time = block.get("out_time_us") or block.get("out_time_ms")
+    if out_time and out_time.lstrip("-").isdigit() and duration > 0:
+        seconds = int(out_time) / 1_000_000
+        progress.encoding_percentage = round(
+            min(100.0, max(0.0, seconds / duration * 100)), 2
+        )
+    if block.get("fps"):
+        try:
+            progress.encoding_fps = float(block["fps"])
+        except ValueError:
+            pass
+    if block.get("frame", "").isdigit():
+        progress.encoding_frame = int(block["frame"])
+    if block.get("speed") and block["speed"] != "N/A":
+        progress.encoding_speed = block["speed"].strip()
+    if block.get("bitrate") and block["bitrate"] != "N/A":
+        progress.encoding_bitrate = block["bitrate"].strip()
+    if block.get("out_time"):
+        progress.encoding_time = block["out_time"]
+
+
+class EncodeError(Exception):
+    def __init__(self, source: Path, returncode: int, output: List[str]):
+        self.source = source
+        self.returncode = returncode
+        self.output = "\n".join(output)
+        super().__init__(f"ffmpeg exited with code {returncode} encoding {source.name}")
+
+
+class EncodePool:
+    """
+    The encode stage of the download pipeline. Fetches only download and
+    remux, re-encodes wait here for one of `workers` ffmpeg processes (one
+    per CPU core by default), so they neither hold network slots nor
+    oversubscribe the CPU.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.canceled = 0
+        self.encode_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._slots = asyncio.Condition()
+
+    def configure(self, workers: Optional[int] = None):
+        if workers is not None:
+            self.workers = max(1, int(workers))
+            asyncio.create_task(self._notify())
+
+    async def _notify(self):
+        async with self._slots:
+            self._slots.notify_all()
+
+    async def encode(
+        self,
+        ffmpeg_path: str,
+        source: Path,
+        target: Path,
+        encoding: EncodingConfig,
+        progress: DownloadProgress,
+        progress_callback: Optional[ProgressCallback] = None,
+        duration: float = 0.0,
+    ) -> Path:
+        """Encode `source` into `target` once a worker is free"""
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            with tracer.child("encode.wait"):
+                async with self._slots:
+                    await self._slots.wait_for(lambda: self.running < self.workers)
+                    self.running += 1
+        finally:
+            self.waiting -= 1
+        started_at = time.monotonic()
+        self.wait_seconds += started_at - queued_at
+
+        try:
+            with tracer.child("encode.ffmpeg", codec=encoding.video and encoding.video.codec):
+                await self._run(
+                    encode_command(ffmpeg_path, source, target, encoding),
+                    source,
+                    progress,
+                    progress_callback,
+                    duration,
+                )
+        except asyncio.CancelledError:
+            self.canceled += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+        finally:
+            self.encode_seconds += time.monotonic() - started_at
+            async with self._slots:
+                self.running -= 1
+                self._slots.notify()
+        return target
+
+    async def _run(
+        self,
+        cmd: List[str],
+        source: Path,
+        progress: DownloadProgress,
+        progress_callback: Optional[ProgressCallback],
+        duration: float,
+    ):
+        logger.debug("ffmpeg command: %s", " ".join(cmd))
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=sys.platform != "win32",
+        )
+        progress.status = ProgressStatus.ENCODING
+        progress.encoding_percentage = 0.0
+        errors: List[str] = []
+        try:
+            block: Dict[str, str] = {}
+            assert process.stdout
+            async for raw in process.stdout:
+                line = raw.decode(errors="replace").strip()
+                key, separator, value = line.partition("=")
+                if not separator:
+                    errors.append(line)
+                    continue
+                if key != "progress":
+                    block[key] = value
+                    continue
+                parse_progress(block, progress, duration)
+                block = {}
+                if progress_callback:
+                    result = progress_callback(progress)
+                    if asyncio.iscoroutine(result):
+                        await result
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        if returncode != 0:
+            raise EncodeError(source, returncode, errors[-20:])
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed + self.canceled
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "canceled": self.canceled,
+            "encode_seconds": round(self.encode_seconds, 2),
+            "average_wait": round(self.wait_seconds / finished, 2) if finished else 0.0,
+        }
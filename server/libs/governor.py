@@ -0,0 +1,200 @@
+import asyncio
+import re
+import time
+from typing import Any, Dict, Optional, Union
+from urllib.parse import urlparse
+
+RATE_PATTERN = re.compile(r"^\s*([\d.]+)\s*([KMG]?)i?B?\s*(/s)?\s*$", re.IGNORECASE)
+
+Rate = Union[str, int, float, None]
+
+# Setting keys and the `HostGovernor.configure` argument each one sets
+GOVERNOR_SETTINGS = {
+    "host_requests_per_second": "requests_per_second",
+    "host_request_burst": "request_burst",
+    "host_bandwidth_limit": "host_bandwidth",
+    "global_bandwidth_limit": "global_bandwidth",
+    "host_limits": "host_limits",
+}
+
+# Hosts that are one origin as far as limits go
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "music.youtube.com": "youtube.com",
+    "youtube-nocookie.com": "youtube.com",
+}
+
+
+def get_host(url: str) -> str:
+    """Host a request goes to, the key for per-host limits"""
+    host = urlparse(url).hostname or ""
+    host = host.removeprefix("www.").removeprefix("m.")
+    return HOST_ALIASES.get(host, host)
+
+
+def parse_rate(rate: Rate) -> float:
+    """Bytes per second of "2M", "500K" or a plain number, 0 for no limit"""
+    if not rate:
+        return 0.0
+    if isinstance(rate, (int, float)):
+        return float(rate)
+    match = RATE_PATTERN.match(rate)
+    if not match:
+        raise ValueError(f"Invalid rate: {rate}")
+    power = " KMG".index(match.group(2).upper() or " ")
+    return float(match.group(1)) * 1024**power
+
+
+def format_rate(rate: float) -> str:
+    """yt-dlp `--limit-rate` value for bytes per second"""
+    return f"{max(1, int(rate / 1024))}K"
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`, a rate of 0 never runs dry"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def take(self, tokens: float = 1.0):
+        while not self.try_take(tokens):
+            await asyncio.sleep(self.wait_time(tokens))
+
+
+class HostGovernor:
+    """
+    Request rate and bandwidth limits per host, plus a global bandwidth cap.
+
+    Every request to a host (info, search, starting a download) takes a
+    token from that host's bucket. Bandwidth can't be changed once yt-dlp
+    runs, so each download gets its share of the caps as `rate_limit` when
+    it starts.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = 1.0,
+        request_burst: float = 5,
+        host_bandwidth: Rate = None,
+        global_bandwidth: Rate = None,
+        min_download_rate: Rate = "64K",
+    ):
+        self.requests_per_second = requests_per_second
+        self.request_burst = request_burst
+        self.host_bandwidth = parse_rate(host_bandwidth)
+        self.global_bandwidth = parse_rate(global_bandwidth)
+        # A host whose share would drop below this takes no more downloads
+        self.min_download_rate = parse_rate(min_download_rate)
+        # Per-host overrides: {"requests_per_second", "request_burst", "bandwidth"}
+        self.host_limits: Dict[str, Dict[str, Any]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def configure(
+        self,
+        requests_per_second: Optional[float] = None,
+        request_burst: Optional[float] = None,
+        host_bandwidth: Rate = None,
+        global_bandwidth: Rate = None,
+        host_limits: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        if requests_per_second is not None:
+            self.requests_per_second = float(requests_per_second)
+        if request_burst is not None:
+            self.request_burst = float(request_burst)
+        if host_bandwidth is not None:
+            self.host_bandwidth = parse_rate(host_bandwidth)
+        if global_bandwidth is not None:
+            self.global_bandwidth = parse_rate(global_bandwidth)
+        if host_limits is not None:
+            # Rejected here rather than failing the scheduler later
+            for limits in host_limits.values():
+                parse_rate(limits.get("bandwidth"))
+            self.host_limits = host_limits
+        # Rebuilt with the new limits on next use
+        self._buckets.clear()
+
+    def _limit(self, host: str, key: str, default: Any) -> Any:
+        value = self.host_limits.get(host, {}).get(key)
+        return default if value is None else value
+
+    def bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(
+                float(self._limit(host, "requests_per_second", self.requests_per_second)),
+                float(self._limit(host, "request_burst", self.request_burst)),
+            )
+        return bucket
+
+    async def acquire(self, host: str):
+        """Wait for a request slot on `host`"""
+        await self.bucket(host).take()
+
+    def bandwidth(self, host: str) -> float:
+        return parse_rate(self._limit(host, "bandwidth", self.host_bandwidth))
+
+    def download_rate(
+        self, host: str, on_host: int, total: int, requested: Rate = None
+    ) -> Optional[str]:
+        """
+        `rate_limit` for a download starting next to `on_host` others on the
+        same host and `total` overall, never above what the user asked for
+        """
+        limits = [parse_rate(requested)]
+        if self.bandwidth(host):
+            limits.append(self.bandwidth(host) / (on_host + 1))
+        if self.global_bandwidth:
+            limits.append(self.global_bandwidth / (total + 1))
+        limits = [limit for limit in limits if limit > 0]
+        return format_rate(min(limits)) if limits else None
+
+    def admit(self, host: str, on_host: int, total: int) -> bool:
+        """
+        Whether a queued download for `host` may start now, takes a request
+        token when it may. Hosts out of tokens or bandwidth wait their turn.
+        """
+        host_bandwidth = self.bandwidth(host)
+        # The first download always fits, however low the cap
+        if on_host and 0 < host_bandwidth / (on_host + 1) < self.min_download_rate:
+            return False
+        if total and 0 < self.global_bandwidth / (total + 1) < self.min_download_rate:
+            return False
+        return self.bucket(host).try_take()
+
+    def retry_after(self, host: str) -> float:
+        return self.bucket(host).wait_time()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests_per_second": self.requests_per_second,
+            "request_burst": self.request_burst,
+            "host_bandwidth": self.host_bandwidth,
+            "global_bandwidth": self.global_bandwidth,
+            "hosts": {
+                host: {"tokens": round(bucket.tokens, 2), "rate": bucket.rate}
+                for host, bucket in self._buckets.items()
+            },
+        }
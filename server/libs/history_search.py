@@ -0,0 +1,125 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from tortoise import connections
+
+from libs.Models import Downloads, check_history_fields, format_history_row
+from libs.db import WRITE_CONNECTION, get_reader
+
+# FTS5 index over the searchable parts of `downloads`. Triggers keep it in
+# sync with every write to metadata/filename/url (setInfo, determine_success,
+# deletes), progress updates don't touch those columns so they cost nothing.
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS downloads_fts USING fts5(
+    title, uploader, description, url, filename,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS downloads_fts_insert AFTER INSERT ON downloads BEGIN
+    INSERT INTO downloads_fts (rowid, title, uploader, description, url, filename)
+    VALUES (
+        new.id,
+        json_extract(new.metadata, '$.title'),
+        json_extract(new.metadata, '$.uploader'),
+        json_extract(new.metadata, '$.description'),
+        new.url,
+        new.filename
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS downloads_fts_update
+AFTER UPDATE OF metadata, filename, url ON downloads BEGIN
+    DELETE FROM downloads_fts WHERE rowid = old.id;
+    INSERT INTO downloads_fts (rowid, title, uploader, description, url, filename)
+    VALUES (
+        new.id,
+        json_extract(new.metadata, '$.title'),
+        json_extract(new.metadata, '$.uploader'),
+        json_extract(new.metadata, '$.description'),
+        new.url,
+        new.filename
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS downloads_fts_delete AFTER DELETE ON downloads BEGIN
+    DELETE FROM downloads_fts WHERE rowid = old.id;
+END;
+"""
+
+# Rows recorded before the index existed
+BACKFILL = """
+INSERT INTO downloads_fts (rowid, title, uploader, description, url, filename)
+SELECT
+    id,
+    json_extract(metadata, '$.title'),
+    json_extract(metadata, '$.uploader'),
+    json_extract(metadata, '$.description'),
+    url,
+    filename
+FROM downloads
+WHERE id NOT IN (SELECT rowid FROM downloads_fts)
+"""
+
+# bm25 weights in column order: title, uploader, description, url, filename
+SEARCH = """
+SELECT f.rowid AS id, bm25(downloads_fts, 10.0, 5.0, 1.0, 2.0, 3.0) AS score
+FROM downloads_fts AS f
+JOIN downloads AS d ON d.id = f.rowid
+WHERE downloads_fts MATCH ? AND d.user_id = ?
+ORDER BY score
+LIMIT ? OFFSET ?
+"""
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+async def setup_history_search():
+    """Create the index and triggers if missing and index any older rows"""
+    connection = connections.get(WRITE_CONNECTION)
+    await connection.execute_script(SCHEMA)
+    await connection.execute_script(BACKFILL)
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 query where every word has to match and the
+    last one may be a prefix, so results follow the user while they type.
+    Quoting each token keeps FTS5 operators in user input from being parsed.
+    """
+    tokens = TOKEN_PATTERN.findall(query)
+    if not tokens:
+        raise ValueError("Search query must contain at least one word")
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+async def search_history(
+    query: str,
+    user_id: int = 0,
+    limit: int = 20,
+    offset: int = 0,
+    fields: Optional[Iterable[str]] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Best matches first, returns the rows and whether more results follow"""
+    selected = check_history_fields(fields)
+    matches = await get_reader().execute_query_dict(
+        SEARCH, [build_match_query(query), user_id, limit + 1, offset]
+    )
+    has_more = len(matches) > limit
+    matches = matches[:limit]
+    if not matches:
+        return [], False
+
+    ids = [match["id"] for match in matches]
+    query = Downloads.filter(id__in=ids).using_db(get_reader())
+    rows = {row["id"]: row for row in await query.values(*{*selected, "id"})}
+    results = []
+    for match in matches:
+        row = rows.get(match["id"])
+        if row:
+            item = format_history_row(row, selected)
+            item["score"] = -match["score"]
+            results.append(item)
+    return results, has_more
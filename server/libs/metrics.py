@@ -0,0 +1,211 @@
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+LabelValues = Tuple[str, ...]
+Collector = Callable[[], Union[None, Awaitable[None]]]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{escape_label(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        """Drop every label set, for values rebuilt on each scrape"""
+        self._values.clear()
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        for key, value in self._values.items():
+            yield self.name, self.labelnames, key, value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labelnames, values, value in self.samples():
+            lines.append(f"{name}{format_labels(labelnames, values)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: Any):
+        """Report a count kept elsewhere, e.g. a cache's own hit counter"""
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> (per bucket counts, +Inf last), sum
+        self._observations: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self._key(labels)
+        counts, total = self._observations.setdefault(
+            key, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: Any):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def totals(self) -> Tuple[int, float]:
+        """Observation count and sum over every label set"""
+        count = sum(sum(counts) for counts, _ in self._observations.values())
+        return count, sum(total[0] for _, total in self._observations.values())
+
+    def clear(self):
+        self._observations.clear()
+
+    def samples(self):
+        bucket_labels = self.labelnames + ("le",)
+        for key, (counts, total) in self._observations.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", bucket_labels, (*key, format_value(bound)), cumulative
+            yield f"{self.name}_sum", self.labelnames, key, total[0]
+            yield f"{self.name}_count", self.labelnames, key, cumulative
+
+
+class MetricsRegistry:
+    """
+    Metrics in the Prometheus text format. Hot paths update counters and
+    histograms in place, values that are cheaper to read than to track
+    (queue sizes, cache stats) are filled in by collectors on each scrape.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _register(self, metric: Metric) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect: Collector) -> Collector:
+        """Run `collect` before every scrape, usable as a decorator"""
+        self._collectors.append(collect)
+        return collect
+
+    async def render(self) -> str:
+        for collect in self._collectors:
+            result = collect()
+            if asyncio.iscoroutine(result):
+                await result
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+
+metrics = MetricsRegistry()
+
+# Updated where the work happens, the rest is declared next to its collector
+DB_WRITE_SECONDS = metrics.histogram(
+    "mihari_db_write_seconds",
+    "Time from queueing a database write to its commit",
+)
+EXTRACTION_SECONDS = metrics.histogram(
+    "mihari_extraction_seconds",
+    "yt-dlp metadata extraction time, cache misses only",
+    ["operation"],
+)
+DOWNLOAD_TRANSITIONS = metrics.counter(
+    "mihari_download_transitions_total",
+    "Downloads entering each status",
+    ["status"],
+)
+DOWNLOADED_BYTES = metrics.counter(
+    "mihari_downloaded_bytes_total",
+    "Bytes fetched by all downloads",
+)
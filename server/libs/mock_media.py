@@ -0,0 +1,338 @@
+import asyncio
+from collections import Counter
+import logging
+import random
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from asyncyt import VideoInfo
+from asyncyt.basemodels import PlaylistInfo
+from asyncyt.exceptions import (
+    YtdlpDownloadError,
+    YtdlpGetInfoError,
+    YtdlpPlaylistGetInfoError,
+    YtdlpSearchError,
+)
+
+from libs.backends import Chunks, LocalBackend, video_id
+from libs.governor import parse_rate
+
+logger = logging.getLogger(__name__)
+
+# Knobs of the server, settable through `MockMediaServer.configure` or POST /config
+SERVER_OPTIONS = (
+    "file_size",
+    "bandwidth",
+    "latency",
+    "failure_rate",
+    "throttle_rate",
+    "retry_after",
+)
+REASONS = {429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+class MockMediaServer:
+    """
+    A fake video site on a local port. Every video id has metadata at
+    /info/{id} and a `file_size` byte file at /media/{id} (with Range
+    support), streamed at `bandwidth` per connection.
+
+    Every request first waits `latency` seconds, then fails with 429 (with
+    Retry-After) at `throttle_rate` and with 503 at `failure_rate`, so
+    retries and throttling see the errors they would see for real.
+    """
+
+    def __init__(
+        self,
+        file_size: int = 8 * 1024 * 1024,
+        bandwidth: Any = "4M",
+        latency: float = 0.05,
+        failure_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: Optional[int] = None,
+    ):
+        self.file_size = file_size
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.stats: Counter = Counter()
+        self.base_url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    def configure(self, **options: Any):
+        for key, value in options.items():
+            if key not in SERVER_OPTIONS:
+                raise ValueError(f"Unknown mock server option: {key}")
+            if key == "bandwidth":
+                parse_rate(value)
+            setattr(self, key, value)
+
+    def options(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in SERVER_OPTIONS}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(middlewares=[self._chaos])
+        app.add_routes(
+            [
+                web.get("/info/{id}", self._info),
+                web.get("/playlist/{id}", self._playlist),
+                web.get("/search", self._search),
+                web.get("/media/{id}", self._media),
+                web.get("/thumb/{id}", self._thumbnail),
+                web.get("/config", self._get_config),
+                web.post("/config", self._set_config),
+                web.get("/stats", self._stats),
+            ]
+        )
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        server = site._server
+        assert server is not None and server.sockets  # type: ignore[attr-defined]
+        bound = server.sockets[0].getsockname()  # type: ignore[attr-defined]
+        self.base_url = f"http://{host}:{bound[1]}"
+        logger.info(f"Mock media server on {self.base_url}")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _chaos(self, request: web.Request, handler):
+        if request.path in ("/config", "/stats"):
+            return await handler(request)
+        self.stats["requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            self.stats["throttled"] += 1
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        if roll < self.throttle_rate + self.failure_rate:
+            self.stats["failed"] += 1
+            return web.Response(status=503)
+        return await handler(request)
+
+    def _video(self, id: str) -> Dict[str, Any]:
+        return {
+            "id": id,
+            "title": f"Mock {id}",
+            "duration": 60,
+            "uploader": "Mock",
+            "thumbnail": f"{self.base_url}/thumb/{id}",
+            "formats": [{"format_id": "18", "ext": "mp4", "filesize": self.file_size}],
+        }
+
+    async def _info(self, request: web.Request):
+        return web.json_response(self._video(request.match_info["id"]))
+
+    async def _playlist(self, request: web.Request):
+        id = request.match_info["id"]
+        count = int(request.query.get("count", 10))
+        entries = [
+            {**self._video(f"{id}-{i}"), "url": f"{self.base_url}/watch/{id}-{i}", "playlist_index": i + 1}
+            for i in range(count)
+        ]
+        return web.json_response(
+            {"id": id, "title": f"Mock playlist {id}", "entry_count": count, "entries": entries}
+        )
+
+    async def _search(self, request: web.Request):
+        query = request.query.get("q", "")
+        count = int(request.query.get("count", 10))
+        return web.json_response(
+            [
+                {**self._video(video_id(f"{query}-{i}")), "url": f"{self.base_url}/watch/{video_id(f'{query}-{i}')}"}
+                for i in range(count)
+            ]
+        )
+
+    async def _media(self, request: web.Request):
+        offset = 0
+        if request.http_range.start:
+            offset = min(request.http_range.start, self.file_size)
+        response = web.StreamResponse(status=206 if offset else 200)
+        response.content_type = "video/mp4"
+        response.content_length = self.file_size - offset
+        if offset:
+            response.headers["Content-Range"] = (
+                f"bytes {offset}-{self.file_size - 1}/{self.file_size}"
+            )
+        await response.prepare(request)
+
+        bandwidth = parse_rate(self.bandwidth)
+        # About ten writes a second when throttled
+        chunk_size = max(4096, min(256 * 1024, int(bandwidth / 10))) if bandwidth else 256 * 1024
+        block = (request.match_info["id"].encode("utf-8") * (chunk_size // 8 + 1))[:chunk_size]
+        try:
+            while offset < self.file_size:
+                data = block[: min(chunk_size, self.file_size - offset)]
+                await response.write(data)
+                offset += len(data)
+                self.stats["bytes"] += len(data)
+                if bandwidth:
+                    await asyncio.sleep(len(data) / bandwidth)
+            await response.write_eof()
+        except ConnectionResetError:
+            # Paused or canceled downloads hang up mid-file
+            self.stats["aborted"] += 1
+            return response
+        self.stats["files"] += 1
+        return response
+
+    async def _thumbnail(self, request: web.Request):
+        return web.Response(body=b"\xff\xd8\xff\xd9", content_type="image/jpeg")
+
+    async def _get_config(self, request: web.Request):
+        return web.json_response(self.options())
+
+    async def _set_config(self, request: web.Request):
+        try:
+            self.configure(**await request.json())
+        except (ValueError, TypeError) as e:
+            return web.json_response({"error": str(e)}, status=400)
+        return web.json_response(self.options())
+
+    async def _stats(self, request: web.Request):
+        return web.json_response(dict(self.stats))
+
+
+def http_error(status: int) -> str:
+    """The line yt-dlp prints for an HTTP error, which the retry policy classifies"""
+    return f"ERROR: HTTP Error {status}: {REASONS.get(status, 'Error')}"
+
+
+class MockHTTPBackend(LocalBackend):
+    """
+    Downloads every URL from a `MockMediaServer`, any URL maps to a video
+    there. The server is started on first use unless `base_url` points to
+    one that already runs. Options are the server's knobs plus `host`,
+    `port` and `seed`.
+    """
+
+    base_url: Optional[str] = None
+    host: str = "127.0.0.1"
+    port: int = 0
+    seed: Optional[int] = None
+    file_size: int = 8 * 1024 * 1024
+    bandwidth: Any = "4M"
+    latency: float = 0.05
+    failure_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: int = 1
+
+    _server: Optional[MockMediaServer] = None
+    _session: Optional[aiohttp.ClientSession] = None
+    _start_lock: Optional[asyncio.Lock] = None
+
+    def configure_backend(self, **options: Any):
+        super().configure_backend(**options)
+        if self._server:
+            self._server.configure(
+                **{k: v for k, v in options.items() if k in SERVER_OPTIONS}
+            )
+
+    def backend_options(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            **{key: getattr(self, key) for key in SERVER_OPTIONS},
+        }
+
+    async def setup_binaries(self):
+        await self._base()
+
+    async def _base(self) -> str:
+        if self._session and self.base_url:
+            return self.base_url
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if not self.base_url:
+                self._server = MockMediaServer(
+                    seed=self.seed,
+                    **{key: getattr(self, key) for key in SERVER_OPTIONS},
+                )
+                self.base_url = await self._server.start(self.host, self.port)
+            if not self._session:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=0),
+                    timeout=aiohttp.ClientTimeout(total=None, sock_read=30),
+                )
+        return self.base_url
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+        if self._server:
+            await self._server.stop()
+            self._server = None
+            self.base_url = None
+
+    async def _get_json(self, path: str, error, url: str, **params: Any) -> Any:
+        base = await self._base()
+        assert self._session
+        try:
+            async with self._session.get(base + path, params=params) as resp:
+                if resp.status != 200:
+                    raise error(url, resp.status, http_error(resp.status))
+                return await resp.json()
+        except aiohttp.ClientError as e:
+            raise error(url, None, f"ERROR: Connection aborted: {e}")
+
+    async def get_video_info(self, url: str) -> VideoInfo:
+        data = await self._get_json(f"/info/{video_id(url)}", YtdlpGetInfoError, url)
+        return VideoInfo(url=url, **{k: v for k, v in data.items() if k != "id"})
+
+    async def get_playlist_info(
+        self, url: str, max_videos: Optional[int] = None
+    ) -> PlaylistInfo:
+        data = await self._get_json(
+            f"/playlist/{video_id(url)}",
+            YtdlpPlaylistGetInfoError,
+            url,
+            count=max_videos or 10,
+        )
+        return PlaylistInfo(url=url, **data)
+
+    async def _search(self, query: str, max_results: int = 10) -> List[VideoInfo]:
+        base = await self._base()
+        assert self._session
+        async with self._session.get(
+            base + "/search", params={"q": query, "count": max_results}
+        ) as resp:
+            if resp.status != 200:
+                raise YtdlpSearchError(query, resp.status, http_error(resp.status))
+            data = await resp.json()
+        return [
+            VideoInfo(**{k: v for k, v in item.items() if k != "id"}) for item in data
+        ]
+
+    async def media(self, url: str, info: VideoInfo, offset: int) -> Chunks:
+        base = await self._base()
+        assert self._session
+        media_url = f"{base}/media/{video_id(url)}"
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            async with self._session.get(media_url, headers=headers) as resp:
+                if resp.status not in (200, 206):
+                    raise YtdlpDownloadError(
+                        url, resp.status, ["GET", media_url], [http_error(resp.status)]
+                    )
+                total = offset + (resp.content_length or 0)
+                async for chunk in resp.content.iter_chunked(256 * 1024):
+                    yield chunk, total
+        except aiohttp.ClientError as e:
+            raise YtdlpDownloadError(
+                url, None, ["GET", media_url], [f"ERROR: Connection aborted: {e}"]
+            )
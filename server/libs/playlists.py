@@ -0,0 +1,169 @@
+import asyncio
+from collections import Counter
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from asyncyt import PlaylistConfig
+from asyncyt.basemodels import PlaylistInfo, PlaylistVideoInfo
+
+from libs.Models import Downloads, DownloadType, Status
+from libs.db import get_reader
+from libs.progress_hub import ProgressHub
+
+logger = logging.getLogger(__name__)
+
+# An item in one of these won't download again
+DONE = (Status.FINISHED, Status.FAILED, Status.CANCELED)
+
+
+def select_entries(
+    info: PlaylistInfo, config: PlaylistConfig
+) -> List[PlaylistVideoInfo]:
+    """Entries `config` asks for, the same selection `AsyncYT.download_playlist` makes"""
+    entries = info.entries[config.start_index - 1 : config.end_index]
+    if config.reverse:
+        entries = list(reversed(entries))
+    return entries
+
+
+def entry_metadata(entry: PlaylistVideoInfo) -> Dict[str, Any]:
+    """What the flat playlist already tells about an item, until its download fills in the rest"""
+    return entry.model_dump(exclude={"thumbnails"})
+
+
+class PlaylistTracker:
+    """Status and progress of every item of one playlist"""
+
+    def __init__(self, playlist_id: int, items: Iterable[Downloads]):
+        self.playlist_id = playlist_id
+        self.status: Dict[int, str] = {}
+        self.percentage: Dict[int, float] = {}
+        for item in items:
+            self.status[item.id] = item.status
+            self.percentage[item.id] = item.percentage or 0.0
+
+    @property
+    def done(self) -> bool:
+        return all(status in DONE for status in self.status.values())
+
+    def pending(self) -> List[int]:
+        """Items that are still queued, running or paused"""
+        return [id for id, status in self.status.items() if status not in DONE]
+
+    def summary(self) -> Dict[str, Any]:
+        """Item counts per status and the overall percentage, done items count as whole"""
+        total = len(self.status)
+        counts = Counter(self.status.values())
+        progress = sum(
+            100.0 if status in DONE else self.percentage[id]
+            for id, status in self.status.items()
+        )
+        return {
+            "total_videos": total,
+            "percentage": round(progress / total, 2) if total else 100.0,
+            **{status.value: counts.get(status, 0) for status in Status},
+        }
+
+
+class PlaylistRegistry:
+    """
+    Playlists with items left to download. Item updates are folded into
+    their playlist's aggregate progress, and the playlist row is settled
+    once the last item is done.
+    """
+
+    def __init__(
+        self,
+        hub: ProgressHub,
+        on_settled: Optional[Callable[[int], Any]] = None,
+    ):
+        self.hub = hub
+        self.on_settled = on_settled
+        self._playlists: Dict[int, PlaylistTracker] = {}
+        # Item id -> playlist id
+        self._items: Dict[int, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __contains__(self, playlist_id: int) -> bool:
+        return playlist_id in self._playlists
+
+    def get(self, playlist_id: int) -> Optional[PlaylistTracker]:
+        return self._playlists.get(playlist_id)
+
+    def add(self, playlist_id: int, items: Iterable[Downloads]) -> PlaylistTracker:
+        tracker = PlaylistTracker(playlist_id, items)
+        self._playlists[playlist_id] = tracker
+        for item_id in tracker.status:
+            self._items[item_id] = playlist_id
+        if tracker.done:
+            self._spawn(self._settle(tracker))
+        return tracker
+
+    async def load(self) -> List[Downloads]:
+        """Track the playlists that were still downloading when the server stopped"""
+        playlists = await Downloads.filter(
+            download_type=DownloadType.PLAYLIST, status=Status.DOWNLOADING
+        ).using_db(get_reader())
+        if not playlists:
+            return []
+        items = await Downloads.filter(
+            parent_id__in=[playlist.id for playlist in playlists]
+        ).using_db(get_reader())
+        for playlist in playlists:
+            self.add(playlist.id, [i for i in items if i.parent_id == playlist.id])
+        return playlists
+
+    def progress(self, item_id: int, percentage: Optional[float]):
+        tracker = self._tracker_of(item_id)
+        if tracker is None:
+            return
+        tracker.percentage[item_id] = percentage or 0.0
+        self.hub.publish_progress(tracker.playlist_id, tracker.summary())
+
+    def update(self, item_id: int, status: str):
+        """Record an item's new status"""
+        tracker = self._tracker_of(item_id)
+        if tracker is None:
+            return
+        tracker.status[item_id] = status
+        if status == Status.QUEUED:
+            # Retried from the start of its progress bar
+            tracker.percentage[item_id] = 0.0
+        if tracker.done:
+            self._spawn(self._settle(tracker))
+        else:
+            self.hub.publish_progress(tracker.playlist_id, tracker.summary())
+
+    def _tracker_of(self, item_id: int) -> Optional[PlaylistTracker]:
+        playlist_id = self._items.get(item_id)
+        return self._playlists.get(playlist_id) if playlist_id else None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _settle(self, tracker: PlaylistTracker):
+        if self._playlists.get(tracker.playlist_id) is not tracker:
+            return
+        self._playlists.pop(tracker.playlist_id)
+        for item_id in tracker.status:
+            self._items.pop(item_id, None)
+        if self.on_settled:
+            self.on_settled(tracker.playlist_id)
+
+        summary = tracker.summary()
+        try:
+            playlist = await Downloads.get_or_none(
+                id=tracker.playlist_id, using_db=get_reader()
+            )
+            if playlist is None:
+                return
+            await playlist.finish_playlist(
+                summary[Status.FINISHED],
+                summary[Status.FAILED],
+                summary[Status.CANCELED],
+            )
+            self.hub.publish_status(playlist.id, playlist.status, **summary)
+        except Exception as e:
+            logger.exception(e)
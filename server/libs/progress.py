@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from asyncyt import DownloadProgress
+from libs.Models import Downloads, parse_speed
+from libs.db import db_writer
+
+logger = logging.getLogger(__name__)
+
+
+def progress_fields(progress: DownloadProgress) -> Dict[str, Any]:
+    """Map a progress event onto the `downloads` progress columns"""
+    return {
+        "downloaded_bytes": progress.downloaded_bytes,
+        "total_bytes": progress.total_bytes,
+        "percentage": progress.percentage,
+        "speed": parse_speed(progress.speed),
+        "eta": progress.eta,
+    }
+
+
+class ProgressBuffer:
+    """
+    Keeps the latest `DownloadProgress` of every running download in memory
+    and writes them to the `downloads` table in one transaction per interval.
+    """
+
+    def __init__(self, interval: float = 2.0):
+        self.interval = interval
+        self._latest: Dict[int, DownloadProgress] = {}
+        self._dirty: set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def update(self, download_id: int, progress: DownloadProgress):
+        """Record a progress event, nothing is written until the next flush"""
+        # AsyncYT reuses one progress object per download, so keep a snapshot
+        self._latest[download_id] = progress.model_copy()
+        self._dirty.add(download_id)
+
+    def get(self, download_id: int) -> Optional[DownloadProgress]:
+        return self._latest.get(download_id)
+
+    def latest(self) -> Dict[int, DownloadProgress]:
+        """Last progress of every running download"""
+        return dict(self._latest)
+
+    async def flush(self, *download_ids: int):
+        """Write pending progress, for all downloads or only the given ones"""
+        async with self._flush_lock:
+            if download_ids:
+                ids = [i for i in download_ids if i in self._dirty]
+            else:
+                ids = list(self._dirty)
+            if not ids:
+                return
+            self._dirty.difference_update(ids)
+            updates = {
+                download_id: progress_fields(self._latest[download_id])
+                for download_id in ids
+                if download_id in self._latest
+            }
+
+            async def write():
+                for download_id, values in updates.items():
+                    await Downloads.filter(id=download_id).update(**values)
+
+            try:
+                # The writer commits the whole flush as one transaction
+                await db_writer.run(write)
+            except Exception:
+                self._dirty.update(ids)
+                raise
+
+    async def finish(self, download_id: int):
+        """Flush a download that changed state and stop tracking it"""
+        try:
+            await self.flush(download_id)
+        finally:
+            self._latest.pop(download_id, None)
+            self._dirty.discard(download_id)
+
+    async def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Failed to flush download progress: {e}")
@@ -0,0 +1,157 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from libs.Models import Status
+
+Event = Dict[str, Any]
+
+
+class Subscription:
+    """
+    One consumer of the hub. Only the newest event per download is kept, so a
+    slow consumer skips intermediate updates instead of queueing them, and
+    events are handed out at most once per `interval` (terminal events skip
+    the wait).
+    """
+
+    def __init__(
+        self,
+        hub: "ProgressHub",
+        download_ids: Optional[Iterable[int]] = None,
+        interval: float = 0.5,
+    ):
+        self.hub = hub
+        self.interval = interval
+        # None follows every download
+        self.download_ids: Optional[Set[int]] = (
+            None if download_ids is None else set(download_ids)
+        )
+        self._pending: Dict[int, Event] = {}
+        self._urgent = False
+        self._ready = asyncio.Event()
+        self._last_sent = 0.0
+        self.closed = False
+
+    def wants(self, download_id: int) -> bool:
+        return self.download_ids is None or download_id in self.download_ids
+
+    def follow(self, download_id: Optional[int] = None):
+        """Follow one more download, or every download when no id is given"""
+        if download_id is None:
+            self.download_ids = None
+        elif self.download_ids is not None:
+            self.download_ids.add(download_id)
+        self.hub.replay(self, download_id)
+
+    def unfollow(self, download_id: Optional[int] = None):
+        """Stop following a download, or everything when no id is given"""
+        if download_id is None:
+            self.download_ids = set()
+            self._pending.clear()
+        elif self.download_ids is not None:
+            self.download_ids.discard(download_id)
+            self._pending.pop(download_id, None)
+
+    def offer(self, download_id: int, event: Event, urgent: bool = False):
+        self._pending[download_id] = event
+        self._urgent = self._urgent or urgent
+        self._ready.set()
+
+    async def get(self) -> List[Event]:
+        """Wait for the next throttled batch of events"""
+        while True:
+            await self._ready.wait()
+            if not self._urgent:
+                loop = asyncio.get_running_loop()
+                delay = self._last_sent + self.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self._ready.clear()
+            if not self._pending:
+                continue
+            events = list(self._pending.values())
+            self._pending.clear()
+            self._urgent = False
+            self._last_sent = asyncio.get_running_loop().time()
+            return events
+
+    def close(self):
+        self.closed = True
+        self.hub.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> List[Event]:
+        if self.closed:
+            raise StopAsyncIteration
+        return await self.get()
+
+
+class ProgressHub:
+    """
+    Fans progress and status events of every download out to any number of
+    subscribers. Publishing never blocks, so sockets can't slow a download.
+    """
+
+    def __init__(self, interval: float = 0.5, min_interval: float = 0.1):
+        self.interval = interval
+        self.min_interval = min_interval
+        self._subscribers: Set[Subscription] = set()
+        # Last progress of each running download, replayed to new subscribers
+        self._latest: Dict[int, Event] = {}
+
+    def configure(self, interval: Optional[float] = None):
+        if interval is not None:
+            interval = float(interval)
+            if not interval >= self.min_interval:
+                raise ValueError(
+                    f"progress_interval must be at least {self.min_interval} seconds"
+                )
+            self.interval = interval
+
+    def subscribe(
+        self,
+        download_ids: Optional[Iterable[int]] = None,
+        interval: Optional[float] = None,
+    ) -> Subscription:
+        if interval is None:
+            interval = self.interval
+        subscription = Subscription(
+            self, download_ids, max(interval, self.min_interval)
+        )
+        self._subscribers.add(subscription)
+        self.replay(subscription)
+        return subscription
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def replay(self, subscription: Subscription, download_id: Optional[int] = None):
+        """Hand a subscriber the current state of what it follows"""
+        for id, event in self._latest.items():
+            if (download_id is None or id == download_id) and subscription.wants(id):
+                subscription.offer(id, event)
+
+    def publish_progress(self, download_id: int, progress: Dict[str, Any]):
+        event = {"type": "progress", "download_id": download_id, "data": progress}
+        self._latest[download_id] = event
+        self._publish(download_id, event)
+
+    def publish_status(self, download_id: int, status: str, **data: Any):
+        """State change of a download, terminal states end its replay"""
+        event = {"type": "status", "download_id": download_id, "status": status, **data}
+        if status == Status.DOWNLOADING:
+            self._latest[download_id] = event
+        else:
+            self._latest.pop(download_id, None)
+        self._publish(download_id, event, urgent=True)
+
+    def _publish(self, download_id: int, event: Event, urgent: bool = False):
+        for subscription in self._subscribers:
+            if subscription.wants(download_id):
+                subscription.offer(download_id, event, urgent)
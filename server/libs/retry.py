@@ -0,0 +1,106 @@
+import random
+import re
+from typing import Optional
+
+from asyncyt.exceptions import YtDlpBase
+
+# Checked first, an error matching these is never retried
+PERMANENT_PATTERNS = [
+    r"HTTP Error (400|401|403|404|410|451)",
+    r"Unsupported URL",
+    r"Video unavailable",
+    r"Private video",
+    r"has been removed",
+    r"members-only|Join this channel",
+    r"Sign in to confirm your age",
+    r"not available in your country",
+    r"copyright",
+    r"Requested format is not available",
+    r"No space left on device",
+]
+
+RETRYABLE_PATTERNS = {
+    "throttled": [
+        r"HTTP Error 429",
+        r"Too Many Requests",
+        r"rate[- ]limit",
+    ],
+    "fragment": [
+        r"fragment \d+ not found",
+        r"Did not get any data blocks",
+        r"giving up after \d+ fragment retries",
+        r"fragment.*(error|failed)",
+    ],
+    "network": [
+        r"HTTP Error 5\d\d",
+        r"timed? ?out",
+        r"Connection (reset|refused|aborted)",
+        r"Remote end closed connection",
+        r"Temporary failure in name resolution",
+        r"Name or service not known",
+        r"Network is unreachable",
+        r"IncompleteRead",
+        r"EOF occurred in violation of protocol",
+        r"SSL: ",
+        r"Unable to download webpage",
+    ],
+}
+
+PERMANENT = re.compile("|".join(PERMANENT_PATTERNS), re.IGNORECASE)
+RETRYABLE = {
+    kind: re.compile("|".join(patterns), re.IGNORECASE)
+    for kind, patterns in RETRYABLE_PATTERNS.items()
+}
+
+
+def describe_error(error: BaseException) -> str:
+    """Error message including yt-dlp's own ERROR lines, which is where the cause is"""
+    message = str(error)
+    output = getattr(error, "output", None) if isinstance(error, YtDlpBase) else None
+    if output:
+        errors = [line for line in output.splitlines() if "ERROR" in line]
+        message += "\n" + "\n".join(errors[-5:] or output.splitlines()[-5:])
+    return message
+
+
+def classify_error(error: str) -> Optional[str]:
+    """Retryable class of an error ("throttled", "fragment", "network") or None"""
+    if PERMANENT.search(error):
+        return None
+    for kind, pattern in RETRYABLE.items():
+        if pattern.search(error):
+            return kind
+    return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter for retryable failures. Each retry waits
+    somewhere between half and all of `base * 2**attempt` (capped), throttling
+    starts from a longer base since hammering a host that sent 429 only
+    extends the ban.
+    """
+
+    def __init__(
+        self,
+        base: float = 5.0,
+        throttled_base: float = 30.0,
+        cap: float = 900.0,
+    ):
+        self.base = base
+        self.throttled_base = throttled_base
+        self.cap = cap
+
+    def delay(self, kind: str, attempt: int) -> float:
+        base = self.throttled_base if kind == "throttled" else self.base
+        ceiling = min(self.cap, base * 2**attempt)
+        return random.uniform(ceiling / 2, ceiling)
+
+    def retry_in(
+        self, error: str, retry_count: int, max_retries: int
+    ) -> Optional[float]:
+        """Seconds until the next attempt, None when the failure is final"""
+        kind = classify_error(error)
+        if kind is None or retry_count >= max_retries:
+            return None
+        return self.delay(kind, retry_count)
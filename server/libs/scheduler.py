@@ -0,0 +1,362 @@
+import asyncio
+from collections import Counter, OrderedDict
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from asyncyt import DownloadGotCanceledError, DownloadProgress
+
+from libs.Models import Downloads, DownloadType, Status
+from libs.db import db_writer, get_reader
+from libs.governor import HostGovernor, get_host
+from libs.storage import StorageGuard
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[DownloadProgress], Awaitable[None]]
+Runner = Callable[[Downloads, ProgressCallback], Awaitable[Any]]
+
+# Outcomes kept for callers that submit a row only after it already ran
+SETTLED_LIMIT = 256
+
+
+class DownloadRequeued(Exception):
+    """Raised by a runner that put its download back in the queue to retry later"""
+
+    def __init__(self, download_id: int, delay: float):
+        self.download_id = download_id
+        self.delay = delay
+        super().__init__(f"Download {download_id} will be retried in {delay:.0f}s")
+
+
+class DownloadScheduler:
+    """
+    Long-lived scheduler that pulls `Status.QUEUED` rows in priority order
+    and runs them through `runner`, with a global and a per-host limit. With
+    a `governor`, hosts also need a free request token and bandwidth share.
+    With a `storage` guard nothing starts while the scratch disk is full.
+    Playlist items only run once their playlist is opened with `open_group`,
+    optionally with a limit of its own.
+    """
+
+    def __init__(
+        self,
+        runner: Runner,
+        max_concurrent: int = 3,
+        max_per_host: int = 2,
+        poll_interval: float = 5.0,
+        governor: Optional[HostGovernor] = None,
+        storage: Optional[StorageGuard] = None,
+    ):
+        self.runner = runner
+        self.governor = governor
+        self.storage = storage
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.poll_interval = poll_interval
+
+        self.active: Dict[int, asyncio.Task] = {}
+        self._hosts: Dict[int, str] = {}
+        # Open playlists and how many of their items may run at once
+        self.groups: Dict[int, Optional[int]] = {}
+        self._groups: Dict[int, int] = {}
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._listeners: Dict[int, List[ProgressCallback]] = {}
+        self._settled: "OrderedDict[int, Tuple[Any, Optional[BaseException]]]" = OrderedDict()
+        # Running downloads being stopped to continue later, their waiters stay
+        self._pausing: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Recover interrupted downloads and start the scheduling loop"""
+        recovered = await db_writer.run(
+            lambda: Downloads.filter(
+                status=Status.DOWNLOADING, download_type=DownloadType.VIDEO
+            ).update(status=Status.QUEUED)
+        )
+        if recovered:
+            logger.info(f"Re-queued {recovered} interrupted downloads")
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop scheduling; running downloads are paused the same way as through
+        `pause` and left QUEUED, so the next start continues them.
+        """
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+        tasks = list(self.active.values())
+        ids = list(self.active.keys())
+        self._pausing.update(ids)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if ids:
+            await db_writer.run(
+                lambda: Downloads.filter(id__in=ids).update(status=Status.QUEUED)
+            )
+
+    def configure(
+        self, max_concurrent: Optional[int] = None, max_per_host: Optional[int] = None
+    ):
+        if max_concurrent is not None:
+            self.max_concurrent = max(1, int(max_concurrent))
+        if max_per_host is not None:
+            self.max_per_host = max(1, int(max_per_host))
+        self.wake()
+
+    def wake(self):
+        """Ask the loop to look at the queue right away"""
+        self._wakeup.set()
+
+    def wake_later(self, delay: float):
+        """Look at the queue again after `delay`, keeps only the earliest call"""
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        handle = self._wake_handle
+        if handle and not handle.cancelled() and loop.time() < handle.when() <= when:
+            return
+        if handle:
+            handle.cancel()
+        self._wake_handle = loop.call_at(when, self.wake)
+
+    def open_group(self, group_id: int, limit: Optional[int] = None):
+        """Let the items of playlist `group_id` run, at most `limit` at a time"""
+        self.groups[group_id] = limit
+        self.wake()
+
+    def close_group(self, group_id: int):
+        self.groups.pop(group_id, None)
+
+    @property
+    def fetching(self) -> int:
+        """Running downloads that hold a slot, those past `release_slot` don't"""
+        return len(self._hosts)
+
+    def release_slot(self, download_id: int):
+        """
+        Free the slot of a running download that is done with the network,
+        it stays active (and cancelable) while it is post-processed
+        """
+        if self._hosts.pop(download_id, None) is not None:
+            self._groups.pop(download_id, None)
+            self.wake()
+
+    def load(self, host: str) -> Tuple[int, int]:
+        """Running downloads on `host` and overall"""
+        on_host = sum(1 for h in self._hosts.values() if h == host)
+        return on_host, self.fetching
+
+    def submit(
+        self, download: Downloads, progress_callback: Optional[ProgressCallback] = None
+    ) -> asyncio.Future:
+        """
+        Wake the scheduler for a freshly queued row and return a future for
+        its result. The row is visible to the loop as soon as it is created,
+        so it may have run already, then the future resolves right away.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Callers may stop waiting (a closed socket), don't warn about their result
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        settled = self._settled.pop(download.id, None)
+        if settled:
+            result, exception = settled
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+            return future
+        self._waiters.setdefault(download.id, []).append(future)
+        if progress_callback:
+            self._listeners.setdefault(download.id, []).append(progress_callback)
+        self.wake()
+        return future
+
+    async def cancel(self, download_id: int) -> bool:
+        """Cancel a running or queued download, returns False if it was neither"""
+        task = self.active.get(download_id)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            return True
+
+        download = await Downloads.get_or_none(
+            id=download_id,
+            status__in=[Status.QUEUED, Status.PAUSED],
+            using_db=get_reader(),
+        )
+        if not download:
+            return False
+        await download.set_canceled()
+        self._resolve(
+            download_id, exception=DownloadGotCanceledError(str(download_id))
+        )
+        return True
+
+    def is_pausing(self, download_id: int) -> bool:
+        return download_id in self._pausing
+
+    async def pause(self, download_id: int) -> bool:
+        """
+        Stop a running or queued download so it can be resumed later, returns
+        False if it was neither. The runner records the paused state of a
+        running download, whoever waits on it keeps waiting.
+        """
+        task = self.active.get(download_id)
+        if task:
+            self._pausing.add(download_id)
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            return True
+
+        download = await Downloads.get_or_none(
+            id=download_id, status=Status.QUEUED, using_db=get_reader()
+        )
+        if not download:
+            return False
+        await download.set_paused()
+        return True
+
+    async def resume(self, download_id: int) -> bool:
+        """Queue a paused download again, returns False if it wasn't paused"""
+        download = await Downloads.get_or_none(
+            id=download_id, status=Status.PAUSED, using_db=get_reader()
+        )
+        if not download:
+            return False
+        await download.resume_download()
+        self.wake()
+        return True
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._fill_slots()
+            except Exception as e:
+                logger.exception(e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fill_slots(self):
+        free = self.max_concurrent - self.fetching
+        if free <= 0:
+            return
+        if self.storage and self.storage.low():
+            # Looked at again on the next poll
+            return
+
+        hosts = Counter(self._hosts.values())
+        groups = Counter(self._groups.values())
+        # Look further than the free slots so a busy host can't block the rest
+        queue = await Downloads.get_queue(
+            limit=len(self.active) + free * 5, using_db=get_reader()
+        )
+        for download in queue:
+            if free <= 0:
+                break
+            if download.id in self.active:
+                continue
+            host = get_host(download.url)
+            if hosts[host] >= self.max_per_host:
+                continue
+            group = download.parent_id
+            if group is not None:
+                # Not before every item of the playlist is queued and tracked
+                if group not in self.groups:
+                    continue
+                limit = self.groups[group]
+                if limit and groups[group] >= limit:
+                    continue
+            if self.governor and not self.governor.admit(
+                host, hosts[host], self.fetching
+            ):
+                # Out of tokens, otherwise a finishing download wakes us
+                delay = self.governor.retry_after(host)
+                if delay > 0:
+                    self.wake_later(delay)
+                continue
+            hosts[host] += 1
+            if group is not None:
+                groups[group] += 1
+            free -= 1
+            self._start(download, host)
+
+    def _start(self, download: Downloads, host: str):
+        self._hosts[download.id] = host
+        if download.parent_id is not None:
+            self._groups[download.id] = download.parent_id
+        self.active[download.id] = asyncio.create_task(self._execute(download))
+
+    async def _execute(self, download: Downloads):
+        try:
+            if not await download.start_download():
+                # Canceled or paused after it was read from the queue
+                return
+            result = await self.runner(download, self._progress_callback(download.id))
+        except DownloadRequeued as e:
+            # Waiters keep waiting for the retry
+            logger.info(str(e))
+            self.wake_later(e.delay)
+        except (asyncio.CancelledError, DownloadGotCanceledError) as e:
+            if download.id in self._pausing:
+                # Waiters and listeners carry over to the resumed run
+                self._pausing.discard(download.id)
+            else:
+                self._resolve(
+                    download.id, exception=DownloadGotCanceledError(str(download.id))
+                )
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        except Exception as e:
+            logger.warning(f"Download {download.id} failed: {e}")
+            self._resolve(download.id, exception=e)
+        else:
+            self._resolve(download.id, result=result)
+        finally:
+            self.active.pop(download.id, None)
+            self._hosts.pop(download.id, None)
+            self._groups.pop(download.id, None)
+            self.wake()
+
+    def _progress_callback(self, download_id: int) -> ProgressCallback:
+        async def progress_callback(progress: DownloadProgress):
+            for listener in self._listeners.get(download_id, []):
+                await listener(progress)
+
+        return progress_callback
+
+    def _resolve(
+        self,
+        download_id: int,
+        result: Any = None,
+        exception: Optional[BaseException] = None,
+    ):
+        self._listeners.pop(download_id, None)
+        waiters = self._waiters.pop(download_id, [])
+        if not waiters:
+            self._settled[download_id] = (result, exception)
+            while len(self._settled) > SETTLED_LIMIT:
+                self._settled.popitem(last=False)
+        for future in waiters:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from libs.Models import Users
+from libs.db import db_writer
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsService:
+    """
+    The user's settings held in memory. Loaded once at startup, reads never
+    touch the database and writes are flushed to `Users` after `flush_delay`,
+    so a burst of changes costs a single write.
+
+    Presets are kept in a dict keyed by uuid (in their saved order) and
+    written back as the usual `presets` list.
+    """
+
+    def __init__(self, user_id: int = 1, flush_delay: float = 0.5):
+        self.user_id = user_id
+        self.flush_delay = flush_delay
+        self.settings: Dict[str, Any] = {}
+        self.presets: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        user, _ = await db_writer.run(lambda: Users.get_or_create(id=self.user_id))
+        self.settings = dict(user.settings)
+        self.presets = {
+            preset["uuid"]: preset for preset in self.settings.pop("presets", [])
+        }
+
+    async def stop(self):
+        """Write out any pending change"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        if key == "presets":
+            return self.list_presets()
+        return self.settings.get(key, default)
+
+    def all(self) -> Dict[str, Any]:
+        return {**self.settings, "presets": self.list_presets()}
+
+    def set(self, key: str, value: Any):
+        if key == "presets":
+            self.presets = {preset["uuid"]: preset for preset in value}
+        else:
+            self.settings[key] = value
+        self._mark_dirty()
+
+    def list_presets(self) -> List[Dict[str, Any]]:
+        return list(self.presets.values())
+
+    def get_preset(self, uuid: str) -> Optional[Dict[str, Any]]:
+        return self.presets.get(uuid)
+
+    def put_preset(self, preset: Dict[str, Any]) -> Dict[str, Any]:
+        """Add a preset, or update the fields of the one with the same uuid"""
+        stored = self.presets.setdefault(preset["uuid"], {})
+        stored.update(preset)
+        self._mark_dirty()
+        return stored
+
+    def delete_preset(self, uuid: str) -> bool:
+        if self.presets.pop(uuid, None) is None:
+            return False
+        self._mark_dirty()
+        return True
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if not self._flush_task:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        settings = self.all()
+        try:
+            await db_writer.run(
+                lambda: Users.filter(id=self.user_id).update(settings=settings)
+            )
+        except Exception as e:
+            logger.error(f"Failed to save settings: {e}")
+            self._mark_dirty()
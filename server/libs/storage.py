@@ -0,0 +1,257 @@
+import errno
+import os
+from pathlib import Path
+import re
+import shutil
+import uuid
+from typing import Any, Dict, Optional
+
+from asyncyt import DownloadConfig, VideoInfo
+from asyncyt.enums import Quality
+
+# Kept free on every disk, so the system and other programs don't run dry
+DEFAULT_MIN_FREE = 1024**3
+# How long a download that doesn't fit yet waits before it is looked at again
+DEFER_SECONDS = 30.0
+# Container overhead, subtitles and thumbnails on top of the stream sizes
+SIZE_MARGIN = 1.05
+
+HEIGHT_PATTERN = re.compile(r"^(\d+)p$")
+
+
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+
+def format_size_of(format: Dict[str, Any], duration: float) -> int:
+    size = format.get("filesize") or format.get("filesize_approx")
+    if size:
+        return int(size)
+    # Total bitrate in kbit/s, what yt-dlp itself estimates from
+    if format.get("tbr") and duration:
+        return int(format["tbr"] * 125 * duration)
+    return 0
+
+
+def estimate_size(info: VideoInfo, config: DownloadConfig) -> int:
+    """
+    Bytes the download will take, from the sizes yt-dlp lists per format:
+    the largest fitting video stream plus the largest audio stream, as
+    "best" picks. 0 when the extractor lists no sizes.
+    """
+    duration = float(info.duration or 0)
+    video = 0
+    audio = 0
+    combined = 0
+    max_height = None
+    match = HEIGHT_PATTERN.match(str(config.quality))
+    if match:
+        max_height = int(match.group(1))
+    for format in info.formats:
+        size = format_size_of(format, duration)
+        if not size:
+            continue
+        has_video = format.get("vcodec") not in (None, "none")
+        has_audio = format.get("acodec") not in (None, "none")
+        if has_video and max_height and (format.get("height") or 0) > max_height:
+            continue
+        if has_video and has_audio:
+            combined = max(combined, size)
+        elif has_video:
+            video = max(video, size)
+        elif has_audio:
+            audio = max(audio, size)
+        else:
+            # Extractors that don't say what a format holds
+            combined = max(combined, size)
+
+    if config.extract_audio or config.quality == Quality.AUDIO_ONLY:
+        size = audio or combined
+    elif config.quality == Quality.VIDEO_ONLY:
+        size = video or combined
+    else:
+        size = max(video + audio, combined)
+    return int(size * SIZE_MARGIN)
+
+
+def existing_parent(path: Path) -> Path:
+    """`path` or its nearest ancestor that exists, for paths not created yet"""
+    path = path.resolve()
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path
+
+
+def move_atomic(source: Path, target: Path) -> Path:
+    """
+    Move a finished file so `target` is either missing or complete. On the
+    same filesystem that's a rename, otherwise the copy goes to a hidden
+    name next to `target` first and is renamed over it once whole.
+    """
+    try:
+        os.replace(source, target)
+        return target
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp = target.with_name(f".{target.name}.{uuid.uuid4().hex[:8]}.part")
+    try:
+        shutil.copy2(source, temp)
+        os.replace(temp, target)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+    source.unlink()
+    return target
+
+
+class InsufficientSpace(Exception):
+    """A download needs more space than the disk has, even with nothing else running"""
+
+    def __init__(self, path: Path, needed: int, available: int):
+        self.path = path
+        self.needed = needed
+        self.available = available
+        super().__init__(
+            f"Not enough disk space on {path}: needs {format_size(needed)}, "
+            f"{format_size(max(0, available))} available"
+        )
+
+
+class SpaceDeferred(InsufficientSpace):
+    """A download doesn't fit next to the running ones, it can start once they are done"""
+
+
+class Reservation:
+    __slots__ = ("needs", "scratch", "written")
+
+    def __init__(self, needs: Dict[int, int], scratch: int, written: int = 0):
+        # Device -> bytes the download will write there
+        self.needs = needs
+        self.scratch = scratch
+        self.written = written
+
+    def remaining(self, device: int) -> int:
+        """Bytes still to be written to `device`, what's on disk already shows as used"""
+        needed = self.needs.get(device, 0)
+        if device == self.scratch:
+            needed -= self.written
+        return max(0, needed)
+
+
+class StorageGuard:
+    """
+    Disk space admission for downloads. Every started download reserves
+    its estimated size on the scratch disk (twice when it is re-encoded,
+    the source and the encode sit side by side) and on the output disk
+    when that is another one. A download that doesn't fit next to the
+    reservations of the running ones is deferred, one that doesn't fit at
+    all is refused. `min_free` bytes are always left alone.
+    """
+
+    def __init__(self, scratch_dir: Path, min_free: int = DEFAULT_MIN_FREE):
+        self.scratch_dir = Path(scratch_dir)
+        self.min_free = min_free
+        self.reservations: Dict[int, Reservation] = {}
+        # A path on every device seen, to measure its free space
+        self._paths: Dict[int, Path] = {}
+        self.deferred = 0
+        self.refused = 0
+
+    def configure(self, min_free: Optional[int] = None, scratch_dir: Optional[Path] = None):
+        if min_free is not None:
+            self.min_free = max(0, int(min_free))
+        if scratch_dir is not None:
+            self.scratch_dir = Path(scratch_dir)
+
+    def device(self, path: Path) -> int:
+        parent = existing_parent(path)
+        device = parent.stat().st_dev
+        self._paths.setdefault(device, parent)
+        return device
+
+    def free(self, device: int) -> int:
+        return shutil.disk_usage(self._paths[device]).free
+
+    def reserved(self, device: int, exclude: Optional[int] = None) -> int:
+        return sum(
+            reservation.remaining(device)
+            for download_id, reservation in self.reservations.items()
+            if download_id != exclude
+        )
+
+    def available(self, device: int, exclude: Optional[int] = None) -> int:
+        return self.free(device) - self.min_free - self.reserved(device, exclude)
+
+    def low(self) -> bool:
+        """No room left on the scratch disk, starting anything now is pointless"""
+        try:
+            return self.available(self.device(self.scratch_dir)) <= 0
+        except OSError:
+            return False
+
+    def reserve(
+        self,
+        download_id: int,
+        size: int,
+        output_dir: Path,
+        encode: bool = False,
+        written: int = 0,
+    ):
+        """
+        Hold `size` bytes for a download that has `written` of them on the
+        scratch disk already, or raise `SpaceDeferred` (retry later) or
+        `InsufficientSpace` (give up). An unknown size of 0 only has to find
+        the disks above `min_free`.
+        """
+        scratch = self.device(self.scratch_dir)
+        output = self.device(output_dir)
+        needs = {scratch: size * 2 if encode else size}
+        if output != scratch:
+            needs[output] = size
+        reservation = Reservation(needs, scratch, written)
+
+        for device in needs:
+            needed = reservation.remaining(device)
+            available = self.available(device, download_id)
+            if 0 < available and needed <= available:
+                continue
+            # The running downloads may be what's in the way
+            if self.reserved(device, download_id):
+                self.deferred += 1
+                raise SpaceDeferred(self._paths[device], needed, available)
+            self.refused += 1
+            raise InsufficientSpace(self._paths[device], needed, available)
+        self.reservations[download_id] = reservation
+
+    def progress(self, download_id: int, written: int):
+        """Bytes a download has on the scratch disk by now, resumed ones included"""
+        reservation = self.reservations.get(download_id)
+        if reservation:
+            reservation.written = written
+
+    def release(self, download_id: int):
+        self.reservations.pop(download_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        disks = []
+        for device, path in self._paths.items():
+            try:
+                free = self.free(device)
+            except OSError:
+                continue
+            disks.append(
+                {"path": str(path), "free": free, "reserved": self.reserved(device)}
+            )
+        return {
+            "scratch_dir": str(self.scratch_dir),
+            "min_free": self.min_free,
+            "running": len(self.reservations),
+            "deferred": self.deferred,
+            "refused": self.refused,
+            "disks": disks,
+        }
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from asyncyt import AsyncYT, PlaylistConfig
+from asyncyt.basemodels import PlaylistInfo, PlaylistVideoInfo
+
+from libs.Models import (
+    Downloads,
+    DownloadType,
+    SubscriptionEntries,
+    Subscriptions,
+    utcnow,
+)
+from libs.db import db_writer, get_reader
+from libs.playlists import select_entries
+from libs.retry import describe_error
+
+logger = logging.getLogger(__name__)
+
+RecordItems = Callable[[List[Downloads]], Awaitable[Any]]
+QueuePlaylist = Callable[
+    [Downloads, PlaylistConfig, PlaylistInfo, List[PlaylistVideoInfo], RecordItems],
+    Awaitable[List[Downloads]],
+]
+
+
+def entry_key(entry: PlaylistVideoInfo) -> str:
+    """What identifies an entry across syncs, its video id when yt-dlp gives one"""
+    return entry.id or entry.url
+
+
+class SubscriptionSyncer:
+    """
+    Keeps subscriptions up to date. A sync lists the playlist flat, diffs it
+    against the entries already queued for it and queues only the new ones,
+    as a playlist row of their own.
+    """
+
+    def __init__(
+        self,
+        downloader: AsyncYT,
+        queue_playlist: QueuePlaylist,
+        check_interval: float = 60.0,
+    ):
+        self.downloader = downloader
+        self.queue_playlist = queue_playlist
+        self.check_interval = check_interval
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def sync(
+        self, subscription: Subscriptions, download: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Queue the entries not seen before. With `download=False` they are only
+        recorded as seen, which is how a subscription skips its back catalogue.
+        """
+        lock = self._locks.setdefault(subscription.id, asyncio.Lock())
+        async with lock:
+            try:
+                result = await self._sync(subscription, download)
+            except Exception as e:
+                subscription.error = describe_error(e)[:2000]
+                subscription.last_synced = utcnow()
+                await db_writer.run(
+                    lambda: subscription.save(update_fields=["error", "last_synced"])
+                )
+                raise
+        return result
+
+    async def _sync(
+        self, subscription: Subscriptions, download: bool
+    ) -> Dict[str, Any]:
+        config = PlaylistConfig.model_validate(subscription.config)
+        info = await self.downloader.get_playlist_info(
+            subscription.url, max_videos=config.max_videos or None
+        )
+        seen = set(
+            await SubscriptionEntries.filter(subscription_id=subscription.id)
+            .using_db(get_reader())
+            .values_list("entry_id", flat=True)
+        )
+        new: Dict[str, PlaylistVideoInfo] = {}
+        for entry in select_entries(info, config):
+            key = entry_key(entry)
+            if key not in seen:
+                new.setdefault(key, entry)
+
+        subscription.title = info.title
+        subscription.error = None
+        subscription.last_synced = utcnow()
+
+        async def record(download_ids: List[Optional[int]]):
+            await SubscriptionEntries.bulk_create(
+                [
+                    SubscriptionEntries(
+                        subscription_id=subscription.id,
+                        entry_id=key,
+                        download_id=download_id,
+                    )
+                    for key, download_id in zip(new, download_ids)
+                ]
+            )
+            await subscription.save(update_fields=["title", "error", "last_synced"])
+
+        playlist = None
+        download_ids: List[Optional[int]] = [None] * len(new)
+        if new and download:
+
+            async def queue() -> Tuple[Downloads, List[Downloads]]:
+                # One transaction with the items and entries, a failed sync
+                # leaves no playlist row behind and a crash can't queue twice
+                playlist = await Downloads.create_download(
+                    subscription.url, config, download_type=DownloadType.PLAYLIST
+                )
+                # Playlists never enter the scheduler's queue, this only marks it started
+                await playlist.start_download()
+                await playlist.setInfo({"subscription_id": subscription.id})
+                items = await self.queue_playlist(
+                    playlist,
+                    config,
+                    info,
+                    list(new.values()),
+                    lambda items: record([item.id for item in items]),
+                )
+                return playlist, items
+
+            playlist, items = await db_writer.run(queue)
+            download_ids = [item.id for item in items]
+        else:
+            await db_writer.run(lambda: record(download_ids))
+
+        if new:
+            logger.info(f"Subscription {subscription.id} has {len(new)} new entries")
+        return {
+            "id": subscription.id,
+            "new_entries": len(new),
+            "playlist_id": playlist.id if playlist else None,
+            "ids": [id for id in download_ids if id is not None],
+        }
+
+    async def forget(self, subscription_id: int):
+        """Drop a subscription and its index of seen entries"""
+        async with self._locks.pop(subscription_id, asyncio.Lock()):
+
+            async def delete():
+                await SubscriptionEntries.filter(
+                    subscription_id=subscription_id
+                ).delete()
+                await Subscriptions.filter(id=subscription_id).delete()
+
+            await db_writer.run(delete)
+
+    async def _run(self):
+        while True:
+            try:
+                subscriptions = await Subscriptions.filter(
+                    interval__isnull=False
+                ).using_db(get_reader())
+                for subscription in subscriptions:
+                    if not subscription.is_due:
+                        continue
+                    try:
+                        await self.sync(subscription)
+                    except Exception as e:
+                        logger.warning(
+                            f"Syncing subscription {subscription.id} failed: {e}"
+                        )
+            except Exception as e:
+                logger.exception(e)
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,246 @@
+import asyncio
+from collections import OrderedDict
+import hashlib
+from io import BytesIO
+import logging
+import os
+from pathlib import Path
+import re
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from libs.Models import Downloads
+from libs.db import db_writer, get_reader
+
+logger = logging.getLogger(__name__)
+
+# Boxes the downscaled variants fit in, the aspect ratio is kept
+VARIANTS = {
+    "list": (160, 90),
+    "card": (480, 270),
+}
+ORIGINAL = "original"
+WEBP_QUALITY = 80
+DEFAULT_BUDGET = 256 * 1024**2
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif"}
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".gif": "image/gif",
+}
+
+
+def write_atomic(path: Path, data: bytes):
+    temp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        temp.write_bytes(data)
+        os.replace(temp, path)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+def render_variant(source: Path, box: Tuple[int, int]) -> bytes:
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(box, Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        out = BytesIO()
+        image.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+        return out.getvalue()
+
+
+class ThumbnailStore:
+    """
+    Thumbnails kept once per distinct image, named by the sha256 of their
+    bytes, so downloads of the same video share one file. Downscaled WebP
+    variants are rendered on first request and kept under `budget` bytes,
+    the least recently served go first; originals stay while a download
+    points at them.
+    """
+
+    def __init__(self, root: Path, budget: int = DEFAULT_BUDGET):
+        self.originals = root / "originals"
+        self.variants = root / "variants"
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        # Variant file name -> size, least recently served first
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._rendering: Dict[Path, asyncio.Future] = {}
+
+    def load(self):
+        """Index the variants on disk, oldest first as the order they were served is lost"""
+        self.originals.mkdir(parents=True, exist_ok=True)
+        self.variants.mkdir(parents=True, exist_ok=True)
+        entries = sorted(
+            (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+            for entry in os.scandir(self.variants)
+            if entry.is_file() and not entry.name.startswith(".")
+        )
+        self._lru = OrderedDict((name, size) for _, name, size in entries)
+        self._size = sum(self._lru.values())
+        self._evict()
+
+    def configure(self, budget: Optional[int] = None):
+        if budget is not None:
+            self.budget = max(0, int(budget))
+            self._evict()
+
+    def digest_of(self, path: Optional[str]) -> Optional[str]:
+        """Hash of a stored original from its path, None for files outside the store"""
+        if not path:
+            return None
+        stored = Path(path)
+        if stored.parent != self.originals.resolve() or not DIGEST_PATTERN.match(stored.stem):
+            return None
+        return stored.stem
+
+    def original(self, digest: str) -> Optional[Path]:
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        for path in self.originals.glob(f"{digest}.*"):
+            return path
+        return None
+
+    def _put(self, data: bytes) -> Path:
+        digest = hashlib.sha256(data).hexdigest()
+        existing = self.original(digest)
+        if existing:
+            return existing
+        try:
+            with Image.open(BytesIO(data)) as image:
+                extension = EXTENSIONS.get(image.format or "", ".jpg")
+        except (OSError, Image.DecompressionBombError):
+            # Kept as it came, it's served without variants
+            extension = ".jpg"
+        path = self.originals / f"{digest}{extension}"
+        write_atomic(path, data)
+        return path
+
+    async def put(self, data: bytes) -> Path:
+        """Store an image, returns the path of the copy every download with it shares"""
+        return await asyncio.to_thread(self._put, data)
+
+    async def adopt(self, download: Downloads) -> Optional[str]:
+        """
+        Hash of a download's thumbnail, moving a file saved before the store
+        (thumbnails/{id}.jpg) into it first
+        """
+        digest = self.digest_of(download.thumbnail_path)
+        if digest or not download.thumbnail_path:
+            return digest
+        legacy = Path(download.thumbnail_path)
+        try:
+            data = await asyncio.to_thread(legacy.read_bytes)
+        except FileNotFoundError:
+            return None
+        path = await self.put(data)
+        download.thumbnail_path = str(path.resolve())
+        await db_writer.run(
+            lambda: Downloads.filter(thumbnail_path=str(legacy)).update(
+                thumbnail_path=download.thumbnail_path
+            )
+        )
+        await asyncio.to_thread(legacy.unlink, True)
+        return path.stem
+
+    async def get(self, digest: str, size: str) -> Tuple[bytes, str]:
+        """
+        Bytes and media type of a variant, raises FileNotFoundError for
+        unknown images. Read into memory, so an eviction can't pull a file
+        from under a response that is still being sent.
+        """
+        source = self.original(digest)
+        if source is None:
+            raise FileNotFoundError(digest)
+        if size == ORIGINAL:
+            return await self._read_original(source)
+
+        path = self.variants / f"{digest}-{size}.webp"
+        if path.name in self._lru:
+            self._lru.move_to_end(path.name)
+            try:
+                data = await asyncio.to_thread(path.read_bytes)
+            except FileNotFoundError:
+                # Evicted meanwhile or removed by hand, rendered again below
+                self._forget(path.name)
+            else:
+                self.hits += 1
+                return data, "image/webp"
+
+        # Another request may be rendering the same variant already
+        pending = self._rendering.get(path)
+        if pending:
+            await asyncio.wait([pending])
+            return await self.get(digest, size)
+        self.misses += 1
+        self._rendering[path] = asyncio.get_running_loop().create_future()
+        try:
+            data = await asyncio.to_thread(render_variant, source, VARIANTS[size])
+            # Larger than the whole budget, served without being kept
+            if len(data) <= self.budget:
+                await asyncio.to_thread(write_atomic, path, data)
+                self._add(path.name, len(data))
+        except (OSError, Image.DecompressionBombError) as e:
+            # Not an image Pillow reads, the original is all there is
+            logger.warning(f"Can't downscale thumbnail {digest}: {e}")
+            return await self._read_original(source)
+        finally:
+            self._rendering.pop(path).set_result(None)
+        return data, "image/webp"
+
+    async def _read_original(self, source: Path) -> Tuple[bytes, str]:
+        data = await asyncio.to_thread(source.read_bytes)
+        return data, MEDIA_TYPES.get(source.suffix, "application/octet-stream")
+
+    async def release(self, path: Optional[str]):
+        """Delete a stored original and its variants once no download uses it"""
+        digest = self.digest_of(path)
+        if not digest:
+            return
+        if await Downloads.filter(thumbnail_path=path).using_db(get_reader()).exists():
+            return
+        await asyncio.to_thread(Path(path).unlink, True)  # type: ignore[arg-type]
+        for size in VARIANTS:
+            name = f"{digest}-{size}.webp"
+            self._discard(name)
+
+    def _add(self, name: str, size: int):
+        """Index a new variant, at most `budget` bytes so evicting never reaches it"""
+        self._forget(name)
+        self._lru[name] = size
+        self._size += size
+        self._evict()
+
+    def _forget(self, name: str) -> bool:
+        size = self._lru.pop(name, None)
+        if size is None:
+            return False
+        self._size -= size
+        return True
+
+    def _discard(self, name: str):
+        if self._forget(name):
+            (self.variants / name).unlink(missing_ok=True)
+
+    def _evict(self):
+        while self._size > self.budget and self._lru:
+            name = next(iter(self._lru))
+            self._discard(name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "variants": len(self._lru),
+            "size": self._size,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import aiohttp
+
+from libs.Models import Downloads
+from libs.db import db_writer
+from libs.thumbnail_store import ThumbnailStore
+from libs.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailFetchError(Exception):
+    def __init__(self, url: str, status: int):
+        self.url = url
+        self.status = status
+        super().__init__(f"Thumbnail request failed with HTTP {status}: {url}")
+
+
+class ThumbnailFetcher:
+    """
+    Background stage that saves thumbnails of finished downloads into
+    `store`, so the download itself is marked finished without waiting on
+    the image.
+    """
+
+    def __init__(
+        self,
+        store: ThumbnailStore,
+        workers: int = 4,
+        timeout: float = 15.0,
+        retries: int = 3,
+        max_pending: int = 1000,
+    ):
+        self.store = store
+        self.workers = workers
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.queue: asyncio.Queue[Tuple[int, str]] = asyncio.Queue(max_pending)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, session: aiohttp.ClientSession):
+        self.session = session
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self, drain_timeout: float = 5.0):
+        """Give queued thumbnails a moment to finish, then stop the workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.queue.qsize()} pending thumbnails")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, download_id: int, url: Optional[str]):
+        if not url:
+            return
+        try:
+            self.queue.put_nowait((download_id, url))
+        except asyncio.QueueFull:
+            logger.warning(f"Thumbnail queue full, skipping download {download_id}")
+
+    async def _worker(self):
+        while True:
+            download_id, url = await self.queue.get()
+            try:
+                await self._save(download_id, url)
+            except Exception as e:
+                logger.warning(f"Failed to fetch thumbnail for {download_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _save(self, download_id: int, url: str):
+        with tracer.span("thumbnail", download_id=download_id):
+            data = await self._fetch(url)
+            filepath = await self.store.put(data)
+            await db_writer.run(
+                lambda: Downloads.filter(id=download_id).update(
+                    thumbnail_path=str(filepath.resolve())
+                )
+            )
+
+    async def _fetch(self, url: str) -> bytes:
+        """GET the image, retrying timeouts, connection errors, 429 and 5xx"""
+        assert self.session, "ThumbnailFetcher.start() was not called"
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.session.get(url, timeout=self.timeout) as resp:
+                    if resp.status == 200:
+                        return await resp.read()
+                    if resp.status != 429 and resp.status < 500:
+                        raise ThumbnailFetchError(url, resp.status)
+                    error: Exception = ThumbnailFetchError(url, resp.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.InvalidURL):
+                    raise
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(delay)
+                delay *= 2
+        raise error
@@ -0,0 +1,161 @@
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import itertools
+import json
+import os
+from pathlib import Path
+import time
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+
+class Span:
+    """One timed stage of a download"""
+
+    __slots__ = ("id", "parent_id", "download_id", "name", "start", "end", "attrs", "error")
+
+    def __init__(
+        self,
+        id: int,
+        parent_id: Optional[int],
+        download_id: Optional[int],
+        name: str,
+        attrs: Dict[str, Any],
+    ):
+        self.id = id
+        self.parent_id = parent_id
+        self.download_id = download_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "download_id": self.download_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": round(self.duration, 6) if self.end is not None else None,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Spans of the stages each download goes through (extraction, fetch,
+    encode, finalize, database writes, thumbnail), kept in a ring buffer of
+    the last `maxlen` finished spans.
+
+    A span started with a `download_id` becomes the parent of every span
+    opened under it in the same task, so code that doesn't know which
+    download it works for (the database writer, the downloader) only opens
+    `child` spans, which are skipped outside a traced download.
+    """
+
+    def __init__(self, maxlen: int = 20000):
+        self.spans: Deque[Span] = deque(maxlen=maxlen)
+        self._open: Dict[int, Span] = {}
+        self._ids = itertools.count(1)
+
+    @contextmanager
+    def span(
+        self, name: str, download_id: Optional[int] = None, **attrs: Any
+    ) -> Iterator[Span]:
+        parent = _current.get()
+        if download_id is None and parent is not None:
+            download_id = parent.download_id
+        span = Span(
+            next(self._ids),
+            parent.id if parent else None,
+            download_id,
+            name,
+            attrs,
+        )
+        self._open[span.id] = span
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            span.end = time.time()
+            self._open.pop(span.id, None)
+            self.spans.append(span)
+
+    def child(self, name: str, **attrs: Any):
+        """A span under the current download's, or nothing when there is none"""
+        if _current.get() is None:
+            return nullcontext()
+        return self.span(name, **attrs)
+
+    def current(self) -> Optional[Span]:
+        return _current.get()
+
+    def timeline(self, download_id: int) -> List[Dict[str, Any]]:
+        """Every span of a download, running ones included, in start order"""
+        spans = [s for s in self.spans if s.download_id == download_id]
+        spans += [s for s in self._open.values() if s.download_id == download_id]
+        spans.sort(key=lambda s: (s.start, s.id))
+        depths: Dict[int, int] = {}
+        items = []
+        for span in spans:
+            depth = depths.get(span.parent_id, -1) + 1 if span.parent_id else 0
+            depths[span.id] = depth
+            items.append({**span.to_dict(), "depth": depth})
+        return items
+
+    def chrome_trace(self, download_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """Spans in the Chrome trace event format, one track per download"""
+        wanted = set(download_ids) if download_ids else None
+        events: List[Dict[str, Any]] = []
+        tracks = set()
+        for span in list(self.spans):
+            if wanted is not None and span.download_id not in wanted:
+                continue
+            track = span.download_id or 0
+            tracks.add(track)
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.name.split(".")[0],
+                    "ph": "X",
+                    "ts": int(span.start * 1_000_000),
+                    "dur": int((span.duration or 0) * 1_000_000),
+                    "pid": os.getpid(),
+                    "tid": track,
+                    "args": {**span.attrs, **({"error": span.error} if span.error else {})},
+                }
+            )
+        for track in tracks:
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": track,
+                    "args": {"name": f"download {track}" if track else "server"},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path: Path, download_ids: Optional[Iterable[int]] = None) -> Path:
+        """Write a Chrome trace file, loadable in chrome://tracing or Perfetto"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.chrome_trace(download_ids)), encoding="utf-8")
+        return path
+
+
+tracer = Tracer()
@@ -1,12 +1,15 @@
 import asyncio
 from contextlib import asynccontextmanager
+import json
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 from pathlib import Path
 import re
 import sys
-from typing import Optional
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Literal, Optional
+import aiohttp
 from fastapi import (
     FastAPI,
     BackgroundTasks,
@@ -14,9 +17,14 @@ from fastapi import (
     WebSocket,
     WebSocketDisconnect,
     APIRouter,
+    Query,
+    Request,
+    Response,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from tortoise.contrib.fastapi import register_tortoise
+from tortoise.functions import Count
 from pydantic import BaseModel
 import uvicorn
 import uuid
@@ -24,46 +32,89 @@ from rich.console import Console
 from rich.logging import RichHandler
 from rich.theme import Theme
 from asyncyt import (
-    AsyncYT,
     DownloadGotCanceledError,
     DownloadRequest,
     SearchRequest,
     PlaylistRequest,
+    PlaylistConfig,
     DownloadResponse,
     SearchResponse,
-    PlaylistResponse,
     HealthResponse,
     DownloadProgress,
+    ProgressStatus,
     VideoInfo,
     DownloadConfig,
     Quality,
     AudioFormat,
     VideoFormat,
+    VideoCodec,
     DownloadNotFoundError,
     get_unique_path,
 )
+from asyncyt.basemodels import PlaylistInfo, PlaylistVideoInfo
 from asyncyt.utils import get_unique_filename
 from libs.Models import (
     TORTOISE_ORM,
     DownloadType,
     Downloads,
+    MediaEntries,
+    Status,
+    SubscriptionEntries,
+    Subscriptions,
     Update,
-    Users,
     decode_presets_from_base64,
     encode_presets_to_base64,
     get_data_path,
     is_bundled,
+    parse_speed,
+    thumbnailsPath,
 )
+from libs.progress import ProgressBuffer, progress_fields
+from libs.progress_hub import ProgressHub
+from libs.backends import DEFAULT_BACKEND, create_downloader
+from libs.batches import BatchRegistry
+from libs.benchmark import EncoderBenchmark
+from libs.db import db_writer, get_reader
+from libs.dedup import MediaIndex
+from libs.downloader import MihariDownloader
+from libs.encoder import EncodePool, needs_encoding
+from libs.governor import GOVERNOR_SETTINGS, HostGovernor, get_host, parse_rate
+from libs.metrics import DOWNLOADED_BYTES, metrics
+from libs.history_search import search_history, setup_history_search
+from libs.playlists import PlaylistRegistry, entry_metadata, select_entries
+from libs.retry import RetryPolicy, describe_error
+from libs.scheduler import DownloadRequeued, DownloadScheduler
+from libs.settings import SettingsService
+from libs.storage import DEFER_SECONDS, SpaceDeferred, StorageGuard, estimate_size
+from libs.subscriptions import SubscriptionSyncer
+from libs.thumbnail_store import ThumbnailStore
+from libs.thumbnails import ThumbnailFetcher
+from libs.tracing import tracer
 from libs.basemodels import (
+    BenchmarkRequest,
     GetSettings,
     Preset,
     PresetExport,
     PresetPath,
     PresetPath,
     SaveSettings,
+    SubscriptionRequest,
 )
 
-downloader: AsyncYT = AsyncYT(get_data_path() / "bin")
+governor = HostGovernor()
+encoder = EncodePool()
+encoder_benchmark = EncoderBenchmark(encoder)
+storage = StorageGuard(get_data_path() / "partial")
+# MIHARI_BACKEND=mock (or stub) swaps yt-dlp for a local fake, for load testing
+downloader: MihariDownloader = create_downloader(
+    os.environ.get("MIHARI_BACKEND", DEFAULT_BACKEND),
+    get_data_path() / "bin",
+    staging_dir=storage.scratch_dir,
+    governor=governor,
+    encoder=encoder,
+    tuner=encoder_benchmark,
+    options=json.loads(os.environ.get("MIHARI_BACKEND_OPTIONS") or "{}"),
+)
 HEARTBEAT_INTERVAL = 15
 
 
@@ -140,11 +191,57 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("Something went wrong while Updating")
 
+    await setup_history_search()
+    db_writer.start()
+
     if not is_bundled():
         logger.info("initializing AsyncYT.. (In dev mode)")
         await downloader.setup_binaries()
         logger.info("Finished initialize AsyncYT.")
+
+    # One pooled session for every outgoing HTTP request the server makes
+    app.state.http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300)
+    )
+    thumbnail_store.load()
+    thumbnail_fetcher.start(app.state.http_session)
+
+    await settings.load()
+    progress_hub.configure(settings.get("progress_interval"))
+    governor.configure(
+        **{arg: settings.get(key) for key, arg in GOVERNOR_SETTINGS.items()}
+    )
+    scheduler.configure(
+        settings.get("max_concurrent_downloads"),
+        settings.get("max_concurrent_per_host"),
+    )
+    encoder.configure(settings.get("max_concurrent_encodes"))
+    if settings.get("thumbnail_cache_size") is not None:
+        thumbnail_store.configure(int(parse_rate(settings.get("thumbnail_cache_size"))))
+    configure_storage(settings.get("scratch_path"), settings.get("storage_min_free"))
+    if settings.get("encode_target_speed") is not None:
+        encoder_benchmark.target_speed = float(settings.get("encode_target_speed"))
+    await encoder_benchmark.load()
+    await progress_buffer.start()
+    # Items of unfinished playlists continue where they left off
+    for playlist in await playlists.load():
+        scheduler.open_group(playlist.id, playlist.metadata.get("concurrency"))
+    await scheduler.start()
+    logger.info(
+        f"Download scheduler started ({scheduler.max_concurrent} slots, "
+        f"{scheduler.max_per_host} per host)"
+    )
+    await subscriptions.start()
     yield
+    await subscriptions.stop()
+    await encoder_benchmark.stop()
+    await scheduler.stop()
+    await progress_buffer.stop()
+    await thumbnail_fetcher.stop()
+    await downloader.close()
+    await app.state.http_session.close()
+    await settings.stop()
+    await db_writer.stop()
 
 
 app = FastAPI(
@@ -164,16 +261,290 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
-def create_progress_callback(download: Downloads):
+progress_buffer = ProgressBuffer()
+progress_hub = ProgressHub()
+thumbnail_store = ThumbnailStore(thumbnailsPath)
+thumbnail_fetcher = ThumbnailFetcher(thumbnail_store)
+retry_policy = RetryPolicy()
+media_index = MediaIndex()
+playlists = PlaylistRegistry(
+    progress_hub, on_settled=lambda playlist_id: scheduler.close_group(playlist_id)
+)
+
+
+def publish_status(download_id: int, status: str, **data):
+    """Publish a status change, also counting it towards the item's playlist"""
+    progress_hub.publish_status(download_id, status, **data)
+    playlists.update(download_id, status)
+
+
+def create_progress_callback(download: Downloads, listener=None):
     async def progress_callback(progress: DownloadProgress):
-        await download.update_progress(progress)
+        if progress.status == ProgressStatus.DOWNLOADED:
+            # Fetched, the encode stage doesn't need a network slot
+            scheduler.release_slot(download.id)
+        previous = progress_buffer.get(download.id)
+        fetched = previous.downloaded_bytes if previous else download.downloaded_bytes
+        if progress.downloaded_bytes > (fetched or 0):
+            DOWNLOADED_BYTES.inc(progress.downloaded_bytes - (fetched or 0))
+            storage.progress(download.id, progress.downloaded_bytes)
+        progress_buffer.update(download.id, progress)
+        progress_hub.publish_progress(download.id, progress.model_dump())
+        playlists.progress(download.id, progress.percentage)
+        if listener:
+            await listener(progress)
 
     return progress_callback
 
 
+async def retry_or_fail(download: Downloads, error: str):
+    """Queue a retryable failure again (raises `DownloadRequeued`) or mark it failed"""
+    delay = retry_policy.retry_in(error, download.retry_count, download.max_retries)
+    if delay is None:
+        await download.set_failed(error)
+        await downloader.discard_partial(download.id)
+        publish_status(download.id, Status.FAILED, error=error)
+        return
+
+    # Partial files are kept, the retry continues them
+    await download.set_retrying(error, delay)
+    publish_status(
+        download.id,
+        Status.QUEUED,
+        error=error,
+        retry_count=download.retry_count,
+        retry_at=download.retry_at.isoformat() if download.retry_at else None,
+    )
+    raise DownloadRequeued(download.id, delay)
+
+
+def configure_storage(scratch_path: Optional[str] = None, min_free: Any = None):
+    """Point partial files at `scratch_path` (the data folder's when unset)"""
+    if min_free is not None:
+        storage.configure(min_free=int(parse_rate(min_free)))
+    scratch = Path(scratch_path) if scratch_path else get_data_path() / "partial"
+    scratch.mkdir(parents=True, exist_ok=True)
+    # Rows paused before a change start over, their .part files stay in the old place
+    storage.configure(scratch_dir=scratch)
+    downloader.staging_dir = scratch
+
+
+async def defer_download(download: Downloads, reason: str):
+    """Put a download that has to wait for disk space back in the queue (raises `DownloadRequeued`)"""
+    await download.set_deferred(reason, DEFER_SECONDS)
+    publish_status(
+        download.id,
+        Status.QUEUED,
+        error=reason,
+        retry_at=download.retry_at.isoformat() if download.retry_at else None,
+    )
+    raise DownloadRequeued(download.id, DEFER_SECONDS)
+
+
+async def run_download(download: Downloads, listener=None) -> DownloadResponse:
+    """Run a download the scheduler has started and record its outcome"""
+    with tracer.span(
+        "download", download_id=download.id, attempt=download.retry_count + 1
+    ):
+        return await _run_download(download, listener)
+
+
+async def _run_download(download: Downloads, listener=None) -> DownloadResponse:
+    key = None
+    # Set only while this download owns `key`, waiters must not release it
+    token = None
+    try:
+        config = DownloadConfig.model_validate(download.config) if download.config else DownloadConfig()
+        if settings.get("deduplicate_downloads", True):
+            key = media_index.key(download.url, config)
+            with tracer.span("dedup.claim"):
+                entry, token = await media_index.claim(key)
+            if entry:
+                return await finish_from_index(download, entry, config)
+        # This download's share of the host and global bandwidth caps
+        host = get_host(download.url)
+        on_host, total = scheduler.load(host)
+        config.rate_limit = governor.download_rate(
+            host, on_host - 1, total - 1, config.rate_limit
+        )
+        # Cached, the download itself reuses this extraction
+        info = await downloader.get_video_info(download.url)
+        try:
+            storage.reserve(
+                download.id,
+                estimate_size(info, config),
+                Path(config.output_path),
+                needs_encoding(config),
+                downloader.partial_bytes(download.id),
+            )
+        except SpaceDeferred as e:
+            await defer_download(download, str(e))
+        # Staged per row, so a paused or interrupted run continues its .part files
+        request = DownloadRequest(url=download.url, config=downloader.resumable(config, download.id))
+        publish_status(download.id, Status.DOWNLOADING)
+        try:
+            with tracer.span("transfer", rate_limit=config.rate_limit):
+                response = await downloader.download_with_response(
+                    request, create_progress_callback(download, listener)
+                )
+        finally:
+            await progress_buffer.finish(download.id)
+        if not response.success:
+            await retry_or_fail(download, response.error or "Unknown error")
+            return response
+
+        with tracer.span("record"):
+            await download.determine_success(response)
+            if download.status == Status.FAILED:
+                await downloader.discard_partial(download.id)
+            elif key and response.filename:
+                await media_index.record(key, Path(response.filename), download.id)
+        publish_status(
+            download.id,
+            download.status,
+            filename=response.filename,
+            error=download.error,
+        )
+        if download.status == Status.FINISHED and response.video_info:
+            thumbnail_fetcher.enqueue(download.id, response.video_info.thumbnail)
+        return response
+    except DownloadRequeued:
+        raise
+    except (DownloadGotCanceledError, asyncio.CancelledError):
+        if scheduler.is_pausing(download.id):
+            downloaded_bytes = downloader.partial_bytes(download.id)
+            await download.set_paused(downloaded_bytes)
+            publish_status(
+                download.id, Status.PAUSED, downloaded_bytes=downloaded_bytes
+            )
+        else:
+            await download.set_canceled()
+            await downloader.discard_partial(download.id)
+            publish_status(download.id, Status.CANCELED)
+        raise
+    except Exception as e:
+        await retry_or_fail(download, describe_error(e))
+        raise
+    finally:
+        media_index.release(key, token)
+        storage.release(download.id)
+
+
+async def finish_from_index(
+    download: Downloads, entry: MediaEntries, config: DownloadConfig
+) -> DownloadResponse:
+    """Finish a download from an earlier identical one without fetching anything"""
+    path = await media_index.materialize(entry, Path(config.output_path))
+    source = await Downloads.get_or_none(id=entry.download_id, using_db=get_reader())
+    if source and source.metadata:
+        await download.setInfo(source.metadata)
+    await download.set_finished(path)
+    publish_status(download.id, download.status, filename=str(path), deduplicated=True)
+    if source and source.metadata:
+        thumbnail_fetcher.enqueue(download.id, source.metadata.get("thumbnail"))
+    return DownloadResponse(
+        success=True,
+        message="Already downloaded",
+        id=str(download.id),
+        filename=str(path),
+    )
+
+
+scheduler = DownloadScheduler(run_download, governor=governor, storage=storage)
+
+
+async def cancel_download(download_id: int) -> bool:
+    """Cancel through the scheduler, queued rows never reach `run_download`"""
+    if download_id in playlists:
+        return await for_playlist_items(download_id, cancel_download)
+    queued = download_id not in scheduler.active
+    canceled = await scheduler.cancel(download_id)
+    if canceled and queued:
+        await downloader.discard_partial(download_id)
+        publish_status(download_id, Status.CANCELED)
+    return canceled
+
+
+async def pause_download(download_id: int) -> bool:
+    """Pause through the scheduler, a running download keeps its partial files"""
+    if download_id in playlists:
+        return await for_playlist_items(download_id, pause_download)
+    queued = download_id not in scheduler.active
+    paused = await scheduler.pause(download_id)
+    if paused and queued:
+        publish_status(download_id, Status.PAUSED)
+    return paused
+
+
+async def resume_download(download_id: int) -> bool:
+    if download_id in playlists:
+        return await for_playlist_items(download_id, resume_download)
+    resumed = await scheduler.resume(download_id)
+    if resumed:
+        publish_status(download_id, Status.QUEUED)
+    return resumed
+
+
+async def for_playlist_items(playlist_id: int, action) -> bool:
+    """Apply a cancel, pause or resume to every unfinished item of a playlist"""
+    tracker = playlists.get(playlist_id)
+    if not tracker:
+        return False
+    results = await asyncio.gather(*(action(id) for id in tracker.pending()))
+    return any(results)
+
+
+async def queue_playlist(
+    download: Downloads,
+    config: PlaylistConfig,
+    info: PlaylistInfo,
+    entries: List[PlaylistVideoInfo],
+    record: Optional[Callable[[List[Downloads]], Awaitable[Any]]] = None,
+) -> List[Downloads]:
+    """
+    Queue `entries` as the items of a started playlist row. `record` runs
+    in the same transaction as the item rows, for writes that must not
+    outlive them.
+    """
+    metadata = {**info.model_dump(exclude={"entries"}), "total_videos": len(entries)}
+    if "concurrency" in config.model_fields_set:
+        metadata["concurrency"] = config.concurrency
+
+    async def create_items() -> List[Downloads]:
+        # Inside the writer these run inline, all of it commits as one
+        await download.setInfo(metadata)
+        items = [
+            await Downloads.create_download(
+                entry.url,
+                config.item_config,
+                parent_id=download.id,
+                metadata=entry_metadata(entry),
+            )
+            for entry in entries
+        ]
+        if record:
+            await record(items)
+        return items
+
+    items = await db_writer.run(create_items)
+    if info.thumbnail:
+        thumbnail_fetcher.enqueue(download.id, info.thumbnail)
+    # Items wait in the queue until the playlist is tracked
+    playlists.add(download.id, items)
+    scheduler.open_group(download.id, download.metadata.get("concurrency"))
+    publish_status(download.id, Status.DOWNLOADING, total_videos=len(items))
+    return items
+
+
+batches = BatchRegistry()
+subscriptions = SubscriptionSyncer(downloader, queue_playlist)
+settings = SettingsService()
+
+
 @api.get("/health", response_model=HealthResponse, tags=["Other"])
 async def health_check():
     """Check API and binary health status"""
@@ -208,6 +579,199 @@ async def search_videos(request: SearchRequest):
     return await downloader.search(request=request)
 
 
+@api.get("/cache/stats", tags=["Other"])
+async def get_cache_stats():
+    """Hit/miss counters of the metadata, search and media caches"""
+    return {
+        "info": downloader.info_cache.stats(),
+        "search": downloader.search_cache.stats(),
+        "media": media_index.stats(),
+    }
+
+
+@api.get("/pipeline/stats", tags=["Other"])
+async def get_pipeline_stats():
+    """Load of the fetch and encode stages of the download pipeline"""
+    return {
+        "fetch": {
+            "slots": scheduler.max_concurrent,
+            "running": scheduler.fetching,
+            "active": len(scheduler.active),
+        },
+        "encode": encoder.stats(),
+        "storage": storage.stats(),
+    }
+
+
+@api.post("/encoder/benchmark", status_code=202, tags=["Other"])
+async def start_encoder_benchmark(request: BenchmarkRequest):
+    """
+    Measure every codec and preset on a synthetic clip in the background.
+    Encodes running meanwhile skew the numbers, so run it while idle.
+    """
+    try:
+        encoder_benchmark.start(
+            str(downloader.ffmpeg_path), request.codecs, request.presets
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "total": encoder_benchmark.total}
+
+
+@api.get("/encoder/benchmark", tags=["Other"])
+async def get_encoder_benchmark():
+    """Progress of the running benchmark and the last measurements"""
+    return encoder_benchmark.stats()
+
+
+@api.get("/encoder/recommend", tags=["Other"])
+async def recommend_encoder_preset(
+    codec: VideoCodec = Query(..., description="Codec to pick a preset for"),
+    duration: float = Query(..., gt=0, description="Video length in seconds"),
+    height: int = Query(1080, gt=0),
+    width: Optional[int] = Query(None, gt=0, description="16:9 of height when omitted"),
+    frame_rate: float = Query(30.0, gt=0),
+    target_speed: Optional[float] = Query(
+        None, gt=0, description="Seconds of video per second of encoding"
+    ),
+    max_seconds: Optional[float] = Query(
+        None, gt=0, description="Encode time to stay within, instead of a speed"
+    ),
+):
+    """The slowest preset expected to meet the target, from the benchmark results"""
+    recommendation = encoder_benchmark.recommend(
+        str(codec),
+        duration,
+        width or round(height * 16 / 9),
+        height,
+        frame_rate,
+        target_speed,
+        max_seconds,
+    )
+    if not recommendation["candidates"]:
+        raise HTTPException(
+            status_code=404, detail=f"No benchmark results for {codec}, run one first"
+        )
+    return recommendation
+
+
+QUEUE_DEPTH = metrics.gauge(
+    "mihari_downloads", "Downloads by status", ["status", "type"]
+)
+ACTIVE_DOWNLOADS = metrics.gauge(
+    "mihari_active_downloads", "Downloads the scheduler is running"
+)
+FETCHING_DOWNLOADS = metrics.gauge(
+    "mihari_fetching_downloads", "Running downloads holding a network slot"
+)
+DOWNLOAD_SLOTS = metrics.gauge(
+    "mihari_download_slots", "Downloads the scheduler runs at once"
+)
+DOWNLOAD_SPEED = metrics.gauge(
+    "mihari_download_speed_bytes", "Current speed of each running download", ["id"]
+)
+TOTAL_SPEED = metrics.gauge(
+    "mihari_download_throughput_bytes", "Combined speed of all running downloads"
+)
+CACHE_HITS = metrics.counter("mihari_cache_hits_total", "Cache hits", ["cache"])
+CACHE_MISSES = metrics.counter("mihari_cache_misses_total", "Cache misses", ["cache"])
+CACHE_COALESCED = metrics.counter(
+    "mihari_cache_coalesced_total", "Lookups that joined a fetch in flight", ["cache"]
+)
+CACHE_ENTRIES = metrics.gauge("mihari_cache_entries", "Entries in each cache", ["cache"])
+DB_WRITE_QUEUE = metrics.gauge(
+    "mihari_db_write_queue", "Writes waiting for the database writer"
+)
+PROGRESS_SUBSCRIBERS = metrics.gauge(
+    "mihari_progress_subscribers", "WebSocket and stream clients following progress"
+)
+# yt-dlp's own merge and post-processing ffmpeg calls aren't ours to count
+FFMPEG_PROCESSES = metrics.gauge(
+    "mihari_encode_ffmpeg_processes", "Re-encode ffmpeg processes running", ["stage"]
+)
+ENCODES_WAITING = metrics.gauge(
+    "mihari_encodes_waiting", "Encodes waiting for an ffmpeg worker"
+)
+ENCODES = metrics.counter("mihari_encodes_total", "Finished encodes", ["result"])
+DISK_FREE = metrics.gauge("mihari_disk_free_bytes", "Free space on the disks in use", ["path"])
+DISK_RESERVED = metrics.gauge(
+    "mihari_disk_reserved_bytes", "Space running downloads are still going to take", ["path"]
+)
+STORAGE_REJECTIONS = metrics.counter(
+    "mihari_storage_rejections_total", "Downloads held back for disk space", ["result"]
+)
+
+
+@metrics.collector
+async def collect_metrics():
+    QUEUE_DEPTH.clear()
+    rows = (
+        await Downloads.all()
+        .using_db(get_reader())
+        .annotate(count=Count("id"))
+        .group_by("status", "download_type")
+        .values_list("status", "download_type", "count")
+    )
+    for status, download_type, count in rows:
+        QUEUE_DEPTH.set(count, status=status, type=download_type)
+
+    ACTIVE_DOWNLOADS.set(len(scheduler.active))
+    FETCHING_DOWNLOADS.set(scheduler.fetching)
+    DOWNLOAD_SLOTS.set(scheduler.max_concurrent)
+    DOWNLOAD_SPEED.clear()
+    total = 0.0
+    for id, progress in progress_buffer.latest().items():
+        speed = parse_speed(progress.speed) or 0.0
+        DOWNLOAD_SPEED.set(speed, id=id)
+        total += speed
+    TOTAL_SPEED.set(total)
+
+    for name, cache in (
+        ("info", downloader.info_cache),
+        ("search", downloader.search_cache),
+    ):
+        stats = cache.stats()
+        CACHE_HITS.set_total(stats["hits"], cache=name)
+        CACHE_MISSES.set_total(stats["misses"], cache=name)
+        CACHE_COALESCED.set_total(stats["coalesced"], cache=name)
+        CACHE_ENTRIES.set(stats["size"], cache=name)
+    thumbnails = thumbnail_store.stats()
+    CACHE_HITS.set_total(thumbnails["hits"], cache="thumbnails")
+    CACHE_MISSES.set_total(thumbnails["misses"], cache="thumbnails")
+    CACHE_ENTRIES.set(thumbnails["variants"], cache="thumbnails")
+    media = media_index.stats()
+    CACHE_HITS.set_total(media["hits"], cache="media")
+    CACHE_COALESCED.set_total(media["coalesced"], cache="media")
+
+    DB_WRITE_QUEUE.set(db_writer.queue.qsize())
+    PROGRESS_SUBSCRIBERS.set(progress_hub.subscriber_count)
+    FFMPEG_PROCESSES.set(encoder.running, stage="encode")
+    FFMPEG_PROCESSES.set(int(encoder_benchmark.running), stage="benchmark")
+    ENCODES_WAITING.set(encoder.waiting)
+    for result in ("completed", "failed", "canceled"):
+        ENCODES.set_total(getattr(encoder, result), result=result)
+    stats = storage.stats()
+    for disk in stats["disks"]:
+        DISK_FREE.set(disk["free"], path=disk["path"])
+        DISK_RESERVED.set(disk["reserved"], path=disk["path"])
+    STORAGE_REJECTIONS.set_total(stats["deferred"], result="deferred")
+    STORAGE_REJECTIONS.set_total(stats["refused"], result="refused")
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Other"])
+async def get_metrics():
+    """Server metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        await metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@api.get("/limits", tags=["Other"])
+async def get_limits():
+    """Request and bandwidth limits with the current tokens per host"""
+    return governor.stats()
+
+
 @api.post("/download", response_model=DownloadResponse, tags=["Download"])
 async def download_video(request: DownloadRequest, background_tasks: BackgroundTasks):
     """Download a single video"""
@@ -216,24 +780,8 @@ async def download_video(request: DownloadRequest, background_tasks: BackgroundT
 
     download = await Downloads.create_download(request.url, request.config)
     try:
-        await download.start_download()
-        response = await downloader.download_with_response(request)
-        await download.determine_success(response)
-        return response
+        return await scheduler.submit(download)
     except Exception as e:
-        await download.set_failed(str(e))
-        raise HTTPException(500, str(e))
-
-
-async def download_async(
-    request: DownloadRequest, progress_callback, download: Downloads
-):
-    try:
-        await download.start_download()
-        response = await downloader.download_with_response(request, progress_callback)
-        await download.determine_success(response)
-    except Exception as e:
-        await download.set_failed(str(e))
         raise HTTPException(500, str(e))
 
 
@@ -246,39 +794,222 @@ async def download_video_async(
         raise HTTPException(status_code=503, detail="Downloader not initialized")
 
     download = await Downloads.create_download(request.url, request.config)
+    scheduler.wake()
+
+    return {"id": download.id, "message": "Download queued", "status": "queued"}
+
 
-    progress_callback = create_progress_callback(download)
+@api.post("/download/{id}/pause", tags=["Download"])
+async def pause(id: int):
+    """Stop a queued or running download, keeping what was downloaded so far"""
+    download = await Downloads.get_or_none(id=id, using_db=get_reader())
+    if not download:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if not await pause_download(id):
+        raise HTTPException(
+            status_code=409, detail=f"Can't pause a {download.status} download"
+        )
+    return {"id": id, "status": Status.PAUSED}
 
-    background_tasks.add_task(download_async, request, progress_callback, download)
 
-    return {"id": download.id, "message": "Download started", "status": "processing"}
+@api.post("/download/{id}/resume", tags=["Download"])
+async def resume(id: int):
+    """Queue a paused download again, it continues from its partial files"""
+    download = await Downloads.get_or_none(id=id, using_db=get_reader())
+    if not download:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if not await resume_download(id):
+        raise HTTPException(
+            status_code=409, detail=f"Can't resume a {download.status} download"
+        )
+    return {"id": id, "status": Status.QUEUED}
 
 
 @api.get("/download/progress/{id}", tags=["Download"])
 async def get_download_progress(id: str):
     """Get progress of an async download"""
-    result = await Downloads.get_or_none(id=id)
+    result = await Downloads.get_or_none(id=id, using_db=get_reader())
     if not result:
         raise HTTPException(status_code=404, detail="Task not found")
-    return result.to_dict()
+    data = result.to_dict()
+    progress = progress_buffer.get(result.id)
+    tracker = playlists.get(result.id)
+    if tracker:
+        data.update(tracker.summary())
+    elif progress:
+        data.update(progress_fields(progress))
+    else:
+        data.update(
+            downloaded_bytes=result.downloaded_bytes,
+            total_bytes=result.total_bytes,
+            percentage=result.percentage,
+            speed=result.speed,
+            eta=result.eta,
+        )
+    return data
+
+
+@api.get("/download/{id}/trace", tags=["Download"])
+async def get_download_trace(id: int):
+    """Timeline of the stages a download went through, as long as its spans are buffered"""
+    spans = tracer.timeline(id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="No trace for this download")
+    totals: dict[str, float] = {}
+    for span in spans:
+        if span["duration"] is not None:
+            totals[span["name"]] = round(totals.get(span["name"], 0.0) + span["duration"], 6)
+    return {"id": id, "spans": spans, "totals": totals}
+
+
+@api.get("/trace", tags=["Other"])
+async def get_trace(
+    id: Optional[list[int]] = Query(None, description="Downloads to include, all when omitted"),
+):
+    """Buffered spans in the Chrome trace format, for chrome://tracing or Perfetto"""
+    return tracer.chrome_trace(id)
+
+
+@api.post("/trace/export", tags=["Other"])
+async def export_trace(
+    id: Optional[list[int]] = Query(None, description="Downloads to include, all when omitted"),
+):
+    """Write the buffered spans to a Chrome trace file in the data folder"""
+    path = get_data_path() / "traces" / f"trace-{datetime.now():%Y%m%d-%H%M%S}.json"
+    await asyncio.to_thread(tracer.export, path, id)
+    return {"path": str(path.resolve())}
 
 
-@api.post("/download/playlist", response_model=PlaylistResponse, tags=["Download"])
+@api.post("/download/playlist", tags=["Download"])
 async def download_playlist(request: PlaylistRequest):
-    """Download an entire playlist"""
+    """
+    Queue every video of a playlist as its own download. Items run
+    concurrently under the scheduler's limits (and `concurrency`, when
+    given), the playlist row tracks their aggregate progress.
+    """
     if not downloader:
         raise HTTPException(status_code=503, detail="Downloader not initialized")
 
-    download = await Downloads.create_download(request.url, request.playlist_config, type=DownloadType.PLAYLIST)
+    playlist_config = request.playlist_config or PlaylistConfig()
+    download = await Downloads.create_download(
+        request.url, playlist_config, download_type=DownloadType.PLAYLIST
+    )
+    # Playlists never enter the scheduler's queue, this only marks it started
+    await download.start_download()
     try:
-        await download.start_download()
-        response = await downloader.download_playlist(request=request)
-        await download.determine_success(response)
-        return response
+        info = await downloader.get_playlist_info(
+            request.url, max_videos=playlist_config.max_videos or None
+        )
+        entries = select_entries(info, playlist_config)
+        if not entries:
+            raise ValueError("Playlist has no videos in the selected range")
     except Exception as e:
-        await download.set_failed(str(e))
+        await download.set_failed(describe_error(e))
         raise HTTPException(500, str(e))
 
+    items = await queue_playlist(download, playlist_config, info, entries)
+
+    return {
+        "id": download.id,
+        "title": info.title,
+        "total_videos": len(items),
+        "ids": [item.id for item in items],
+        "status": Status.DOWNLOADING,
+    }
+
+
+@api.get("/download/playlist/{id}", tags=["Download"])
+async def get_playlist(id: int):
+    """A playlist with its aggregate progress and the status of every item"""
+    download = await Downloads.get_or_none(
+        id=id, download_type=DownloadType.PLAYLIST, using_db=get_reader()
+    )
+    if not download:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    items = (
+        await Downloads.filter(parent_id=id).using_db(get_reader()).order_by("id")
+    )
+    tracker = playlists.get(id)
+    return {
+        **download.to_dict(),
+        **(tracker.summary() if tracker else {}),
+        "items": [
+            {
+                "id": item.id,
+                "url": item.url,
+                "title": item.metadata.get("title"),
+                "status": item.status,
+                "percentage": item.percentage,
+                "filename": item.filename,
+                "error": item.error,
+            }
+            for item in items
+        ],
+    }
+
+
+@api.post("/subscriptions", tags=["Subscriptions"])
+async def create_subscription(request: SubscriptionRequest):
+    """Follow a playlist or channel, its new videos are downloaded on every sync"""
+    if not downloader:
+        raise HTTPException(status_code=503, detail="Downloader not initialized")
+
+    playlist_config = request.playlist_config or PlaylistConfig()
+    subscription = await db_writer.run(
+        lambda: Subscriptions.create(
+            url=request.url,
+            # Unset fields stay unset, `concurrency` only applies when given
+            config=playlist_config.model_dump(exclude_unset=True),
+            interval=request.interval,
+        )
+    )
+    try:
+        result = await subscriptions.sync(
+            subscription, download=request.download_existing
+        )
+    except Exception as e:
+        await subscriptions.forget(subscription.id)
+        raise HTTPException(500, str(e))
+    return {**subscription.to_dict(), **result}
+
+
+@api.get("/subscriptions", tags=["Subscriptions"])
+async def get_subscriptions():
+    """Every subscription with the number of entries it has seen"""
+    items = await Subscriptions.all().using_db(get_reader()).order_by("id")
+    counts = dict(
+        await SubscriptionEntries.all()
+        .using_db(get_reader())
+        .annotate(count=Count("id"))
+        .group_by("subscription_id")
+        .values_list("subscription_id", "count")
+    )
+    return [
+        {**subscription.to_dict(), "entries": counts.get(subscription.id, 0)}
+        for subscription in items
+    ]
+
+
+@api.post("/subscriptions/{id}/sync", tags=["Subscriptions"])
+async def sync_subscription(id: int):
+    """Queue the videos added to a subscription since its last sync"""
+    subscription = await Subscriptions.get_or_none(id=id, using_db=get_reader())
+    if not subscription:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    try:
+        return await subscriptions.sync(subscription)
+    except Exception as e:
+        raise HTTPException(500, str(e))
+
+
+@api.delete("/subscriptions/{id}", tags=["Subscriptions"])
+async def delete_subscription(id: int):
+    """Stop following a subscription, its downloads are kept"""
+    if not await Subscriptions.exists(id=id):
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    await subscriptions.forget(id)
+    return {"id": id, "status": "deleted"}
+
 
 @api.get("/formats", tags=["Info"])
 async def get_supported_formats():
@@ -318,21 +1049,246 @@ async def batch_download(
 
     batch_id = str(uuid.uuid4())
 
-    results = []
-    for url in request.urls:
+    async def queue_item(url: str):
+        download = await Downloads.create_download(url, request.config, batch_id=batch_id)
+        # Before anything else awaits, the scheduler may pick the row up already
+        return download, scheduler.submit(download)
+
+    # Created concurrently so the DB writer commits them as one transaction
+    items = await asyncio.gather(*(queue_item(url) for url in request.urls))
+    downloads = [download for download, _ in items]
+
+    # Items run concurrently under the scheduler's global and per-host limits
+    tracker = batches.create(batch_id, downloads)
+    for download, future in items:
+        tracker.watch(download, future)
+
+    return {
+        "batch_id": batch_id,
+        "total_urls": len(request.urls),
+        "ids": [download.id for download in downloads],
+        # An empty batch is over already and can't be followed
+        "status": "finished" if tracker.done else "queued",
+    }
+
+
+@api.get("/download/batch/{batch_id}", tags=["Download"])
+async def get_batch(batch_id: str):
+    """Current status of every item in a batch"""
+    downloads = (
+        await Downloads.filter(batch_id=batch_id).using_db(get_reader()).order_by("id")
+    )
+    if not downloads:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {
+        "batch_id": batch_id,
+        "total_urls": len(downloads),
+        "items": [
+            {
+                "id": download.id,
+                "url": download.url,
+                "status": download.status,
+                "filename": download.filename,
+                "error": download.error,
+            }
+            for download in downloads
+        ],
+    }
+
+
+@api.get("/download/batch/{batch_id}/events", tags=["Download"])
+async def stream_batch(batch_id: str):
+    """Stream per-item results of a batch as NDJSON until every item is done"""
+    tracker = batches.get(batch_id)
+    if not tracker:
+        raise HTTPException(status_code=404, detail="Batch not found or expired")
+
+    async def events():
+        async for event in tracker.stream():
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@api.get("/download/events", tags=["Download"])
+async def stream_progress(
+    id: Optional[list[int]] = Query(None, description="Downloads to follow, all when omitted"),
+    interval: Optional[float] = Query(None, gt=0, description="Seconds between updates"),
+):
+    """Server-sent events with the throttled progress and status of downloads"""
+    subscription = progress_hub.subscribe(download_ids=id, interval=interval)
+
+    async def events():
         try:
-            download_request = DownloadRequest(url=url, config=request.config)
-            result = await downloader.download_with_response(download_request)
-            results.append({"url": url, "result": result.model_dump()})
-        except Exception as e:
-            results.append({"url": url, "error": str(e)})
+            while True:
+                try:
+                    batch = await asyncio.wait_for(
+                        subscription.get(), timeout=HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                for event in batch:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            subscription.close()
 
-    return {"batch_id": batch_id, "total_urls": len(request.urls), "results": results}
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@api.websocket("/ws/progress")
+async def websocket_progress(websocket: WebSocket):
+    """
+    Progress and status of any download. Follows the `id` query parameters
+    (all downloads when there are none), more can be (un)followed with
+    {"type": "subscribe" | "unsubscribe", "download_id": ...} messages.
+    """
+    await websocket.accept()
+    ids = websocket.query_params.getlist("id")
+    interval = websocket.query_params.get("interval")
+    try:
+        subscription = progress_hub.subscribe(
+            download_ids=[int(i) for i in ids] if ids else None,
+            interval=float(interval) if interval else None,
+        )
+    except ValueError:
+        await websocket.close(code=1008, reason="Invalid id or interval")
+        return
+
+    async def forward():
+        async for events in subscription:
+            for event in events:
+                await websocket.send_json(event)
+
+    async def receive():
+        while True:
+            try:
+                data = await websocket.receive_json()
+            except WebSocketDisconnect:
+                return
+            if data.get("type") == "subscribe":
+                subscription.follow(data.get("download_id"))
+            elif data.get("type") == "unsubscribe":
+                subscription.unfollow(data.get("download_id"))
+
+    tasks = [asyncio.create_task(forward()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    except Exception as e:
+        logger.warning(f"WebSocket error: {e}")
+    finally:
+        subscription.close()
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
 
 @api.get("/history", tags=["Other"])
-async def get_history():
-    return await Downloads.get_user_downloads(as_model=True)
+async def get_history(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[Status] = None,
+    download_type: Optional[DownloadType] = Query(None, alias="type"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Optional[str] = Query(
+        None, description="Comma separated columns to return, e.g. id,url,status"
+    ),
+):
+    """
+    Download history, newest first. Pass `limit` to page through it, the cursor
+    of the next page is returned in the `X-Next-Cursor` header.
+    """
+    try:
+        page, next_cursor = await Downloads.get_history_page(
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            download_type=download_type,
+            since=since,
+            until=until,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return page
+
+
+# VARIANTS of the store and the original
+ThumbnailSize = Literal["list", "card", "original"]
+
+
+async def thumbnail_response(
+    request: Request, digest: str, size: str, cache_control: str
+) -> Response:
+    etag = f'"{digest}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    try:
+        data, media_type = await thumbnail_store.get(digest, size)
+    except FileNotFoundError:
+        raise HTTPException(404, detail="Thumbnail not found")
+    return Response(data, media_type=media_type, headers=headers)
+
+
+@api.get("/thumbnails/{digest}", tags=["Other"])
+async def get_thumbnail(request: Request, digest: str, size: ThumbnailSize = "card"):
+    """A stored thumbnail by content hash, which never changes, so clients keep it for good"""
+    return await thumbnail_response(
+        request, digest, size, "public, max-age=31536000, immutable"
+    )
+
+
+@api.get("/download/{id}/thumbnail", tags=["Download"])
+async def get_download_thumbnail(request: Request, id: int, size: ThumbnailSize = "card"):
+    """
+    A download's thumbnail, downscaled to WebP for `list` and `card`. Cached
+    for an hour, then revalidated against its ETag.
+    """
+    download = await Downloads.get_or_none(id=id, using_db=get_reader())
+    digest = await thumbnail_store.adopt(download) if download else None
+    if not digest:
+        raise HTTPException(404, detail="Thumbnail not found")
+    return await thumbnail_response(request, digest, size, "private, max-age=3600")
+
+
+@api.get("/history/search", tags=["Other"])
+async def search_history_endpoint(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    fields: Optional[str] = Query(
+        None, description="Comma separated columns to return, e.g. id,url,status"
+    ),
+):
+    """Full-text search of past downloads by title, uploader, description, URL and filename"""
+    try:
+        results, has_more = await search_history(
+            q,
+            limit=limit,
+            offset=offset,
+            fields=[f.strip() for f in fields.split(",") if f.strip()] if fields else None,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "query": q,
+        "results": results,
+        "next_offset": offset + limit if has_more else None,
+    }
 
 
 @api.delete("/history/{id}", tags=["Other"])
@@ -340,7 +1296,12 @@ async def delete_history(id: int):
     item = await Downloads.get_or_none(id=id)
     if not item:
         raise HTTPException(404, detail="History Item not found")
+    if id in playlists:
+        # Its items would otherwise wait for a playlist that is gone
+        await cancel_download(id)
     await item.delete()
+    await thumbnail_store.release(item.thumbnail_path)
+    await downloader.discard_partial(id)
 
 
 @api.websocket("/ws/download")
@@ -353,6 +1314,10 @@ async def websocket_download(websocket: WebSocket):
 
     # Track multiple downloads by ID
     active_downloads = {}  # Dict[str, asyncio.Task]
+    download_rows = {}  # Dict[str, int], socket download ID -> Downloads.id
+    socket_ids = {}  # Dict[int, str], Downloads.id -> socket download ID
+    # Progress of this socket's downloads plus whatever it subscribes to
+    subscription = progress_hub.subscribe(download_ids=())
     last_activity = asyncio.get_event_loop().time()
 
     async def send_heartbeat():
@@ -374,10 +1339,35 @@ async def websocket_download(websocket: WebSocket):
                 if data.get("type", "") == "pong":
                     # Handle pong responses
                     continue
+                elif data.get("type", "") == "subscribe":
+                    # Follow another download, or all of them without an id
+                    subscription.follow(data.get("download_id"))
+                    continue
+                elif data.get("type", "") == "unsubscribe":
+                    subscription.unfollow(data.get("download_id"))
+                    continue
+                elif data.get("type", "") in ("pause", "resume"):
+                    download_id = data.get("id")
+                    action = pause_download if data["type"] == "pause" else resume_download
+                    if download_id in download_rows and await action(
+                        download_rows[download_id]
+                    ):
+                        await websocket.send_json({
+                            "type": "paused" if data["type"] == "pause" else "resumed",
+                            "id": download_id,
+                        })
+                    else:
+                        await websocket.send_json({
+                            "type": "error",
+                            "id": download_id,
+                            "data": {"error": f"Download can't be {data['type']}d"}
+                        })
                 elif data.get("type", "") == "cancel":
                     download_id = data.get("id")
                     if download_id and download_id in active_downloads:
                         task = active_downloads.pop(download_id)  # remove it first
+                        if download_id in download_rows:
+                            await cancel_download(download_rows[download_id])
                         task.cancel()                              # cancel the wrapper task
                         try:
                             await task
@@ -425,42 +1415,28 @@ async def websocket_download(websocket: WebSocket):
 
         if not request.config:
             request.config = DownloadConfig()
+
+        # Handle format configuration
+        if request.config and request.config.video_format:
+            request.config.video_format = VideoFormat(request.config.video_format)
+        if request.config and request.config.audio_format:
+            request.config.audio_format = AudioFormat(request.config.audio_format)
+
+        if request.config.encoding and request.config.encoding.video and request.config.encoding.video.codec == None:
+            request.config.encoding.video.preset = None
+
         download = await Downloads.create_download(request.url, request.config)
+        # Before anything else awaits, the scheduler may pick the row up already
+        inner_download_task = scheduler.submit(download)
+        download_rows[download_id] = download.id
+        socket_ids[download.id] = download_id
+        subscription.follow(download.id)
         try:
             last_activity = asyncio.get_event_loop().time()
             await websocket.send_json({"type": "info_id", "id": download_id})
 
-            async def ws_progress_callback(progress: DownloadProgress):
-                nonlocal last_activity
-                try:
-                    # Ensure progress includes the download ID
-                    progress_data = progress.model_dump()
-                    progress_data["id"] = download_id
-
-                    await websocket.send_json(
-                        {"type": "progress", "id": download_id, "data": progress_data}
-                    )
-                    last_activity = asyncio.get_event_loop().time()
-                except Exception as e:
-                    logger.warning(f"Failed to send progress for {download_id}: {e}")
-
-            # Handle format configuration
-            if request.config and request.config.video_format:
-                request.config.video_format = VideoFormat(request.config.video_format)
-            if request.config and request.config.audio_format:
-                request.config.audio_format = AudioFormat(request.config.audio_format)
-
-            if request.config.encoding and request.config.encoding.video and request.config.encoding.video.codec == None:
-                request.config.encoding.video.preset = None
-                
-            
-            await download.start_download()
-
-            # Run video info retrieval and download concurrently
+            # Fetch video info while the download waits for a slot
             info_task = asyncio.create_task(downloader.get_video_info(request.url))
-            inner_download_task = asyncio.create_task(
-                downloader.download(request, ws_progress_callback, finalize=True)
-            )
 
             # Wait for video info first and send it immediately when available
             try:
@@ -475,17 +1451,7 @@ async def websocket_download(websocket: WebSocket):
                 data = None
 
             # Wait for download to complete
-            file = await inner_download_task
-
-            result = DownloadResponse(
-                success=True,
-                message="Download completed successfully",
-                filename=str(file.absolute()),
-                video_info=data,
-                id=download_id,
-            )
-
-            await download.determine_success(result)
+            result = await inner_download_task
 
             # Ensure result includes the download ID
             result_data = result.model_dump()
@@ -504,7 +1470,6 @@ async def websocket_download(websocket: WebSocket):
 
         except DownloadGotCanceledError:
             # Handle cancellation gracefully
-            await download.set_canceled()
             await websocket.send_json(
                 {
                     "type": "cancelled",
@@ -515,7 +1480,6 @@ async def websocket_download(websocket: WebSocket):
             # raise  # Re-raise to properly handle cancellation
         except Exception as e:
             console.print_exception()
-            await download.set_failed(str(e))
             await websocket.send_json(
                 {"type": "error", "id": download_id, "data": {"error": str(e)}}
             )
@@ -524,6 +1488,29 @@ async def websocket_download(websocket: WebSocket):
         finally:
             # Clean up this download from active downloads
             active_downloads.pop(download_id, None)
+            download_rows.pop(download_id, None)
+            socket_ids.pop(download.id, None)
+            subscription.unfollow(download.id)
+
+    async def forward_progress():
+        """Send the throttled hub events this socket follows"""
+        nonlocal last_activity
+        async for events in subscription:
+            for event in events:
+                if not subscription.wants(event["download_id"]):
+                    continue
+                download_id = socket_ids.get(event["download_id"])
+                if download_id is None:
+                    # A download followed through "subscribe"
+                    await websocket.send_json(event)
+                elif event["type"] == "progress":
+                    # Own downloads keep the socket ID, their outcome is
+                    # sent by process_download
+                    progress_data = {**event["data"], "id": download_id}
+                    await websocket.send_json(
+                        {"type": "progress", "id": download_id, "data": progress_data}
+                    )
+            last_activity = asyncio.get_event_loop().time()
 
     async def handle_idle_timeout():
         """Monitor for idle timeout and close connection if inactive"""
@@ -569,10 +1556,11 @@ async def websocket_download(websocket: WebSocket):
     message_task = asyncio.create_task(handle_messages())
     timeout_task = asyncio.create_task(handle_idle_timeout())
     cleanup_task = asyncio.create_task(cleanup_completed_downloads())
+    progress_task = asyncio.create_task(forward_progress())
 
     try:
         done, pending = await asyncio.wait(
-            [heartbeat_task, message_task, timeout_task, cleanup_task],
+            [heartbeat_task, message_task, timeout_task, cleanup_task, progress_task],
             return_when=asyncio.FIRST_COMPLETED,
         )
 
@@ -586,7 +1574,8 @@ async def websocket_download(websocket: WebSocket):
     except Exception as e:
         logger.warning(f"WebSocket error: {e}")
     finally:
-        # Cancel all active downloads
+        subscription.close()
+        # Stop following active downloads, the scheduler keeps running them
         for download_task in active_downloads.values():
             if not download_task.done():
                 download_task.cancel()
@@ -596,7 +1585,7 @@ async def websocket_download(websocket: WebSocket):
                     pass
 
         # Cancel all background tasks
-        for task in [heartbeat_task, message_task, timeout_task, cleanup_task]:
+        for task in [heartbeat_task, message_task, timeout_task, cleanup_task, progress_task]:
             if not task.done():
                 task.cancel()
                 try:
@@ -689,9 +1678,36 @@ async def websocket_startup(websocket: WebSocket):
 
 @api.post("/setting", tags=["settings"])
 async def save_setting(request: SaveSettings):
+    value = request.value
     try:
-        user, _ = await Users.get_or_create(id=1)
-        await user.set_setting(request.key, request.value)
+        if request.key == "max_concurrent_downloads":
+            scheduler.configure(max_concurrent=request.value)
+        elif request.key == "max_concurrent_per_host":
+            scheduler.configure(max_per_host=request.value)
+        elif request.key == "max_concurrent_encodes":
+            encoder.configure(workers=request.value)
+        elif request.key == "encode_target_speed":
+            if value is not None:
+                value = float(value)
+                if not value > 0:
+                    raise ValueError("encode_target_speed must be positive")
+            encoder_benchmark.target_speed = value
+        elif request.key == "scratch_path":
+            configure_storage(request.value, None)
+        elif request.key == "storage_min_free":
+            if parse_rate(request.value) < 0:
+                raise ValueError("storage_min_free can't be negative")
+            storage.configure(min_free=int(parse_rate(request.value)))
+        elif request.key == "thumbnail_cache_size":
+            thumbnail_store.configure(int(parse_rate(request.value)))
+        elif request.key == "progress_interval":
+            if value is not None:
+                value = float(value)
+            progress_hub.configure(value)
+        elif request.key in GOVERNOR_SETTINGS:
+            governor.configure(**{GOVERNOR_SETTINGS[request.key]: request.value})
+        # Stored once the value was accepted
+        settings.set(request.key, value)
         return {"status": "success"}
     except Exception as e:
         logger.error(e)
@@ -701,8 +1717,7 @@ async def save_setting(request: SaveSettings):
 @api.get("/setting", tags=["settings"])
 async def get_setting(request: GetSettings):
     try:
-        user, _ = await Users.get_or_create(id=1)
-        value = user.get_setting(request.key, request.default)
+        value = settings.get(request.key, request.default)
         return {"status": "success", "value": value}
     except Exception as e:
         logger.error(e)
@@ -712,8 +1727,7 @@ async def get_setting(request: GetSettings):
 @api.get("/settings", tags=["settings"])
 async def get_settings():
     try:
-        user, _ = await Users.get_or_create(id=1)
-        return {"status": "success", "value": user.settings}
+        return {"status": "success", "value": settings.all()}
     except Exception as e:
         logger.error(e)
         return {"status": "failed", "error": str(e)}
@@ -722,26 +1736,16 @@ async def get_settings():
 @api.post("/preset", tags=["presets"])
 async def save_preset(request: Preset):
     try:
-        user, _ = await Users.get_or_create(id=1)
-        presets: list = user.get_setting("presets", [])
-        if not request.uuid:
-            presets.append(
-                {
-                    "uuid": str(uuid.uuid4()),
-                    "name": request.name,
-                    "description": request.description,
-                    "config": request.config,
-                }
-            )
-            await user.set_setting("presets", presets)
-        else:
-            preset = next((p for p in presets if p["uuid"] == request.uuid), None)
-            if not preset:
-                raise HTTPException(404, detail="Preset not found")
-            preset["name"] = request.name
-            preset["description"] = request.description
-            preset["config"] = request.config
-            await user.set_setting("presets", presets)
+        if request.uuid and not settings.get_preset(request.uuid):
+            raise HTTPException(404, detail="Preset not found")
+        settings.put_preset(
+            {
+                "uuid": request.uuid or str(uuid.uuid4()),
+                "name": request.name,
+                "description": request.description,
+                "config": request.config,
+            }
+        )
 
         return {"status": "success"}
     except HTTPException:
@@ -754,8 +1758,7 @@ async def save_preset(request: Preset):
 @api.get("/presets", tags=["presets"])
 async def get_presets():
     try:
-        user, _ = await Users.get_or_create(id=1)
-        return user.get_setting("presets", [])
+        return settings.list_presets()
     except Exception as e:
         logger.error(e)
         return {"status": "failed", "error": str(e)}
@@ -764,12 +1767,8 @@ async def get_presets():
 @api.delete("/presets/{uuid}", tags=["presets"])
 async def delete_preset(uuid: str):
     try:
-        user, _ = await Users.get_or_create(id=1)
-        presets: list = user.get_setting("presets", [])
-        new_presets = [p for p in presets if p["uuid"] != uuid]
-        if len(new_presets) == len(presets):
+        if not settings.delete_preset(uuid):
             raise HTTPException(404, detail="Preset not found")
-        await user.set_setting("presets", new_presets)
         return {"status": "success"}
     except HTTPException:
         raise
@@ -783,9 +1782,7 @@ async def export_preset(payload: PresetExport):
     uuid_ = payload.uuid
     path = payload.path
     try:
-        user, _ = await Users.get_or_create(id=1)
-        presets = user.get_setting("presets", [])
-        preset = next((p for p in presets if p["uuid"] == uuid_), None)
+        preset = settings.get_preset(uuid_)
         if not preset:
             raise HTTPException(404, "Preset not found")
 
@@ -820,36 +1817,23 @@ async def import_preset(payload: PresetPath):
             if not required_keys.issubset(preset.keys()):
                 raise HTTPException(400, "Preset missing required fields")
 
-        user, _ = await Users.get_or_create(id=1)
-        presets = user.get_setting("presets", [])
-
         if isinstance(data, dict):
             # Single preset import
             validate_preset(data)
-            existing = next((p for p in presets if p["uuid"] == data["uuid"]), None)
-            if existing:
-                existing.update(data)
-            else:
-                presets.append(data)
+            settings.put_preset(data)
             msg = f"{data["name"]} Preset imported"
         elif isinstance(data, list):
             # Multiple presets import
             for preset in data:
                 validate_preset(preset)
-                existing = next(
-                    (p for p in presets if p["uuid"] == preset["uuid"]), None
-                )
-                if existing:
-                    existing.update(preset)
-                else:
-                    presets.append(preset)
+            for preset in data:
+                settings.put_preset(preset)
             msg = f"{len(data)} Presets imported"
         else:
             raise HTTPException(
                 400, "File data must be a preset object or list of presets"
             )
 
-        await user.set_setting("presets", presets)
         return {"status": "success", "message": msg}
     except HTTPException:
         raise
@@ -863,9 +1847,7 @@ async def export_all_presets(payload: PresetPath):
     path = payload.path
 
     try:
-        user, _ = await Users.get_or_create(id=1)
-        presets = user.get_setting("presets", [])
-        encoded = encode_presets_to_base64(presets)
+        encoded = encode_presets_to_base64(settings.list_presets())
         os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, "w", encoding="utf-8") as f:
             f.write(encoded)
@@ -0,0 +1,46 @@
+import asyncio
+
+from libs.batches import BatchRegistry
+
+
+class Row:
+    def __init__(self, id: int, url: str):
+        self.id = id
+        self.url = url
+
+
+async def collect(tracker):
+    return [event async for event in tracker.stream()]
+
+
+def test_empty_batch_is_done_and_not_kept():
+    async def main():
+        registry = BatchRegistry()
+        tracker = registry.create("empty", [])
+        assert tracker.done
+        assert registry.get("empty") is None
+        events = await asyncio.wait_for(collect(tracker), 1)
+        assert [event["type"] for event in events] == ["batch", "done"]
+        assert events[-1]["total"] == 0
+
+    asyncio.run(main())
+
+
+def test_batch_is_done_after_its_items_and_evicted():
+    async def main():
+        registry = BatchRegistry(keep_for=0)
+        rows = [Row(1, "https://example.com/a"), Row(2, "https://example.com/b")]
+        tracker = registry.create("batch", rows)  # type: ignore[arg-type]
+        assert registry.get("batch") is tracker
+        futures = [asyncio.get_running_loop().create_future() for _ in rows]
+        for row, future in zip(rows, futures):
+            tracker.watch(row, future)  # type: ignore[arg-type]
+        stream = asyncio.create_task(collect(tracker))
+        for future in futures:
+            future.set_exception(RuntimeError("gone"))
+        events = await asyncio.wait_for(stream, 1)
+        assert [event["type"] for event in events] == ["batch", "item", "item", "done"]
+        await asyncio.sleep(0)
+        assert registry.get("batch") is None
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import asyncio
+
+from libs.dedup import MediaIndex
+
+KEY = ("example.com/watch?v=1", "hash")
+
+
+def make_index() -> MediaIndex:
+    index = MediaIndex()
+
+    async def lookup(key):
+        return None
+
+    index._lookup = lookup  # type: ignore[method-assign]
+    return index
+
+
+def test_canceled_waiter_keeps_the_owner_claim():
+    async def main():
+        index = make_index()
+        entry, token = await index.claim(KEY)
+        assert entry is None and token is not None
+
+        waiter = asyncio.create_task(index.claim(KEY))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        # What _run_download's finally does for a canceled waiter
+        index.release(KEY, None)
+
+        third = asyncio.create_task(index.claim(KEY))
+        await asyncio.sleep(0.01)
+        assert not third.done()
+
+        index.release(KEY, token)
+        entry, third_token = await asyncio.wait_for(third, 1)
+        assert entry is None and third_token is not None
+        index.release(KEY, third_token)
+        assert not index._inflight
+
+    asyncio.run(main())
+
+
+def test_stale_token_does_not_release_a_new_owner():
+    async def main():
+        index = make_index()
+        _, first = await index.claim(KEY)
+        index.release(KEY, first)
+        _, second = await index.claim(KEY)
+        index.release(KEY, first)
+        assert index._inflight[KEY] is second
+        index.release(KEY, second)
+
+    asyncio.run(main())